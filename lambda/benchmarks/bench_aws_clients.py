@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+# Measures the latency of sending an email on a warm Lambda container, with a
+# new boto3 client per call (the old behaviour) versus the shared client from
+# the aws registry. SES is stubbed out with botocore's Stubber, so this times
+# client construction and request building only, never the network.
+
+import argparse
+import os
+
+from botocore.stub import Stubber
+
+import util
+
+import aws
+import mail
+
+# Fake credentials so that boto3 can build clients without an AWS account
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+RESPONSE = {'MessageId': 'fake-message-id'}
+
+
+def send(stubber):
+    stubber.add_response('send_email', RESPONSE)
+    mail.send_ses_email("gwb@example.com", "You're checked in!", "body", source="bot@example.com")
+
+
+def fresh_client():
+    aws.reset()
+    with Stubber(aws.client('ses')) as stubber:
+        send(stubber)
+
+
+def main(args):
+    fresh = [util.timed(fresh_client)[0] for _ in range(args.iterations)]
+    print(util.summarize("send_ses_email (new client)", fresh))
+
+    aws.reset()
+    with Stubber(aws.client('ses')) as stubber:
+        shared = [util.timed(send, stubber)[0] for _ in range(args.iterations)]
+    print(util.summarize("send_ses_email (shared client)", shared))
+
+    saved = util.percentile(fresh, 50) - util.percentile(shared, 50)
+    print("p50 saved per warm invocation: {:.3f}ms".format(saved * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=100)
+    args = parser.parse_args()
+    main(args)
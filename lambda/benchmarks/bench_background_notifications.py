@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+# Measures the wall time of the schedule check-in handler when the SES client
+# is created and the confirmation email sent after the reservation lookup (the
+# old behaviour), versus with the client warmed up in the background during
+# the lookup.
+#
+# Southwest is the local stand-in with a fixed response latency. SES clients
+# are built by boto3 for real, so that importing boto3 and creating a client
+# are included, but calls go to a stand-in with a fixed latency instead of
+# the network. By default each invocation runs in a fresh interpreter, like a
+# cold Lambda container; pass --warm to reuse one process and client.
+
+import argparse
+import os
+import subprocess
+import sys
+
+import mock
+
+import util
+
+import aws
+import cache
+import fake_aws
+import mail
+import metrics
+import swa
+from fake_southwest import FakeSouthwestServer
+from handlers.schedule_check_in import main as schedule_check_in
+
+# Fake credentials so that boto3 can build clients without an AWS account
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+EVENT = {
+    'first_name': 'George',
+    'last_name': 'Bush',
+    'confirmation_number': 'ABC123',
+    'email': 'gwb@example.com'
+}
+
+
+def blocking(event):
+    reservation = swa.Reservation.from_passenger_info(
+        event['first_name'], event['last_name'], event['confirmation_number'],
+        cache=cache.get_reservation_cache()
+    )
+    mail.send_confirmation(event['email'], reservation=reservation)
+    return reservation.check_in_times
+
+
+def background(event):
+    return schedule_check_in(dict(event), None)
+
+
+MODES = {"blocking": blocking, "background": background}
+
+
+def invoke(mode, iterations, ses_latency):
+    """
+    Runs the handler `iterations` times in this process and returns the
+    elapsed time of each
+    """
+    real_client = aws.client
+    ses = fake_aws.FakeSESClient(latency=ses_latency)
+
+    def client(service):
+        # Imports boto3 and builds the real client on first use
+        real_client(service)
+        return ses
+
+    samples = []
+    with mock.patch('aws.client', side_effect=client):
+        for _ in range(iterations):
+            # Every invocation looks up the reservation
+            cache._reservation_cache = None
+            samples.append(util.timed(MODES[mode], EVENT)[0])
+
+    return samples
+
+
+def run(name, mode, args):
+    with FakeSouthwestServer(latency=args.latency / 1000.0) as server:
+        if args.warm:
+            swa.API_URL = server.url
+            swa.reset_session()
+            samples = invoke(mode, args.iterations, args.ses_latency / 1000.0)
+        else:
+            command = [
+                sys.executable, __file__, '--invoke', mode,
+                '--ses-latency', str(args.ses_latency)
+            ]
+            env = dict(os.environ, SWA_API_URL=server.url)
+            samples = [
+                float(subprocess.check_output(command, env=env, stderr=subprocess.DEVNULL))
+                for _ in range(args.iterations)
+            ]
+
+    print(util.summarize(name, samples))
+    return util.percentile(samples, 50)
+
+
+def main(args):
+    metrics.sink = lambda line: None
+
+    if args.invoke:
+        assert 'boto3' not in sys.modules
+        print(invoke(args.invoke, 1, args.ses_latency / 1000.0)[0])
+        return
+
+    blocking_p50 = run("confirmation after lookup", "blocking", args)
+    background_p50 = run("SES warmed up during lookup", "background", args)
+    print("saved at p50: {:.1f}ms ({:.0%})".format(
+        (blocking_p50 - background_p50) * 1000, 1 - background_p50 / blocking_p50))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=50, help="Southwest response latency in milliseconds")
+    parser.add_argument('--ses-latency', type=float, default=40, help="SES response latency in milliseconds")
+    parser.add_argument('--warm', action='store_true', help="Reuse one process and SES client for every invocation")
+    parser.add_argument('--invoke', choices=sorted(MODES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    main(args)
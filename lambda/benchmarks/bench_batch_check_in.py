@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+# Measures check-in throughput for a batch of reservations which all become
+# eligible in the same second: one at a time through swa.check_in, versus
+# concurrently through swa_async.check_in_all. The local Southwest stand-in
+# adds a fixed latency to every response to approximate the real API.
+
+import argparse
+
+import util
+
+import swa
+import swa_async
+from fake_southwest import FakeSouthwestServer
+
+
+def sequential(check_ins, concurrency):
+    return [swa.check_in(**c) for c in check_ins]
+
+
+def concurrent(check_ins, concurrency):
+    return swa_async.run(swa_async.check_in_all(check_ins, concurrency=concurrency))
+
+
+def run(name, fn, args):
+    check_ins = [
+        dict(first_name="George", last_name="Bush", confirmation_number="ABC123")
+        for _ in range(args.reservations)
+    ]
+
+    with FakeSouthwestServer(latency=args.latency / 1000.0) as server:
+        swa.API_URL = server.url
+        swa.reset_session()
+        elapsed, _ = util.timed(fn, check_ins, args.concurrency)
+
+    print("{:<28} reservations={} elapsed={:.3f}s throughput={:.1f}/s".format(
+        name, args.reservations, elapsed, args.reservations / elapsed))
+    return elapsed
+
+
+def main(args):
+    sequential_elapsed = run("sequential", sequential, args)
+    concurrent_elapsed = run("concurrent (limit={})".format(args.concurrency), concurrent, args)
+    print("speedup: {:.1f}x".format(sequential_elapsed / concurrent_elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reservations', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=swa_async.MAX_CONCURRENCY)
+    parser.add_argument('--latency', type=float, default=20, help="Response latency in milliseconds")
+    args = parser.parse_args()
+    main(args)
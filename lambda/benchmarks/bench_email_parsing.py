@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+# Replays a corpus of raw emails through SesMailNotification and
+# mail.find_name_and_confirmation_number, with the raw messages served from
+# a local S3 stand-in. Reports throughput, latency and match rate for each
+# email format, and exits non-zero if either regresses past a threshold.
+#
+# A corpus is a directory of raw emails (`<name>.eml`), each with an SES
+# notification (`<name>.json`) in the shape of
+# tests/fixtures/ses_email_notification.json, or a whole SES Lambda event.
+# The notification may also have an `expected` key holding the reservation
+# the email should produce, or null if it shouldn't produce one. Emails
+# without a notification or expectation are expected to match.
+#
+#   # record a baseline, then compare against it after a change
+#   python bench_email_parsing.py --save-baseline /tmp/baseline.json
+#   python bench_email_parsing.py --baseline /tmp/baseline.json
+
+import argparse
+import collections
+import email
+import glob
+import json
+import os
+import sys
+import time
+
+import util
+
+import aws
+import email_parser
+import exceptions
+import fake_aws
+import mail
+
+CORPUS = os.path.join(os.path.dirname(__file__), 'corpus')
+BUCKET = 'corpus'
+UNCLAIMED = 'unclaimed'
+# Latency changes smaller than this (in seconds) are treated as noise
+NOISE_FLOOR = 0.0001
+
+Sample = collections.namedtuple('Sample', ['name', 'mail', 'expected', 'raw'])
+
+
+def _notification_from_headers(name, raw):
+    # Builds the parts of an SES notification the parser uses
+    msg = email.message_from_bytes(raw)
+    return {
+        'commonHeaders': {'subject': " ".join(str(msg.get('Subject', '')).split())},
+        'source': msg.get('Return-Path', msg.get('From', '')).strip('<>'),
+        'messageId': name
+    }
+
+
+def load_corpus(path):
+    samples = []
+    for eml in sorted(glob.glob(os.path.join(path, '*.eml'))):
+        name = os.path.splitext(os.path.basename(eml))[0]
+        with open(eml, 'rb') as f:
+            raw = f.read()
+
+        notification = {}
+        json_path = os.path.join(path, name + '.json')
+        if os.path.exists(json_path):
+            with open(json_path) as f:
+                notification = json.load(f)
+
+        if 'Records' in notification:
+            ses_mail = notification['Records'][0]['ses']['mail']
+        else:
+            ses_mail = notification.get('mail') or _notification_from_headers(name, raw)
+
+        samples.append(Sample(name, ses_mail, notification.get('expected', True), raw))
+
+    return samples
+
+
+def replay(sample):
+    """
+    Returns (elapsed seconds, whether the result was what we expected)
+    """
+    msg = mail.SesMailNotification(sample.mail, s3_bucket=BUCKET)
+    start = time.perf_counter()
+    try:
+        result = mail.find_name_and_confirmation_number(msg)
+    except exceptions.ReservationNotFoundError:
+        result = None
+    elapsed = time.perf_counter() - start
+
+    if sample.expected is True:
+        return elapsed, result is not None
+
+    return elapsed, result == sample.expected
+
+
+def run(samples, iterations):
+    results = collections.OrderedDict()
+    for sample in samples:
+        email_format, _ = email_parser.find_format(sample.mail['commonHeaders']['subject'])
+        format_name = email_format.name if email_format else UNCLAIMED
+        stats = results.setdefault(format_name, {'samples': [], 'matched': 0, 'total': 0, 'misses': []})
+
+        for _ in range(iterations):
+            elapsed, matched = replay(sample)
+            stats['samples'].append(elapsed)
+            stats['total'] += 1
+            stats['matched'] += matched
+
+        if not matched:
+            stats['misses'].append(sample.name)
+
+    return results
+
+
+def report(results):
+    summary = {}
+    for format_name, stats in results.items():
+        samples = stats['samples']
+        total_time = sum(samples)
+        summary[format_name] = {
+            'p50': util.percentile(samples, 50),
+            'p99': util.percentile(samples, 99),
+            'throughput': len(samples) / total_time if total_time else float('inf'),
+            'match_rate': stats['matched'] / float(stats['total'])
+        }
+        print("{} {:>9.0f}/s match={:6.1%}{}".format(
+            util.summarize(format_name, samples),
+            summary[format_name]['throughput'],
+            summary[format_name]['match_rate'],
+            " misses: {}".format(", ".join(stats['misses'])) if stats['misses'] else ""
+        ))
+
+    return summary
+
+
+def find_regressions(summary, baseline, max_slowdown, max_match_drop, min_match_rate):
+    regressions = []
+    for format_name, current in summary.items():
+        if current['match_rate'] < min_match_rate:
+            regressions.append("{}: match rate {:.1%} is below {:.1%}".format(
+                format_name, current['match_rate'], min_match_rate))
+
+        previous = baseline.get(format_name)
+        if previous is None:
+            continue
+
+        if current['match_rate'] < previous['match_rate'] - max_match_drop:
+            regressions.append("{}: match rate fell from {:.1%} to {:.1%}".format(
+                format_name, previous['match_rate'], current['match_rate']))
+
+        for key in ('p50', 'p99'):
+            if current[key] > max(previous[key] * max_slowdown, previous[key] + NOISE_FLOOR):
+                regressions.append("{}: {} rose from {:.3f}ms to {:.3f}ms".format(
+                    format_name, key, previous[key] * 1000, current[key] * 1000))
+
+    return regressions
+
+
+def main(args):
+    samples = []
+    for path in args.corpus:
+        samples.extend(load_corpus(path))
+
+    s3 = fake_aws.FakeS3Client(latency=args.s3_latency, bandwidth=args.s3_bandwidth)
+    for sample in samples:
+        s3.put_object(Bucket=BUCKET, Key=sample.mail['messageId'], Body=sample.raw)
+    aws.set_client('s3', s3)
+
+    print("Replaying {} emails x {} iterations".format(len(samples), args.iterations))
+    summary = report(run(samples, args.iterations))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(summary, f, indent=4, sort_keys=True)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    regressions = find_regressions(
+        summary, baseline, args.max_slowdown, args.max_match_drop, args.min_match_rate
+    )
+    for regression in regressions:
+        print("REGRESSION {}".format(regression))
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', nargs='+', default=[CORPUS],
+                        help="Directories of .eml files and SES notifications")
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--s3-latency', type=float, default=0,
+                        help="Simulated seconds before S3 returns the first byte")
+    parser.add_argument('--s3-bandwidth', type=float, default=None,
+                        help="Simulated S3 transfer rate, in bytes per second")
+    parser.add_argument('--baseline', help="Summary saved by a previous run to compare against")
+    parser.add_argument('--save-baseline', help="Where to save this run's summary")
+    parser.add_argument('--max-slowdown', type=float, default=1.5,
+                        help="Fail if p50 or p99 latency grows by more than this factor")
+    parser.add_argument('--max-match-drop', type=float, default=0.0,
+                        help="Fail if a format's match rate falls by more than this fraction")
+    parser.add_argument('--min-match-rate', type=float, default=1.0,
+                        help="Fail if a format's match rate is below this fraction")
+    args = parser.parse_args()
+    sys.exit(main(args))
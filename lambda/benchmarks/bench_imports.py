@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+# Measures how long each Lambda handler module takes to import in a cold
+# interpreter, which is the import portion of a Lambda cold start, and which
+# of the heavy dependencies it pulls in.
+#
+# Pass --output to append the results as a JSON line, so the numbers can be
+# tracked over time.
+
+import argparse
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+import util
+
+SRC_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+HANDLERS = ['receive_email', 'schedule_check_in', 'check_in', 'check_in_failure']
+HEAVY_MODULES = ['boto3', 'requests', 'pendulum', 'mail', 'asyncio']
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module):
+    env = dict(os.environ, PYTHONPATH=SRC_PATH)
+    probe = PROBE.format(module=module, heavy=HEAVY_MODULES)
+    output = subprocess.check_output([sys.executable, "-c", probe], env=env, cwd=SRC_PATH)
+    return json.loads(output.decode('utf-8'))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"]).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    results = {}
+
+    for handler in HANDLERS:
+        module = "handlers.{}".format(handler)
+        runs = [measure(module) for _ in range(args.iterations)]
+        elapsed = [r['elapsed'] for r in runs]
+        results[handler] = {
+            'median_ms': round(statistics.median(elapsed) * 1000, 2),
+            'loaded': runs[0]['loaded']
+        }
+        print(util.summarize(module, elapsed), "loads:", ", ".join(runs[0]['loaded']) or "-")
+
+    if args.output:
+        record = {
+            'date': datetime.datetime.utcnow().isoformat(),
+            'revision': git_revision(),
+            'python': sys.version.split()[0],
+            'handlers': results
+        }
+        with open(args.output, 'a') as fh:
+            fh.write(json.dumps(record) + "\n")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--output', help="Append results to this JSON lines file")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+# Compares searching the raw source of a reservation email with searching
+# the text extracted by the mime module, for the new_reservation_email
+# fixture and for synthetic messages with large attachments. Reports time per
+# search, how much of the message was read from (fake) S3, and whether the
+# passenger's name was found.
+
+import argparse
+import base64
+import os
+import re
+
+import util
+
+import aws
+import fake_aws
+import mail
+
+FIXTURE = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures', 'new_reservation_email')
+
+# Both patterns allow for markup between the words, to give the raw search a
+# chance. It still misses in the fixture, where quoted-printable soft line
+# breaks split "ABC123" and "George".
+CONFIRMATION = re.compile(r"Confirmation #\s+(?:<[^>]+>\s*)*([A-Z0-9]{6})")
+PASSENGER = re.compile(r"George(?:\s|&nbsp;)+Bush")
+
+SYNTHETIC = """\
+From: gwb@example.com
+Subject: Fwd: Here's your itinerary! (ABC123)
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="outer"
+
+--outer
+Content-Type: multipart/alternative; boundary="inner"
+
+--inner
+Content-Type: text/plain; charset="utf-8"
+Content-Transfer-Encoding: quoted-printable
+
+Confirmation # ABC123
+PASSENGER
+George Bush
+Check in
+
+--inner
+Content-Type: text/html; charset="utf-8"
+Content-Transfer-Encoding: quoted-printable
+
+<p>Confirmation # <strong>ABC123</strong></p><p>George&nbsp;Bush</p>
+--inner--
+
+--outer
+Content-Type: application/pdf
+Content-Disposition: attachment; filename="boarding-pass.pdf"
+Content-Transfer-Encoding: base64
+
+{}
+--outer--
+"""
+
+
+def synthetic_message(attachment_size):
+    attachment = base64.encodebytes(os.urandom(attachment_size)).decode('ascii')
+    return SYNTHETIC.format(attachment).encode('utf-8')
+
+
+def search_raw(msg, pattern):
+    # What SesMailNotification did before it understood MIME
+    return pattern.search(msg.body())
+
+
+def main(args):
+    with open(FIXTURE, 'rb') as f:
+        messages = [("fixture", f.read())]
+    for size in args.attachment_sizes:
+        messages.append(("attachment {}KiB".format(size), synthetic_message(size * 1024)))
+
+    s3 = fake_aws.FakeS3Client()
+    aws.set_client('s3', s3)
+    data = {
+        'commonHeaders': {'subject': 'benchmark'},
+        'source': 'gwb@example.com',
+        'messageId': 'benchmark'
+    }
+
+    for name, message in messages:
+        s3.put_object(Bucket="bucket", Key="benchmark", Body=message)
+
+        for method, search in (("raw", search_raw), ("mime", mail.SesMailNotification.search_body)):
+            samples = []
+            for _ in range(args.iterations):
+                msg = mail.SesMailNotification(data, s3_bucket="bucket")
+                elapsed, found = util.timed(
+                    lambda: (search(msg, CONFIRMATION), search(msg, PASSENGER))
+                )
+                samples.append(elapsed)
+
+            read = s3.bodies[-1].bytes_read
+            print("{} read={:>5.1f}% confirmation={} passenger={}".format(
+                util.summarize("{} {}".format(name, method), samples),
+                100.0 * read / len(message),
+                "yes" if found[0] else "no",
+                "yes" if found[1] else "no"
+            ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--attachment-sizes', type=int, nargs='+', default=[512, 4096],
+                        help="Synthetic attachment sizes, in KiB")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+# Compares sending a burst of "You're checked in!" emails one SendEmail call
+# at a time with sending them in SendBulkTemplatedEmail batches, against a
+# local SES stand-in with simulated per-call latency and throttling.
+
+import argparse
+import logging
+
+import util
+
+import fake_aws
+import notifications
+
+PREFIX = "checkin-bot-"
+FLIGHTS = "\nAUS => DAL (#1234)\n  - George Bush: A12\n"
+
+
+def send_burst(count, template_prefix, latency, throttle):
+    ses = fake_aws.FakeSESClient(template_prefix=PREFIX, latency=latency, throttle=throttle)
+    dispatcher = notifications.Dispatcher(source="bot@example.com", template_prefix=template_prefix, client=ses)
+
+    for i in range(count):
+        dispatcher.queue("passenger{}@example.com".format(i), 'checked_in', {'flights': FLIGHTS})
+
+    elapsed, results = util.timed(dispatcher.flush)
+    failures = sum(1 for r in results if isinstance(r, Exception))
+    return elapsed, len(ses.calls), failures
+
+
+def main(args):
+    # Don't print a warning for every throttled call
+    logging.getLogger('notifications').setLevel(logging.ERROR)
+
+    for name, prefix in (("individual", ""), ("bulk", PREFIX)):
+        samples = []
+        for _ in range(args.iterations):
+            elapsed, calls, failures = send_burst(args.count, prefix, args.latency, args.throttle)
+            samples.append(elapsed)
+
+        print("{} calls={} failures={}".format(
+            util.summarize("{} x{}".format(name, args.count), samples), calls, failures))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=60, help="Emails in the burst")
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.02, help="Simulated seconds per SES call")
+    parser.add_argument('--throttle', type=int, default=1, help="SES calls to throttle per burst")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+# Measures the payloads the check-in state machine passes between states, as
+# the number of flights (legs) on a reservation grows. Compares the current
+# definition in terraform/state_machine.tf, where the Map state projects each
+# check-in's own fields, with the unversioned events it replaced, where every
+# iteration carried the whole ScheduleCheckIns output.
+#
+# Reports how long serializing one execution's payloads takes (Step Functions
+# serializes every state's input and output), the bytes of each check-in's
+# input and of the whole execution, and how close the largest payload comes
+# to Step Functions' payload size limit.
+#
+#   bench_payloads.py --legs 1,2,4,8,16
+
+import argparse
+import json
+import os
+import time
+
+import util
+
+import events
+import state_machine
+
+DEFINITION_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'terraform', 'state_machine.tf')
+# 2099-08-01T05:35:00Z, the first check-in time
+START = 4089245700
+# Largest input or output Step Functions accepts for a state
+PAYLOAD_LIMIT = 256 * 1024
+
+# The MapCheckIns and CheckIn parameters of the unversioned events
+UNVERSIONED_MAP_PARAMETERS = {
+    "time.$": "$$.Map.Item.Value.time",
+    "wait_until.$": "$$.Map.Item.Value.wait_until",
+    "data.$": "$"
+}
+UNVERSIONED_CHECK_IN_PARAMETERS = {
+    "first_name.$": "$.data.first_name",
+    "last_name.$": "$.data.last_name",
+    "confirmation_number.$": "$.data.confirmation_number",
+    "email.$": "$.data.email",
+    "check_in_times.$": "$.data.check_in_times",
+    "time.$": "$.time"
+}
+
+RESERVATION = {
+    'first_name': "George",
+    'last_name': "Bush",
+    'confirmation_number': "ABC123",
+    'email': "george.w.bush@example.com"
+}
+
+
+def schedule_output(legs):
+    # A flight a day, latest first like swa.Reservation.check_in_times
+    times = [time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(START + day * 86400)) for day in range(legs)]
+    schedule = [{'time': t, 'wait_until': t.replace(":35:00", ":34:55")} for t in times]
+    return events.schedule(RESERVATION, times[::-1], schedule[::-1])
+
+
+def unversioned(output, legs=None):
+    # Check-in inputs under the unversioned events. Each Map iteration got
+    # the whole output, which the CheckIn state then picked from.
+    output = dict(output)
+    del output['version']
+    payloads = []
+    for index, item in enumerate(output['check_in_schedule'][:legs]):
+        context = {'Map': {'Item': {'Index': index, 'Value': item}}}
+        iteration = state_machine.apply_parameters(UNVERSIONED_MAP_PARAMETERS, output, context)
+        payloads.append((iteration, state_machine.apply_parameters(UNVERSIONED_CHECK_IN_PARAMETERS, iteration)))
+    return output, payloads
+
+
+def projected(output, map_parameters, legs=None):
+    # Check-in inputs under the current definition, which the Map state
+    # projects and the CheckIn state passes on as they are
+    payloads = []
+    for index, item in enumerate(output['check_in_schedule'][:legs]):
+        context = {'Map': {'Item': {'Index': index, 'Value': item}}}
+        iteration = state_machine.apply_parameters(map_parameters, output, context)
+        payloads.append((iteration, iteration))
+    return output, payloads
+
+
+def transitions(output, payloads):
+    # Every payload serialized for one execution: the schedule, then for each
+    # check-in the Wait state's input and output and the CheckIn task's input
+    serialized = [output]
+    for iteration, check_in in payloads:
+        serialized += [iteration, iteration, check_in]
+    return serialized
+
+
+def serialize(payloads):
+    # The round trip each payload makes between states
+    for payload in payloads:
+        json.loads(json.dumps(payload))
+
+
+def size(payload):
+    return len(json.dumps(payload, separators=(",", ":")))
+
+
+def measure(name, output, payloads, iterations):
+    all_payloads = transitions(output, payloads)
+    samples = [util.timed(serialize, all_payloads)[0] for _ in range(iterations)]
+    sizes = [size(p) for p in all_payloads]
+    print(util.summarize("{} legs={}".format(name, len(payloads)), samples))
+    print("    check-in={}B iteration={}B execution={}B largest={}B ({:.1%} of the limit)".format(
+        max(size(c) for _, c in payloads), max(size(i) for i, _ in payloads), sum(sizes), max(sizes),
+        max(sizes) / float(PAYLOAD_LIMIT)))
+
+
+def main(args):
+    definition = state_machine.load_definition(DEFINITION_PATH)
+    map_parameters = definition['States']['MapCheckIns']['Parameters']
+
+    for legs in args.legs:
+        output = schedule_output(legs)
+        measure("unversioned", *unversioned(output), iterations=args.iterations)
+        measure("projected", *projected(output, map_parameters), iterations=args.iterations)
+
+
+def _ints(value):
+    return [int(v) for v in value.split(",")]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--legs', type=_ints, default=[1, 2, 4, 8, 16], help="Comma separated numbers of legs")
+    parser.add_argument('--iterations', type=int, default=1000)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+# Pushes reservations through the whole check-in pipeline locally: emails to
+# the receive-email handler, then the state machine from
+# terraform/state_machine.tf run on a virtual clock against in-memory
+# stand-ins for S3, SES, Step Functions and Southwest (see tests/simulator.py).
+# Wait states take no real time, so weeks of check-ins run in seconds.
+#
+# Reports the CPU time each handler used per invocation, retries (by the
+# state machine, and check-in POSTs beyond the first), and how late each
+# check-in reached Southwest after its window opened.
+#
+#   bench_pipeline.py --reservations 10000
+#   # keep the check-in outcomes for scripts/check-in-report.py
+#   bench_pipeline.py --reservations 10000 --history /tmp/history.db
+
+import argparse
+import logging
+import random
+import string
+import time
+
+import util
+
+from simulator import Pipeline
+
+FIRST_NAMES = ("George", "Laura", "Barbara", "Jenna", "Neil", "Marvin", "Dorothy", "Jeb")
+LAST_NAMES = ("Bush", "Walker", "Pierce", "Smith", "Mc Lovin", "Garcia", "Nguyen", "Johnson")
+
+
+def confirmation_number(i):
+    digits = string.digits + string.ascii_uppercase
+    chars = []
+    for _ in range(6):
+        i, d = divmod(i, len(digits))
+        chars.append(digits[d])
+    return "".join(reversed(chars))
+
+
+def departures(rng, start, days):
+    # Flights leave on the hour or half hour, so check-ins pile up on the
+    # same seconds like they do for real. The first check-ins are a day out.
+    outbound = start + 2 * 86400 + rng.randrange(int(days * 48)) * 1800
+    times = [outbound]
+    if rng.random() < 0.7:
+        times.append(outbound + rng.randint(2, 7) * 86400)
+    return [time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(t)) for t in times]
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    # Start on a whole second, as the check-in times are
+    start = float(int(time.time()))
+
+    unparsed = 0
+    with Pipeline(start=start, latency=args.latency / 1000.0, clock_offset=args.clock_offset,
+                  history_db=args.history) as pipeline:
+        numbers = []
+        for i in range(args.reservations):
+            first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            number = confirmation_number(i)
+            numbers.append(number)
+            pipeline.add_reservation(number, first_name, last_name, departures(rng, start, args.days))
+            if not pipeline.send_email(number, first_name, last_name, itinerary=rng.random() < 0.5):
+                unparsed += 1
+
+        # Schedule everything, then cancel some reservations before they
+        # check in
+        scheduling_elapsed, _ = util.timed(pipeline.run, start + 3600)
+        for number in numbers:
+            if rng.random() < args.cancelled:
+                pipeline.southwest.cancel(number)
+
+        elapsed, executions = util.timed(pipeline.run)
+        elapsed += scheduling_elapsed
+
+    statuses = {}
+    for execution in executions:
+        statuses[execution.status] = statuses.get(execution.status, 0) + 1
+
+    southwest = pipeline.southwest
+    check_ins = southwest.check_ins
+    print("reservations={} executions={} check-ins={} elapsed={:.1f}s virtual={:.1f} days".format(
+        args.reservations, len(executions), len(check_ins), elapsed, (pipeline.clock.now - start) / 86400))
+    print("statuses: {} emails not parsed={}".format(
+        " ".join("{}={}".format(k, v) for k, v in sorted(statuses.items())), unparsed))
+    print()
+
+    stats = pipeline.machine.stats
+    for name in sorted(stats):
+        if stats[name].cpu_time:
+            print(util.summarize("cpu {}".format(name), stats[name].cpu_time))
+    print(util.summarize("cpu ReceiveEmail", pipeline.receive_email_cpu_time))
+    print()
+
+    for name in sorted(stats):
+        if stats[name].retries or stats[name].errors:
+            print("{:<32} retries={} errors={}".format(name, stats[name].retries, stats[name].errors))
+    extra_posts = sum(southwest.attempts.values()) - len(check_ins)
+    print("{:<32} requests={} extra check-in POSTs={}".format("southwest", southwest.requests, extra_posts))
+    print()
+
+    if check_ins:
+        late = [c['late'] for c in check_ins]
+        print(util.summarize("lateness", late))
+        print("{:<32} max={:.3f}ms".format("lateness", max(late) * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reservations', type=int, default=200)
+    parser.add_argument('--days', type=float, default=30, help="Spread departures over this many days")
+    parser.add_argument('--latency', type=float, default=50, help="Southwest response latency in milliseconds")
+    parser.add_argument('--clock-offset', type=float, default=0, help="Seconds Southwest's clock is ahead of ours")
+    parser.add_argument('--cancelled', type=float, default=0.01, help="Fraction of reservations cancelled")
+    parser.add_argument('--history', default=":memory:",
+                        help="SQLite file to save check-in outcomes in, for scripts/check-in-report.py")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help="Show the handlers' warnings and errors")
+    args = parser.parse_args()
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+    main(args)
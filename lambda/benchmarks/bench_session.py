@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+# Compares a fresh connection per request (the old module-level requests.get
+# and requests.post calls) against the pooled keep-alive session used by
+# swa._make_request. Both run the GET => POST check-in pair against a local
+# stand-in for the Southwest API.
+#
+# The stand-in speaks plain HTTP, so this only shows the TCP connect savings.
+# Against the real API each new connection also pays for DNS and a TLS
+# handshake, so the difference in production is considerably larger.
+
+import argparse
+
+import requests
+
+import util
+
+import swa
+from fake_southwest import FakeSouthwestServer
+
+PAGE = "mobile-air-operations/v1/mobile-air-operations/page/check-in"
+PARAMS = {'first-name': 'George', 'last-name': 'Bush'}
+
+
+def check_in_unpooled(url):
+    headers = {"User-Agent": swa.USER_AGENT, "Accept": "application/json"}
+    session = requests.get(f"{url}/{PAGE}/ABC123", headers=headers, params=PARAMS)
+    body = session.json()['checkInViewReservationPage']['_links']['checkIn']['body']
+    return requests.post(f"{url}/{PAGE}", headers=headers, json=body)
+
+
+def check_in_pooled(url):
+    return swa.check_in("George", "Bush", "ABC123")
+
+
+def run(name, fn, iterations):
+    with FakeSouthwestServer() as server:
+        swa.API_URL = server.url
+        swa.reset_session()
+        samples = [util.timed(fn, server.url)[0] for _ in range(iterations)]
+
+    print(util.summarize(name, samples), f"connections={server.connections}")
+    return samples
+
+
+def main(args):
+    unpooled = run("check-in (new connections)", check_in_unpooled, args.iterations)
+    pooled = run("check-in (pooled session)", check_in_pooled, args.iterations)
+
+    saved = util.percentile(unpooled, 50) - util.percentile(pooled, 50)
+    print("p50 saved per check-in: {:.3f}ms".format(saved * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# Drives the swa client through the local Southwest stand-in at a range of
+# concurrency levels. The stand-in can draw its latency from a distribution,
+# fail requests with 429s and 5xxs (in bursts), refuse check-ins as too early
+# for a while, and run its clock ahead of ours, so the client's pooling,
+# retries and clock skew estimate can be measured under realistic conditions
+# rather than against cassettes which replay instantly.
+#
+# For each concurrency level this reports throughput, latency percentiles,
+# the outcome of each operation, and the requests and connections it took.
+#
+#   bench_southwest_client.py --operation check-in --concurrency 1,8,32 \
+#       --latency lognormal:60:0.5 --error-rate 0.02 --error-burst 5
+
+import argparse
+import concurrent.futures
+import time
+
+import util
+
+import clock
+import swa
+from fake_southwest import ErrorInjector, FakeSouthwestServer, TRANSIENT_STATUSES, parse_latency
+
+
+def view(args):
+    return swa.Reservation.from_passenger_info("George", "Bush", "ABC123")
+
+
+def check_in(args):
+    return swa.check_in("George", "Bush", "ABC123", budget=args.budget)
+
+
+OPERATIONS = {'view': view, 'check-in': check_in}
+
+
+def timed_operation(operation, args):
+    start = time.perf_counter()
+    try:
+        operation(args)
+        outcome = "ok"
+    except Exception as e:
+        outcome = swa.classify_error(e)
+    return time.perf_counter() - start, outcome
+
+
+def run(concurrency, args):
+    errors = ErrorInjector(
+        rate=args.error_rate, statuses=args.error_statuses, burst=args.error_burst, seed=args.seed
+    )
+    opens_at = time.time() + args.clock_offset + args.too_early if args.too_early else None
+    server = FakeSouthwestServer(
+        latency=parse_latency(args.latency), errors=errors, clock_offset=args.clock_offset,
+        check_in_opens_at=opens_at
+    )
+
+    operation = OPERATIONS[args.operation]
+    with server:
+        swa.API_URL = server.url
+        swa.POOL_SIZE = args.pool_size
+        swa.reset_session()
+        swa.clock_skew = clock.SkewEstimator()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            elapsed, results = util.timed(
+                lambda: list(executor.map(lambda _: timed_operation(operation, args), range(args.operations)))
+            )
+
+    samples = [r[0] for r in results]
+    outcomes = {}
+    for _, outcome in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    print(util.summarize("{} concurrency={}".format(args.operation, concurrency), samples),
+          "throughput={:.1f}/s".format(args.operations / elapsed))
+    print("    outcomes={} requests/op={:.2f} connections={} injected={}".format(
+        outcomes, server.requests / float(args.operations), server.connections, errors.injected))
+    if args.clock_offset and swa.clock_skew.skew is not None:
+        print("    clock skew estimate={:.3f}s (actual {:.3f}s)".format(swa.clock_skew.skew, args.clock_offset))
+
+
+def main(args):
+    for concurrency in args.concurrency:
+        run(concurrency, args)
+
+
+def _ints(value):
+    return [int(v) for v in value.split(",")]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--operation', choices=sorted(OPERATIONS), default='check-in')
+    parser.add_argument('--operations', type=int, default=50, help="Operations per concurrency level")
+    parser.add_argument('--concurrency', type=_ints, default=[1, 4, 16], help="Comma separated concurrency levels")
+    parser.add_argument('--pool-size', type=int, default=swa.POOL_SIZE, help="swa's connection pool size")
+    parser.add_argument('--latency', default="lognormal:20:0.5",
+                        help="Response latency in ms: a number, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA")
+    parser.add_argument('--error-rate', type=float, default=0.02, help="Chance of a request starting an error burst")
+    parser.add_argument('--error-burst', type=int, default=2, help="Requests failed in a row per burst")
+    parser.add_argument('--error-statuses', type=_ints, default=list(TRANSIENT_STATUSES))
+    parser.add_argument('--too-early', type=float, default=0,
+                        help="Refuse check-ins as too early for this many seconds after starting")
+    parser.add_argument('--clock-offset', type=float, default=0, help="Seconds Southwest's clock is ahead of ours")
+    parser.add_argument('--budget', type=float, default=swa.CHECK_IN_RETRY_BUDGET, help="Check-in retry budget")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    main(args)
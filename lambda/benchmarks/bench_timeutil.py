@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+# Compares pendulum with the stdlib-based timeutil module for the operations
+# on the check-in path: parsing RFC 3339 check-in times and sorting them, as
+# scripts/get-next-checkins.py does for every running execution.
+
+import argparse
+import datetime
+import random
+
+import pendulum
+
+import util
+
+import timeutil
+
+
+def generate_times(count):
+    start = datetime.datetime(2099, 1, 1, tzinfo=datetime.timezone(datetime.timedelta(hours=-5)))
+    return [
+        (start + datetime.timedelta(minutes=random.randint(0, 525600))).isoformat()
+        for _ in range(count)
+    ]
+
+
+def main(args):
+    random.seed(0)
+    times = generate_times(args.count)
+
+    for name, parse in (("pendulum", pendulum.parse), ("timeutil", timeutil.parse)):
+        parse_elapsed, _ = util.timed(lambda: [parse(t) for t in times])
+        sort_elapsed, _ = util.timed(lambda: sorted(times, key=parse))
+        print("{:<10} parse={:>10.0f}/s sort={:8.3f}ms ({} timestamps)".format(
+            name, args.count / parse_elapsed, sort_elapsed * 1000, args.count))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=10000)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,40 @@
+import os
+import statistics
+import sys
+import time
+
+# Add ../src and ../tests to the path so benchmarks can use the project modules
+# and the local test stand-ins directly.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+
+
+def timed(fn, *args, **kwargs):
+    """
+    Calls `fn` and returns a tuple of (elapsed seconds, result)
+    """
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def percentile(samples, pct):
+    """
+    Nearest-rank percentile of a list of samples
+    """
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(name, samples, unit="ms", scale=1000.0):
+    """
+    Formats a one line summary of timing samples (in seconds)
+    """
+    return "{:<32} n={:<6} mean={:8.3f}{unit} p50={:8.3f}{unit} p99={:8.3f}{unit}".format(
+        name, len(samples),
+        statistics.mean(samples) * scale,
+        percentile(samples, 50) * scale,
+        percentile(samples, 99) * scale,
+        unit=unit
+    )
@@ -0,0 +1,58 @@
+#
+# aws.py
+# A per-process registry of boto3 clients
+#
+# Creating a client resolves endpoints and walks the credential chain, which
+# is slow enough to matter on every warm invocation. Clients are created on
+# first use and then reused for the life of the Lambda container.
+#
+
+import os
+import threading
+
+# Applied to every client created by the registry
+MAX_ATTEMPTS = int(os.getenv("AWS_MAX_ATTEMPTS", 3))
+CONNECT_TIMEOUT = float(os.getenv("AWS_CONNECT_TIMEOUT", 2))
+READ_TIMEOUT = float(os.getenv("AWS_READ_TIMEOUT", 10))
+
+_clients = {}
+# boto3's default session isn't safe to create clients from concurrently
+_lock = threading.Lock()
+
+
+def client(service):
+    """
+    Returns the shared boto3 client for `service`, creating it if needed
+    """
+    c = _clients.get(service)
+    if c is not None:
+        return c
+
+    with _lock:
+        if service not in _clients:
+            # boto3 is slow to import, so only pay for it once a client is needed
+            import boto3
+            from botocore.config import Config
+
+            config = Config(
+                connect_timeout=CONNECT_TIMEOUT,
+                read_timeout=READ_TIMEOUT,
+                retries={'max_attempts': MAX_ATTEMPTS}
+            )
+            _clients[service] = boto3.client(service, config=config)
+
+        return _clients[service]
+
+
+def set_client(service, c):
+    """
+    Replaces the client for `service`, e.g. with a stub in tests
+    """
+    _clients[service] = c
+
+
+def reset():
+    """
+    Forgets all clients. New ones are created on next use.
+    """
+    _clients.clear()
@@ -0,0 +1,187 @@
+#
+# bucket_scheduler.py
+# Check in every reservation due in the same second together
+#
+# The state machine runs one execution per reservation: N reservations due
+# at the same instant mean N waits and N check-in invocations. This
+# scheduler instead groups pending check-ins into per-second buckets and
+# fires one worker per bucket, which checks in the whole bucket concurrently
+# through the check-in handler's batch mode.
+#
+# A scheduler plans the check-ins it's given and runs until they're done, so
+# it's meant for a long-running process (see scripts/run-bucket-scheduler.py)
+# rather than a Lambda function.
+#
+# The state machine's executions check in the same reservations unless the
+# schedule handler is deployed with CHECK_IN_MODE=buckets (see
+# schedule_index.CHECK_IN_MODE), so only run this against an index whose
+# reservations nothing else is checking in.
+#
+
+import concurrent.futures
+import heapq
+import logging
+import os
+import threading
+import time
+
+import exceptions
+import schedule_index
+import timeutil
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+# How many seconds before a bucket's check-in time its worker is started.
+# The check-in handler waits out the rest itself, as it does when invoked by
+# the state machine.
+BUCKET_LEAD_SECONDS = int(os.getenv('CHECK_IN_LEAD_SECONDS', 5))
+# Most buckets being checked in at once
+MAX_BUCKET_WORKERS = int(os.getenv('MAX_BUCKET_WORKERS', 4))
+
+
+class Bucket(object):
+    """
+    The check-in events due in one second, `time` (a Unix timestamp)
+    """
+
+    def __init__(self, time, reservations=None):
+        self.time = time
+        self.reservations = reservations or []
+
+    def __repr__(self):
+        return "<Bucket {} ({} reservations)>".format(self.time, len(self.reservations))
+
+
+def bucket_time(check_in_time):
+    """
+    Returns the second (a Unix timestamp) whose bucket a check-in time falls in
+    """
+    return int(timeutil.parse(check_in_time).timestamp())
+
+
+def check_in_bucket(bucket):
+    """
+    Checks in every reservation in `bucket` and returns the check-in
+    handler's result for each. Reservations which couldn't be checked in are
+    sent the failure email, as the state machine does, unless they've been
+    cancelled.
+    """
+    from handlers.check_in import main as check_in
+    import notifications
+
+    results = check_in({'reservations': bucket.reservations}, None)
+
+    dispatcher = notifications.Dispatcher()
+    index = schedule_index.get_schedule_index()
+    for reservation, result in zip(bucket.reservations, results):
+        if 'error' not in result or result['error'] == exceptions.ReservationNotFoundError.__name__:
+            continue
+
+        dispatcher.queue(reservation.get('email'), 'check_in_failed', {
+            'first_name': reservation['first_name'],
+            'last_name': reservation['last_name'],
+            'confirmation_number': reservation['confirmation_number']
+        })
+        if index:
+            index.remove(reservation['confirmation_number'], [reservation['time']])
+
+    for result in dispatcher.flush():
+        if isinstance(result, Exception):
+            log.warning("Error sending email: {}".format(result))
+
+    return results
+
+
+class Scheduler(object):
+    """
+    Plans check-ins into per-second buckets and runs them.
+
+    Each check-in is an event like the check-in handler takes: the
+    reservation's `first_name`, `last_name`, `confirmation_number` and
+    `email`, plus the check-in `time`. `worker` is called with each Bucket
+    `lead` seconds before its time, on a pool of `max_workers` threads.
+
+    `now` and `sleep` default to the real clock, where adding a check-in
+    cuts short the wait for the next bucket. Pass the `time` and `sleep` of a
+    clock.SimulatedClock to run a schedule without waiting.
+    """
+
+    def __init__(self, worker=check_in_bucket, lead=BUCKET_LEAD_SECONDS, max_workers=MAX_BUCKET_WORKERS,
+                 now=time.time, sleep=None):
+        self.worker = worker
+        self.lead = lead
+        self.max_workers = max_workers
+        self._now = now
+        self._sleep = sleep or self._wait
+        self._buckets = {}
+        self._times = []
+        self._lock = threading.Lock()
+        self._added = threading.Event()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def add(self, event):
+        """
+        Plans a check-in. Check-ins may be added while the scheduler runs,
+        up until their bucket has fired.
+        """
+        second = bucket_time(event['time'])
+        with self._lock:
+            bucket = self._buckets.get(second)
+            if bucket is None:
+                bucket = self._buckets[second] = Bucket(second)
+                heapq.heappush(self._times, second)
+            bucket.reservations.append(event)
+        self._added.set()
+
+    def _wait(self, seconds):
+        # Sleeps until `seconds` have passed or a check-in is added
+        self._added.wait(seconds)
+        self._added.clear()
+
+    def _next_bucket(self):
+        with self._lock:
+            if not self._times:
+                return None
+            return self._buckets[self._times[0]]
+
+    def _pop_bucket(self, second):
+        with self._lock:
+            heapq.heappop(self._times)
+            return self._buckets.pop(second)
+
+    def run(self):
+        """
+        Fires every planned bucket in time order, waits for them all to
+        finish, and returns a list of (bucket, worker result or exception)
+        """
+        fired = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                bucket = self._next_bucket()
+                if bucket is None:
+                    break
+
+                # Something earlier may be added while we wait, so look again
+                # after every sleep
+                now = self._now()
+                if now < bucket.time - self.lead:
+                    self._sleep(bucket.time - self.lead - now)
+                    continue
+
+                bucket = self._pop_bucket(bucket.time)
+                if now > bucket.time:
+                    log.warning("Firing {} {:.1f}s late".format(bucket, now - bucket.time))
+                log.info("Firing {}".format(bucket))
+                fired.append((bucket, executor.submit(self.worker, bucket)))
+
+        results = []
+        for bucket, future in fired:
+            try:
+                results.append((bucket, future.result()))
+            except Exception as e:
+                log.error("Error checking in {}: {}".format(bucket, e))
+                results.append((bucket, e))
+        return results
@@ -0,0 +1,156 @@
+#
+# cache.py
+# TTL caches for Southwest API lookups
+#
+
+import collections
+import json
+import logging
+import os
+import time
+
+import aws
+import metrics
+import storage
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+# Seconds a cached reservation lookup is served before asking Southwest again
+RESERVATION_CACHE_TTL = int(os.getenv("RESERVATION_CACHE_TTL", 300))
+# Maximum number of reservations held by the in-process cache
+RESERVATION_CACHE_SIZE = int(os.getenv("RESERVATION_CACHE_SIZE", 256))
+# DynamoDB table shared between Lambda containers. If unset, each container
+# keeps its own in-process cache.
+RESERVATION_CACHE_TABLE = os.getenv("RESERVATION_CACHE_TABLE")
+
+
+class MemoryCache(object):
+    """
+    An in-process cache which expires entries after `ttl` seconds and evicts
+    the least recently used entry once it holds `max_size` entries.
+    """
+
+    def __init__(self, ttl, max_size, now=time.time):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._now = now
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at <= self._now():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (self._now() + self.ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class DynamoDBCache(object):
+    """
+    A cache stored in a DynamoDB table with a string hash key named `key` and
+    TTL enabled on the `expires_at` attribute. DynamoDB removes expired items
+    itself (lazily), so expiry is also checked on read.
+
+    Values must be JSON serializable. Pass `client` to use a stub locally.
+    """
+
+    def __init__(self, table_name, ttl, client=None, now=time.time):
+        self.table_name = table_name
+        self.ttl = ttl
+        self.client = client or aws.client('dynamodb')
+        self._now = now
+
+    def get(self, key):
+        item = self.client.get_item(
+            TableName=self.table_name,
+            Key={'key': {'S': key}}
+        ).get('Item')
+
+        if item is None or float(item['expires_at']['N']) <= self._now():
+            return None
+
+        return json.loads(item['value']['S'])
+
+    def set(self, key, value):
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                'key': {'S': key},
+                'value': {'S': json.dumps(value)},
+                'expires_at': {'N': str(int(self._now() + self.ttl))}
+            }
+        )
+
+
+class ReservationCache(object):
+    """
+    Caches view-reservation responses by confirmation number and passenger
+    name, counting hits and misses. A lookup the backend fails is logged and
+    counted as a miss, and a failed store is logged and dropped, so a broken
+    backend just behaves like an empty cache.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(first_name, last_name, confirmation_number):
+        # Names arrive in whatever case and spacing the email used
+        name = " ".join("{} {}".format(first_name, last_name).lower().split())
+        return "{}:{}".format(confirmation_number.upper(), name)
+
+    def get(self, first_name, last_name, confirmation_number):
+        value = None
+        with storage.log_errors(log, "Error reading reservation cache"):
+            value = self.backend.get(self.key(first_name, last_name, confirmation_number))
+
+        if value is None:
+            self.misses += 1
+            metrics.record("ReservationCacheMiss", 1, "Count")
+        else:
+            self.hits += 1
+            metrics.record("ReservationCacheHit", 1, "Count")
+
+        return value
+
+    def set(self, first_name, last_name, confirmation_number, response):
+        with storage.log_errors(log, "Error writing reservation cache"):
+            self.backend.set(self.key(first_name, last_name, confirmation_number), response)
+
+
+_reservation_cache = None
+
+
+def get_reservation_cache():
+    """
+    Returns the process-wide reservation cache, backed by DynamoDB if
+    `RESERVATION_CACHE_TABLE` is set or by memory otherwise.
+    """
+    global _reservation_cache
+
+    if _reservation_cache is None:
+        if RESERVATION_CACHE_TABLE:
+            backend = DynamoDBCache(RESERVATION_CACHE_TABLE, RESERVATION_CACHE_TTL)
+        else:
+            backend = MemoryCache(RESERVATION_CACHE_TTL, RESERVATION_CACHE_SIZE)
+        _reservation_cache = ReservationCache(backend)
+
+    return _reservation_cache
@@ -0,0 +1,121 @@
+#
+# clock.py
+# Helpers for firing requests at a precise instant
+#
+
+import collections
+import email.utils
+import time
+
+# Number of recent samples used for the rolling clock skew estimate
+SKEW_WINDOW = 32
+
+# Sleep until this many seconds before the target, then busy-wait the rest.
+# time.sleep() routinely overshoots by a few milliseconds, which matters when
+# the check-in window opens on the exact second.
+SPIN_SECONDS = 0.02
+
+
+def wait_until(target, now=None, sleep=None):
+    """
+    Blocks until the local clock reaches `target`, a Unix timestamp in
+    seconds. Returns how late (in seconds) the wait actually finished, which
+    is 0 or slightly positive. Targets in the past return immediately.
+    """
+    # Looked up on each call, rather than bound as defaults, so that a
+    # simulation can swap out this module's clock
+    now = now or time.time
+    sleep = sleep or time.sleep
+
+    while True:
+        remaining = target - now()
+        if remaining <= 0:
+            return -remaining
+        if remaining > SPIN_SECONDS:
+            sleep(remaining - SPIN_SECONDS)
+
+
+class SkewEstimator(object):
+    """
+    Estimates how far a server's clock is ahead of the local clock from the
+    `Date` headers on its HTTP responses.
+
+    A `Date` header is truncated to the whole second and was stamped some time
+    between sending the request and receiving the response, so each sample
+    bounds the skew to an interval. Intersecting the intervals of recent
+    samples narrows the estimate well below one second once requests have
+    landed on either side of a second boundary.
+    """
+
+    def __init__(self, window=SKEW_WINDOW):
+        self.samples = collections.deque(maxlen=window)
+
+    def add_sample(self, date_header, sent, received):
+        """
+        Records a response `Date` header along with the local Unix timestamps
+        at which the request was sent and the response received.
+        """
+        server_time = email.utils.parsedate_to_datetime(date_header).timestamp()
+        self.samples.append((server_time - received, server_time + 1 - sent))
+
+    @property
+    def bounds(self):
+        """
+        The (lower, upper) bounds of the skew in seconds, or None without any
+        samples. If the samples disagree (e.g. one of the clocks was stepped),
+        only the most recent sample is trusted.
+        """
+        if not self.samples:
+            return None
+
+        lower = max(s[0] for s in self.samples)
+        upper = min(s[1] for s in self.samples)
+        if lower > upper:
+            return self.samples[-1]
+
+        return lower, upper
+
+    @property
+    def skew(self):
+        """
+        Best estimate of the server clock minus the local clock, in seconds
+        """
+        bounds = self.bounds
+        if bounds is None:
+            return None
+        return (bounds[0] + bounds[1]) / 2.0
+
+    def local_time(self, server_time):
+        """
+        Returns the earliest local Unix timestamp at which the server's clock
+        is certain to have reached `server_time`, or None without samples.
+        """
+        bounds = self.bounds
+        if bounds is None:
+            return None
+        return server_time - bounds[0]
+
+
+class SimulatedClock(object):
+    """
+    A clock which only moves forward when slept on, for running schedules
+    in tests and simulations without waiting in real time. Pass its `time`
+    and `sleep` wherever a function takes `now` and `sleep`.
+
+    Every reading also advances the clock by `tick` seconds, like a real
+    busy-wait, so that `wait_until` can spin out its last few milliseconds.
+    """
+
+    def __init__(self, start=0.0, tick=0.001):
+        self.now = start
+        self.tick = tick
+
+    def time(self):
+        self.now += self.tick
+        return self.now
+
+    # Readings only move forward, so it stands in for time.monotonic too
+    monotonic = time
+
+    def sleep(self, seconds):
+        self.now += max(0, seconds)
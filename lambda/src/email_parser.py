@@ -0,0 +1,203 @@
+#
+# email_parser.py
+# Registry of the reservation email formats we know how to read
+#
+# Each format claims an email by its subject, which is cheap to check. Only
+# the format which claims the email goes on to extract the passenger details,
+# so the body (an S3 download) is only fetched for formats which need it.
+#
+
+import logging
+import re
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+CONFIRMATION_NUMBER = re.compile(r"\(([A-Z0-9]{6})\)")
+
+
+class EmailFormat(object):
+    """
+    A known reservation email format.
+
+    The first format, by `priority`, whose `keywords` all appear in the
+    subject and whose `subject` pattern (if any) matches it claims the email.
+    `extract(msg, subject_match)` then returns a tuple of
+    (first name, last name, confirmation number), any of which may be None.
+    Set `needs_body` if `extract` reads the message body; prefer
+    `msg.search_body(pattern)` to `msg.body()`, as it stops reading once the
+    pattern matches.
+    """
+
+    def __init__(self, name, priority, extract, keywords=(), subject=None, needs_body=False):
+        self.name = name
+        self.priority = priority
+        self.extract = extract
+        self.keywords = keywords
+        self.subject = re.compile(subject) if subject else None
+        self.needs_body = needs_body
+
+        # Emails claimed by this format, and how many of them yielded a reservation
+        self.claimed = 0
+        self.matched = 0
+
+    def __repr__(self):
+        return "<EmailFormat {}>".format(self.name)
+
+    def claim(self, subject):
+        """
+        Returns a truthy value (the subject match, if there is a pattern) if
+        this format should handle an email with this subject.
+        """
+        for keyword in self.keywords:
+            if keyword not in subject:
+                return None
+
+        if self.subject is None:
+            return True
+
+        return self.subject.search(subject)
+
+
+FORMATS = []
+
+
+def register_format(email_format):
+    """
+    Adds a format to the registry, keeping it ordered by priority
+    """
+    FORMATS.append(email_format)
+    FORMATS.sort(key=lambda f: f.priority)
+    return email_format
+
+
+def find_format(subject):
+    """
+    Returns (format, subject match) for the format which claims an email
+    with this subject, or (None, None) if none do
+    """
+    for email_format in FORMATS:
+        subject_match = email_format.claim(subject)
+        if subject_match:
+            return email_format, subject_match
+
+    return None, None
+
+
+def parse(msg):
+    """
+    Finds the format which claims `msg` and extracts the passenger details.
+    Returns (format, (first name, last name, confirmation number)), or
+    (None, (None, None, None)) if no format claims the email.
+    """
+    email_format, subject_match = find_format(msg.subject)
+    if email_format is None:
+        return None, (None, None, None)
+
+    log.debug("Found a {} email: {}".format(email_format.name, msg.subject))
+    email_format.claimed += 1
+    result = email_format.extract(msg, subject_match)
+
+    if all(result):
+        email_format.matched += 1
+
+    return email_format, result
+
+
+def get_stats():
+    """
+    Per-format counts of emails claimed and successfully matched
+    """
+    return {f.name: {'claimed': f.claimed, 'matched': f.matched} for f in FORMATS}
+
+
+def reset_stats():
+    for f in FORMATS:
+        f.claimed = 0
+        f.matched = 0
+
+
+#
+# Formats, in the order they're tried
+#
+
+def _extract_legacy(msg, match):
+    lname, fname = match.group(2).split('/')
+    return fname, lname, match.group(1)
+
+
+# Try to match `(5OK3YZ) | 22APR17 | HOU-MDW | Bush/George`
+register_format(EmailFormat(
+    "legacy", 10, _extract_legacy,
+    keywords=("(", "|"),
+    subject=r"\(([A-Z0-9]{6})\).*\| (\w+ ?\w+\/\w+)"
+))
+
+
+ITINERARY_PASSENGER = re.compile(r"PASSENGER([\w\s]+)Check in")
+
+
+def _extract_itinerary(msg, match):
+    reservation, fname, lname = None, None, None
+
+    conf_match = CONFIRMATION_NUMBER.search(msg.subject)
+    if conf_match:
+        reservation = conf_match.group(1)
+
+    log.debug("Reservation found: {}".format(reservation))
+
+    body_match = msg.search_body(ITINERARY_PASSENGER)
+    if body_match:
+        log.debug("Passenger matched. Parsing first and last name")
+        name_parts = body_match.group(1).split()
+        fname, lname = name_parts[0], name_parts[-1]
+
+    return fname, lname, reservation
+
+
+register_format(EmailFormat(
+    "itinerary", 20, _extract_itinerary,
+    keywords=("Here's your itinerary!",),
+    needs_body=True
+))
+
+
+#
+# AIR Confirmation: ABC123
+# *Passenger(s)*
+# BUSH/GEORGE W
+#
+TICKETLESS_PASSENGER = re.compile(r"AIR Confirmation:\s+([A-Z0-9]{6})\s+\*Passenger\(s\)\*\s+(\w+\/\w+)")
+
+
+def _extract_ticketless(msg, match):
+    body_match = msg.search_body(TICKETLESS_PASSENGER)
+    if not body_match:
+        return None, None, None
+
+    log.debug("Passenger matched. Parsing first and last name")
+    lname, fname = body_match.group(2).strip().split('/')
+    return fname, lname, body_match.group(1)
+
+
+register_format(EmailFormat(
+    "ticketless", 30, _extract_ticketless,
+    keywords=("Passenger Itinerary",),
+    needs_body=True
+))
+
+
+# This matches a variety of new email formats which look like
+# George Bush's 12/25 Detroit trip (ABC123)
+register_format(EmailFormat(
+    "new_subject", 40, lambda msg, m: (m.group(1), m.group(2), m.group(3)),
+    keywords=("'s", "("),
+    subject=r"(?:[Ff][Ww][Dd]?: )?(\w+).* (\w+)'s.*\(([A-Z0-9]{6})\)"
+))
+
+
+# ABC123 George Bush
+register_format(EmailFormat(
+    "manual", 50, lambda msg, m: (m.group(2), m.group(3), m.group(1)),
+    subject=r"([A-Z0-9]{6})\s+(\w+) (\w+ ?\w+)"
+))
@@ -0,0 +1,66 @@
+#
+# events.py
+# The events passed between the check-in state machine's states
+#
+# ScheduleCheckIns returns the reservation with its check-in schedule, and
+# the MapCheckIns state projects each check-in's event out of it, holding
+# only what the check-in needs: the passenger, the address to notify and that
+# check-in's own time. Events are versioned because executions keep the
+# definition they started with, so events shaped by older definitions reach
+# the current handlers until those executions finish:
+#
+#   0. From before the Map state, checking in one flight at a time.
+#      `check_in_times` holds the `next` check-in time and those `remaining`.
+#   1. Unversioned. Each check-in event carried the reservation's whole list
+#      of `check_in_times`.
+#   2. Each check-in event carries only its own `time`. Events of newer
+#      definitions also carry the `execution` checking in.
+#
+# The functions below read an event of any version.
+#
+
+SCHEMA_VERSION = 2
+
+# Fields of the reservation each check-in event carries
+RESERVATION_FIELDS = ('first_name', 'last_name', 'confirmation_number', 'email')
+
+
+def get_version(event):
+    if 'version' in event:
+        return event['version']
+    return 0 if isinstance(event.get('check_in_times'), dict) else 1
+
+
+def schedule(reservation, check_in_times, check_in_schedule):
+    """
+    Builds the output of ScheduleCheckIns. `check_in_times` is kept whole
+    for tools which read the schedule from the execution history, but isn't
+    passed on to the check-ins.
+    """
+    event = {f: reservation.get(f) for f in RESERVATION_FIELDS}
+    event.update(version=SCHEMA_VERSION, check_in_times=check_in_times, check_in_schedule=check_in_schedule)
+    return event
+
+
+def get_check_in_times(event):
+    """
+    Returns the check-in times an event is responsible for: its own, or for
+    unversioned and legacy events, every one they carry
+    """
+    version = get_version(event)
+    if version == 0:
+        check_in_times = event['check_in_times']
+        return [t for t in [check_in_times.get('next')] + check_in_times.get('remaining', []) if t]
+    if version == 1:
+        return event.get('check_in_times', [])
+    return [event['time']] if event.get('time') else []
+
+
+def get_remaining(event):
+    """
+    Returns the check-in times a legacy event still has to schedule itself.
+    Later events have every check-in scheduled up front, so this is empty.
+    """
+    if get_version(event) == 0:
+        return event['check_in_times'].get('remaining', [])
+    return []
@@ -1,6 +1,17 @@
 class SouthwestAPIError(Exception):
-    pass
+    def __init__(self, message='', status_code=None, message_key=None):
+        super().__init__(message)
+        # HTTP status and Southwest's `messageKey` from the error response, if any
+        self.status_code = status_code
+        self.message_key = message_key
 
 
 class ReservationNotFoundError(Exception):
     pass
+
+
+class NotificationError(Exception):
+    def __init__(self, message='', status=None):
+        super().__init__(message)
+        # SES's delivery status for the destination, if any
+        self.status = status
@@ -1,32 +1,259 @@
 import logging
+import os
 import sys
+import time
 
-import swa, exceptions, mail
+import events
+import exceptions
+import handlers
+import history
+import metrics
+import schedule_index
+import swa
+import timeutil
+
+# notifications (and boto3 with it, via aws) and swa_async are imported where they're
+# used so that a cold start loads only what's needed to check in.
 
 # Set up logging
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+# The check-in function's time limit, set from terraform/lambda.tf
+LAMBDA_TIMEOUT = int(os.getenv("LAMBDA_TIMEOUT", 30))
+# Longest the handler waits for background emails before returning
+DRAIN_TIMEOUT = 3
+# Longest we'll hold a prepared check-in waiting for its scheduled time:
+# whatever the Lambda timeout leaves after preparing the check-in, retrying
+# it and sending emails, less a second for everything else.
+MAX_WAIT_SECONDS = max(0, LAMBDA_TIMEOUT - (swa.PREPARE_CONNECT_TIMEOUT + swa.PREPARE_READ_TIMEOUT) -
+                       swa.CHECK_IN_RETRY_BUDGET - DRAIN_TIMEOUT - 1)
+# Maximum number of reservations checked in at once in batch mode
+BATCH_CONCURRENCY = swa.POOL_SIZE
+# The SES client is set up in the background while a check-in is prepared,
+# but only if the check-in will be sent at least this many seconds later, so
+# that setting it up can't hold up the precisely timed request.
+WARM_UP_MIN_LEAD = 2
+# Boarding positions per group, for turning A12 or B5 into a single number
+BOARDING_GROUP_SIZE = 60
+
+# Seconds spent loading the handler and its dependencies, which is most of a
+# cold start. Reported by the first invocation.
+_init_duration = time.monotonic() - handlers.IMPORT_STARTED
+_cold_start = True
+
+
+def _get_fire_time(event):
+    """
+    Returns the scheduled check-in `time` from the event as a Unix timestamp,
+    or None if the check-in should be sent immediately.
+    """
+    if not event.get('time'):
+        return None
+
+    fire_time = timeutil.parse(event['time']).timestamp()
+    wait = fire_time - time.time()
+
+    if wait > MAX_WAIT_SECONDS:
+        log.warning("Check-in time {} is {:.1f}s away, not waiting".format(event['time'], wait))
+        return None
 
-def _generate_email_body(response):
-    body = "I just checked in to your flight! Please login to Southwest to view your boarding passes.\n"
+    return fire_time
+
+
+def _get_flight_summary(response):
+    summary = ""
     for flight in response['checkInConfirmationPage']['flights']:
-        body += f"\n{flight['originAirportCode']} => {flight['destinationAirportCode']} (#{flight['flightNumber']})\n"
+        summary += "\n{} => {} (#{})\n".format(
+            flight['originAirportCode'], flight['destinationAirportCode'], flight['flightNumber']
+        )
         for passenger in flight['passengers']:
             # Child and infant fares might check in without a boarding group/position
             if 'boardingGroup' in passenger:
-                body += f"  - {passenger['name']}: {passenger['boardingGroup']}{passenger['boardingPosition']}\n"
+                summary += f"  - {passenger['name']}: {passenger['boardingGroup']}{passenger['boardingPosition']}\n"
             else:
-                body += f"  - {passenger['name']}\n"
-    return body
+                summary += f"  - {passenger['name']}\n"
+    return summary
+
+
+def _get_boarding_positions(response):
+    # Boarding positions counted from A1, so A12 is 12 and B5 is 65
+    positions = []
+    for flight in response.get('checkInConfirmationPage', {}).get('flights', []):
+        for passenger in flight['passengers']:
+            if 'boardingGroup' in passenger:
+                group = "ABC".index(passenger['boardingGroup'])
+                positions.append(group * BOARDING_GROUP_SIZE + int(passenger['boardingPosition']))
+    return positions
+
+
+def _record_check_in(event, response=None, error=None, prepared=None, fire_time=None):
+    """
+    Records how a check-in went, as metrics and in the check-in history.
+    Retries, lateness and latency are only known for prepared check-ins,
+    and lateness only when we waited for the check-in time.
+    """
+    retries = lateness = latency = fired = None
+    if prepared is not None and prepared.sent_at is not None:
+        retries, fired, latency = prepared.attempts - 1, prepared.sent_at, prepared.latency
+        if fire_time is not None:
+            # How long after the scheduled time the POST left, by Southwest's clock
+            lateness = fired + (swa.clock_skew.skew or 0) - fire_time
+
+    positions = []
+    if response is not None:
+        try:
+            positions = _get_boarding_positions(response)
+        except (KeyError, ValueError) as e:
+            log.warning("Error parsing boarding positions from check-in response: {}".format(e))
+
+    if error is None:
+        dimensions = {'Retries': retries} if retries is not None else None
+        metrics.record("CheckInSuccess", 1, "Count", dimensions)
+        if lateness is not None:
+            metrics.record("CheckInLateness", lateness * 1000, "Milliseconds", dimensions)
+        for position in positions:
+            metrics.record("BoardingPosition", position, "None", dimensions)
+        outcome = history.ALREADY_CHECKED_IN if response.get('alreadyCheckedIn') else history.CHECKED_IN
+    else:
+        metrics.record("CheckInFailure", 1, "Count")
+        outcome = type(error).__name__
+
+    check_in_history = history.get_history()
+    if check_in_history:
+        scheduled = timeutil.parse(event['time']).timestamp() if event.get('time') else None
+        check_in_history.record(
+            event['confirmation_number'], outcome, scheduled=scheduled, fired=fired, lateness=lateness,
+            latency=latency, retries=retries, boarding_positions=positions, execution=event.get('execution')
+        )
+
+
+def _get_metric_dimensions(event):
+    # Metrics are sliced by the hour of the day (UTC) check-ins are scheduled
+    # for, and by whether the Lambda container was new
+    scheduled = event.get('time') or (event.get('reservations') or [{}])[0].get('time')
+    try:
+        timestamp = timeutil.parse(scheduled).timestamp()
+    except (TypeError, ValueError):
+        timestamp = time.time()
+    return {
+        'Hour': time.gmtime(timestamp).tm_hour,
+        'Start': "cold" if _cold_start else "warm"
+    }
+
+
+def _queue_success_email(dispatcher, email, response):
+    # TODO(dw): This should probably be a separate task in the step function
+    if response.get('alreadyCheckedIn'):
+        # We never saw the response that checked in, so there are no
+        # boarding positions to send
+        dispatcher.queue(email, 'already_checked_in', {})
+        return
+
+    flights = ""
+    try:
+        flights = _get_flight_summary(response)
+    except Exception as e:
+        log.warning("Error parsing flight details from check-in response: {}".format(e))
+
+    dispatcher.queue(email, 'checked_in', {'flights': flights})
+
+
+def _send_emails(dispatcher):
+    for result in dispatcher.flush():
+        if isinstance(result, Exception):
+            log.warning("Error sending email: {}".format(result))
+
+
+def _remove_from_index(event, cancelled=False):
+    # Drops a finished check-in from the schedule index, or every check-in
+    # for the reservation if it's been cancelled
+    index = schedule_index.get_schedule_index()
+    if not index:
+        return
+
+    if cancelled:
+        index.remove(event['confirmation_number'])
+    elif event.get('time'):
+        index.remove(event['confirmation_number'], [event['time']])
+    else:
+        index.remove_past(event['confirmation_number'], events.get_check_in_times(event))
+
+
+def _check_in_batch(reservations):
+    """
+    Checks in a list of reservations concurrently. Returns a result for each
+    reservation, in order, rather than raising on the first failure.
+    """
+    import notifications
+    import swa_async
+    log.info("Checking in {} reservations".format(len(reservations)))
+
+    check_ins = [
+        dict(
+            first_name=r['first_name'],
+            last_name=r['last_name'],
+            confirmation_number=r['confirmation_number'],
+            at=_get_fire_time(r)
+        )
+        for r in reservations
+    ]
+    responses = swa_async.run(swa_async.check_in_all(check_ins, concurrency=BATCH_CONCURRENCY))
+
+    # Success emails are sent together once every check-in is done
+    dispatcher = notifications.Dispatcher()
+    results = []
+    for reservation, resp in zip(reservations, responses):
+        result = {'confirmation_number': reservation['confirmation_number']}
+
+        if isinstance(resp, Exception):
+            log.error("Error checking in {}: {}".format(reservation['confirmation_number'], resp))
+            result['error'] = type(resp).__name__
+            result['message'] = str(resp)
+            _record_check_in(reservation, error=resp)
+            if isinstance(resp, exceptions.ReservationNotFoundError):
+                _remove_from_index(reservation, cancelled=True)
+        else:
+            log.info("Checked in {} successfully!".format(reservation['confirmation_number']))
+            result['checked_in'] = True
+            _record_check_in(reservation, resp)
+            _remove_from_index(reservation)
+            _queue_success_email(dispatcher, reservation.get('email'), resp)
+
+        results.append(result)
+
+    _send_emails(dispatcher)
+    return results
 
 
 def main(event, context):
     """
     This function is triggered at check-in time and completes the check-in via
     the Southwest API and emails the reservation, if requested.
+
+    Events with a `reservations` list are checked in concurrently as a batch,
+    and a list of per-reservation results is returned.
+
+    Timings for the check-in are collected as it runs and emitted as metrics
+    once it's done.
     """
+    global _cold_start
+
+    started = time.monotonic()
+    with metrics.collect(_get_metric_dimensions(event)):
+        if _cold_start:
+            metrics.record("InitDuration", _init_duration * 1000, "Milliseconds")
+            _cold_start = False
+
+        try:
+            if 'reservations' in event:
+                return _check_in_batch(event['reservations'])
+            return _check_in(event)
+        finally:
+            metrics.record("HandlerDuration", (time.monotonic() - started) * 1000, "Milliseconds")
 
+
+def _check_in(event):
     confirmation_number = event['confirmation_number']
     email = event['email']
     first_name = event['first_name']
@@ -36,35 +263,40 @@ def main(event, context):
         first_name, last_name, confirmation_number
     ))
 
-    try:
-        resp = swa.check_in(first_name, last_name, confirmation_number)
-        log.info("Checked in successfully!")
-        log.debug("Check-in response: {}".format(resp))
-    except exceptions.ReservationNotFoundError:
-        log.error("Reservation {} not found. It may have been cancelled".format(confirmation_number))
-        raise
-    except Exception as e:
-        log.error("Error checking in: {}".format(e))
-        raise
-
-    # Send success email
-    # TODO(dw): This should probably be a separate task in the step function
-    subject = "You're checked in!"
-    body = "I just checked into your flight! Please login to Southwest to view your boarding passes."
+    import notifications
+    fire_time = _get_fire_time(event)
+    if email and (fire_time is None or fire_time - time.time() > WARM_UP_MIN_LEAD):
+        notifications.warm_up()
 
+    prepared = None
     try:
-        body = _generate_email_body(resp)
-    except Exception as e:
-        log.warning("Error parsing flight details from check-in response: {}".format(e))
+        try:
+            # Stage the check-in while the state machine's Wait ends a few seconds
+            # early, then send it on the exact second.
+            prepared = swa.prepare_check_in(first_name, last_name, confirmation_number)
+            resp = swa.fire_check_in(prepared, at=fire_time)
+            log.info("Checked in successfully!")
+            log.debug("Check-in response: {}".format(resp))
+        except exceptions.ReservationNotFoundError as e:
+            log.error("Reservation {} not found. It may have been cancelled".format(confirmation_number))
+            _record_check_in(event, error=e, prepared=prepared, fire_time=fire_time)
+            _remove_from_index(event, cancelled=True)
+            raise
+        except Exception as e:
+            log.error("Error checking in: {}".format(e))
+            _record_check_in(event, error=e, prepared=prepared, fire_time=fire_time)
+            raise
 
-    try:
-        mail.send_ses_email(email, subject, body)
-    except Exception as e:
-        log.warning("Error sending email: {}".format(e))
+        # Send the success email while the outcome is recorded
+        dispatcher = notifications.Dispatcher()
+        _queue_success_email(dispatcher, email, resp)
+        notifications.submit(_send_emails, dispatcher)
+
+        _record_check_in(event, resp, prepared=prepared, fire_time=fire_time)
+        _remove_from_index(event)
+    finally:
+        notifications.drain(DRAIN_TIMEOUT)
 
     # Older events use check_in_times.remaining to track remaining check-ins
     # TODO(dw): Remove this when old events are deprecated
-    if 'remaining' in event['check_in_times'] and len(event['check_in_times']['remaining']) > 0:
-        return False
-
-    return True
+    return not events.get_remaining(event)
@@ -1,4 +1,6 @@
-import mail
+import events
+import notifications
+import schedule_index
 
 
 def main(event, context):
@@ -7,26 +9,18 @@ def main(event, context):
     to the user letting them know that they need to check in manually.
     """
 
-    confirmation_number = event['confirmation_number']
-    email = event['email']
-    first_name = event['first_name']
-    last_name = event['last_name']
+    # The failed check-in is no longer pending
+    index = schedule_index.get_schedule_index()
+    if index:
+        index.remove_past(event['confirmation_number'], events.get_check_in_times(event))
 
-    subject = "Error checking in to your flight"
-    body = (
-        "Sorry! There was an error checking in to your flight. "
-        "Please check in to your flight manually to get your boarding passes.\n\n"
-        f"First Name: {first_name}\n"
-        f"Last Name: {last_name}\n"
-        f"Confirmation #{confirmation_number}\n\n"
-        "https://www.southwest.com/air/check-in/index.html"
-    )
-    mail.send_ses_email(email, subject, body)
+    notifications.send(event['email'], 'check_in_failed', {
+        'first_name': event['first_name'],
+        'last_name': event['last_name'],
+        'confirmation_number': event['confirmation_number']
+    })
 
     # TODO(dw): DRY and move this into a separate task instead of duplicating
     #           here and in the check in handler.
     # Return False to indicate that there are check-ins remaining
-    if len(event['check_in_times']['remaining']) > 0:
-        return False
-
-    return True
+    return not events.get_remaining(event)
@@ -1,40 +1,130 @@
 import json
 import logging
 import os
-import time
-
-import boto3
+import re
 
+import aws
+import cache
+import exceptions
+import idempotency
 import mail
+import metrics
+import swa
 
 # Set up logging
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+# Step Functions execution names are limited to 80 characters of letters,
+# numbers, hyphens and underscores
+MAX_EXECUTION_NAME_LENGTH = 80
+# Statuses of an execution which stopped without checking in, so the next
+# arrival of its reservation starts another
+CLOSED_UNSUCCESSFULLY = ('FAILED', 'TIMED_OUT', 'ABORTED')
+# Connect and read timeouts for the departure lookup. Kept well inside the
+# function's 30s timeout (terraform/lambda.tf), which also covers claiming the
+# reservation, starting its execution and replying to the sender.
+LOOKUP_TIMEOUT = (swa.CONNECT_TIMEOUT, 5)
+
 
-def _get_sfn_execution_name(reservation):
+def _get_departures(reservation):
+    """
+    Looks up the reservation's check-in times, past and future, which stand in
+    for its departure set. Returns None if Southwest can't find the
+    reservation; the state machine reports that to the passenger as usual.
+    Any other error is raised, since without departures the reservation
+    can't be told apart from other itineraries under the same confirmation
+    number.
+    """
+    try:
+        return swa.Reservation.from_passenger_info(
+            reservation['first_name'],
+            reservation['last_name'],
+            reservation['confirmation_number'],
+            cache=cache.get_reservation_cache(),
+            timeout=LOOKUP_TIMEOUT
+        ).get_check_in_times(expired=True)
+    except exceptions.ReservationNotFoundError as e:
+        log.warning("Unable to find departures for {}: {}".format(reservation['confirmation_number'], e))
+        return None
+
+
+def _get_sfn_execution_name(reservation, departures=None, attempt=1):
     """
     Generate a human-readable execution named composed of the passenger's
-    check in details followed by a timestamp
+    check in details followed by a fingerprint of the departures. The name is
+    the same every time a reservation arrives, so Step Functions rejects a
+    duplicate that gets past the idempotency store. Without departures, the
+    name has no fingerprint.
+
+    Step Functions keeps the names of closed executions for 90 days, so each
+    `attempt` after the first, started because the one before it failed, is
+    suffixed with its number.
     """
-    name = "{}-{}-{}-{}".format(
+    name = "{}-{}-{}".format(
         reservation['last_name'].lower().replace(' ', '-'),
         reservation['first_name'].lower(),
-        reservation['confirmation_number'].lower(),
-        int(time.time())
+        reservation['confirmation_number'].lower()
     )
-    return name
+    if departures:
+        name += "-" + idempotency.fingerprint(departures)
+    if attempt > 1:
+        name += "-{}".format(attempt)
+    name = re.sub(r'[^\w-]', '', name)
+    # Keep the suffix if the passenger's name is long
+    return name[-MAX_EXECUTION_NAME_LENGTH:]
+
+
+def _get_execution_arn(state_machine_arn, name):
+    return "{}:{}".format(state_machine_arn.replace(':stateMachine:', ':execution:'), name)
+
+
+def _closed_unsuccessfully(sfn, execution_arn):
+    """
+    Returns whether an earlier arrival's execution stopped without checking
+    in. An execution which doesn't exist yet is taken to be starting, and one
+    which can't be described to be running, rather than risk checking in
+    twice.
+    """
+    try:
+        status = sfn.describe_execution(executionArn=execution_arn)['status']
+    except sfn.exceptions.ExecutionDoesNotExist:
+        return False
+    except Exception as e:
+        log.warning("Unable to describe execution {}: {}".format(execution_arn, e))
+        return False
+
+    log.debug("Execution {} is {}".format(execution_arn, status))
+    return status in CLOSED_UNSUCCESSFULLY
+
+
+def _reply_duplicate(reservation):
+    # Let the sender know the forward wasn't lost
+    if not reservation.get('email'):
+        return
+    try:
+        mail.send_already_scheduled(reservation['email'], reservation['confirmation_number'])
+    except Exception as e:
+        log.warning("Unable to send already scheduled email: {}".format(e))
 
 
+@metrics.collect()
 def main(event, context):
     """
     This function is triggered when as an SES Action when a new e-mail is
     received. It scrapes the email to find the name and confirmation
     number of the passenger to check-in, and then executes the AWS Step
     state machine provided in the `STATE_MACHINE_ARN` environment variable.
+
+    A reservation that has already been received (see `idempotency`) doesn't
+    start another execution; the earlier execution is returned instead, with
+    `duplicate` set, and the sender is told it's already scheduled. If the
+    earlier execution failed, another is started under the next attempt's
+    name. Metrics recorded along the way are emitted together when it
+    returns.
     """
 
-    sfn = boto3.client('stepfunctions')
+    sfn = aws.client('stepfunctions')
     ses_notification = event['Records'][0]['ses']
     # ARN of the AWS Step State Machine to execute when an email
     # is successfully parsed and a new check-in should run.
@@ -58,11 +148,54 @@ def main(event, context):
     if not ses_msg.from_email.endswith('southwest.com'):
         reservation['email'] = ses_msg.from_email
 
-    execution = sfn.start_execution(
-        stateMachineArn=state_machine_arn,
-        name=_get_sfn_execution_name(reservation),
-        input=json.dumps(reservation)
-    )
+    try:
+        departures = _get_departures(reservation)
+    except Exception as e:
+        # Let SES's retry of this invocation try again, rather than claiming
+        # the reservation under a key a successful lookup wouldn't use
+        log.error("Error looking up departures for {}: {}".format(reservation['confirmation_number'], e))
+        raise
+
+    name = _get_sfn_execution_name(reservation, departures)
+
+    store = idempotency.get_store()
+    key = idempotency.reservation_key(reservation['confirmation_number'], departures)
+    claimed = store.claim(key, {'name': name})
+    if claimed is not None:
+        # The execution the earlier arrival started
+        earlier_arn = _get_execution_arn(state_machine_arn, claimed.get('name', name))
+        if not _closed_unsuccessfully(sfn, earlier_arn):
+            log.info("Already received reservation {}, not starting another execution".format(key))
+            _reply_duplicate(reservation)
+            return {'executionArn': earlier_arn, 'duplicate': True}
+
+        # Arrivals racing to replace the same execution pick the same name,
+        # so Step Functions still starts only one of them
+        attempt = claimed.get('attempt', 1) + 1
+        name = _get_sfn_execution_name(reservation, departures, attempt)
+        log.info("Execution {} failed, starting {}".format(earlier_arn, name))
+        store.release(key)
+        store.claim(key, {'name': name, 'attempt': attempt})
+
+    duplicate = {'executionArn': _get_execution_arn(state_machine_arn, name), 'duplicate': True}
+
+    try:
+        execution = sfn.start_execution(
+            stateMachineArn=state_machine_arn,
+            name=name,
+            input=json.dumps(reservation)
+        )
+    except sfn.exceptions.ExecutionAlreadyExists:
+        log.info("Execution {} already exists".format(name))
+        _reply_duplicate(reservation)
+        return duplicate
+    except Exception:
+        # Let SES's retry of this invocation try again, from the failed
+        # execution if this was to replace one
+        store.release(key)
+        if claimed is not None:
+            store.claim(key, claimed)
+        raise
 
     log.debug("State machine started at: {}".format(execution['startDate']))
     log.debug("Execution ARN: {}".format(execution['executionArn']))
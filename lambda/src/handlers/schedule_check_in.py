@@ -1,25 +1,65 @@
+import datetime
 import json
 import logging
+import os
 
-import swa, mail
+import cache
+import events
+import mail
+import metrics
+import notifications
+import schedule_index
+import swa
+import timeutil
 
 # Set up logging
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+# How many seconds before each check-in time the state machine wakes the
+# check-in handler, which then waits out the remainder itself.
+CHECK_IN_LEAD_SECONDS = int(os.getenv('CHECK_IN_LEAD_SECONDS', 5))
 
+
+def _get_check_in_schedule(check_in_times):
+    """
+    Pairs each check-in time with the earlier time at which the state machine
+    should stop waiting and invoke the check-in handler.
+    """
+    return [
+        {
+            'time': t,
+            'wait_until': (timeutil.parse(t) - datetime.timedelta(seconds=CHECK_IN_LEAD_SECONDS)).isoformat()
+        }
+        for t in check_in_times
+    ]
+
+
+def _send_confirmation(email_address, reservation):
+    try:
+        mail.send_confirmation(email_address, reservation=reservation)
+    except Exception as e:
+        log.warning("Unable to send confirmation email: {}".format(e))
+
+
+@metrics.collect()
 def main(event, context):
     """
     This handler looks up the Southwest Reservation via the API to retrieve flight times.
 
-    Returns a dictionary containing details for the rest of the check-in
+    Returns the reservation and its check-in schedule, see `events.schedule`.
+    The schedule is empty if bucket_scheduler is checking in from the schedule
+    index instead (see `schedule_index.CHECK_IN_MODE`).
+    Legacy events are returned with their next check-in time set instead.
+    Metrics recorded along the way are emitted together when it returns.
     """
 
     # Handle older check-in events TODO(dw): Deprecate this
-    # We already have the check-in times, just schedule the next one.
-    if 'check_in_times' in event:
-        event['check_in_times']['next'] = \
-            event['check_in_times']['remaining'].pop()
+    # We already have the check-in times, just schedule the next one. The
+    # executions sending these run the definition from before the Map state,
+    # which expects the event back with `check_in_times.next` set.
+    if events.get_version(event) == 0:
+        event['check_in_times']['next'] = event['check_in_times']['remaining'].pop()
         return event
 
     # New check-in, fetch reservation
@@ -29,26 +69,49 @@ def main(event, context):
     email_address = event.get('email')
     send_confirmation = event.get('send_confirmation_email', True)
 
-    log.info("Looking up reservation {} for {} {}".format(confirmation_number,
-                                                          first_name, last_name))
-    reservation = swa.Reservation.from_passenger_info(
-        first_name, last_name, confirmation_number
-    )
-    log.debug("Reservation: {}".format(reservation))
-
-    result = {
-        'check_in_times': reservation.check_in_times,
-        'first_name': first_name,
-        'last_name': last_name,
-        'confirmation_number': confirmation_number,
-        'email': email_address
-    }
-
-    # Send a confirmation email
-    if email_address and send_confirmation:
-        try:
-            mail.send_confirmation(email_address, reservation=reservation)
-        except Exception as e:
-            log.warning("Unable to send confirmation email: {}".format(e))
-
-    return result
+    notify = email_address and send_confirmation
+    if notify:
+        # Set up the SES client while we wait on Southwest
+        notifications.warm_up()
+
+    try:
+        log.info("Looking up reservation {} for {} {}".format(confirmation_number,
+                                                              first_name, last_name))
+        reservation = swa.Reservation.from_passenger_info(
+            first_name, last_name, confirmation_number,
+            cache=cache.get_reservation_cache()
+        )
+        log.debug("Reservation: {}".format(reservation))
+
+        # Send a confirmation email in the background
+        if notify:
+            notifications.submit(_send_confirmation, email_address, reservation)
+
+        check_in_times = reservation.check_in_times
+        check_in_schedule = _get_check_in_schedule(check_in_times)
+        index = schedule_index.get_schedule_index()
+        indexed = index and index.add(confirmation_number, check_in_times, first_name, last_name, email_address)
+
+        if schedule_index.CHECK_IN_MODE == schedule_index.BUCKETS:
+            if indexed:
+                # bucket_scheduler checks these in from the index, so the
+                # execution's Map state has nothing to do
+                check_in_schedule = []
+            elif index:
+                log.error("Unable to add {} to the schedule index, checking in from the execution".format(
+                    confirmation_number))
+            else:
+                log.error("CHECK_IN_MODE is {} without a schedule index, checking in from the execution".format(
+                    schedule_index.BUCKETS))
+
+        return events.schedule(
+            {
+                'first_name': first_name,
+                'last_name': last_name,
+                'confirmation_number': confirmation_number,
+                'email': email_address
+            },
+            check_in_times, check_in_schedule
+        )
+    finally:
+        notifications.drain()
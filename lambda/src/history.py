@@ -0,0 +1,259 @@
+#
+# history.py
+# A history of check-in outcomes
+#
+# The check-in handler records how each check-in went: when it was scheduled,
+# when the POST actually left, how long Southwest took to answer, how many
+# POSTs it took and the boarding position it got. scripts/check-in-report.py
+# aggregates the history so check-in timing and capacity can be tuned from
+# real outcomes.
+#
+# Deployed, the history is a DynamoDB table. Locally, e.g. for a simulated
+# run, it can be a SQLite database instead.
+#
+
+import logging
+import math
+import os
+import time
+
+import aws
+import storage
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+# DynamoDB table holding the history
+CHECK_IN_HISTORY_TABLE = os.getenv("CHECK_IN_HISTORY_TABLE")
+# SQLite database holding the history, used if CHECK_IN_HISTORY_TABLE isn't
+# set. If neither is set, no history is kept.
+CHECK_IN_HISTORY_DB = os.getenv("CHECK_IN_HISTORY_DB")
+
+# Rows are appended in the order check-ins finish. A retry of the same
+# execution's check-in for the same flight replaces the row of the attempt
+# before it, see SQLiteHistory.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outcomes (
+    execution TEXT,
+    confirmation_number TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    scheduled REAL,
+    fired REAL,
+    lateness REAL,
+    latency REAL,
+    retries INTEGER,
+    boarding_position INTEGER,
+    passengers INTEGER
+);
+CREATE INDEX IF NOT EXISTS outcomes_scheduled ON outcomes (scheduled);
+"""
+
+# Created once an older database has been given the execution column
+UNIQUE_INDEX = """
+CREATE UNIQUE INDEX IF NOT EXISTS outcomes_check_in ON outcomes (execution, confirmation_number, scheduled);
+"""
+
+FIELDS = (
+    'execution', 'confirmation_number', 'outcome', 'scheduled', 'fired', 'lateness', 'latency', 'retries',
+    'boarding_position', 'passengers'
+)
+
+# Fields stored as strings and as whole numbers. The rest are REAL numbers.
+STRING_FIELDS = ('execution', 'confirmation_number', 'outcome')
+INTEGER_FIELDS = ('retries', 'boarding_position', 'passengers')
+
+DAY = 86400
+
+# Outcomes other than an error's class name
+CHECKED_IN = "checked_in"
+ALREADY_CHECKED_IN = "already_checked_in"
+
+
+class SQLiteHistory(storage.SQLiteDatabase):
+    """
+    A check-in history stored in SQLite. Times are Unix timestamps and
+    durations are seconds, stored as REALs.
+
+    An outcome with the same execution, confirmation number and scheduled
+    time as one already stored replaces it. SQLite never counts NULLs as
+    equal, so outcomes missing any of those are always appended.
+    """
+
+    def __init__(self, path):
+        super().__init__(path, SCHEMA)
+        with self._lock, self._conn:
+            columns = [row['name'] for row in self._conn.execute("PRAGMA table_info(outcomes)")]
+            if 'execution' not in columns:
+                self._conn.execute("ALTER TABLE outcomes ADD COLUMN execution TEXT")
+            self._conn.executescript(UNIQUE_INDEX)
+
+    def append(self, outcomes):
+        with self._lock, self._conn:
+            query = "INSERT OR REPLACE INTO outcomes ({}) VALUES ({})"
+            self._conn.executemany(
+                query.format(", ".join(FIELDS), ", ".join("?" * len(FIELDS))),
+                [tuple(o.get(f) for f in FIELDS) for o in outcomes]
+            )
+
+    def between(self, start=None, end=None):
+        query = "SELECT * FROM outcomes"
+        params = []
+        if start is not None or end is not None:
+            query += " WHERE scheduled >= ? AND scheduled < ?"
+            params = [start if start is not None else float("-inf"), end if end is not None else float("inf")]
+
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(query + " ORDER BY rowid", params)]
+
+
+class DynamoDBHistory(object):
+    """
+    A check-in history stored in a DynamoDB table keyed by the day the
+    check-in was scheduled for, Unix seconds // 86400 (hash), and a string
+    `id` (range). Outcomes without a scheduled time are filed under the day
+    they were recorded.
+
+    The `id` of an outcome with an execution and a scheduled time is made of
+    those and the confirmation number, so a retry's outcome overwrites the
+    one before it. Any other outcome's `id` is made of the time it was
+    recorded and the confirmation number.
+
+    Querying a range of scheduled times reads only the days in range, and
+    outcomes are put back in the order they were recorded. Pass `client` to
+    use a stub locally.
+    """
+
+    def __init__(self, table_name, client=None, now=time.time):
+        self.table_name = table_name
+        self.client = client or aws.client('dynamodb')
+        self._now = now
+
+    def append(self, outcomes):
+        for outcome in outcomes:
+            recorded = self._now()
+            scheduled = outcome.get('scheduled')
+            if outcome.get('execution') and scheduled is not None:
+                key = "{}#{}#{!r}".format(outcome['execution'], outcome['confirmation_number'], float(scheduled))
+            else:
+                key = "{:017.6f}#{}".format(recorded, outcome['confirmation_number'])
+            item = {
+                'day': {'N': str(int((scheduled if scheduled is not None else recorded) // DAY))},
+                'id': {'S': key},
+                'recorded': {'N': repr(recorded)}
+            }
+            # DynamoDB has no nulls, so missing fields are left out
+            for field in FIELDS:
+                if outcome.get(field) is not None:
+                    kind = 'S' if field in STRING_FIELDS else 'N'
+                    item[field] = {kind: str(outcome[field])}
+
+            self.client.put_item(TableName=self.table_name, Item=item)
+
+    @staticmethod
+    def _outcome(item):
+        outcome = {}
+        for field in FIELDS:
+            if field not in item:
+                outcome[field] = None
+            elif field in STRING_FIELDS:
+                outcome[field] = item[field]['S']
+            elif field in INTEGER_FIELDS:
+                outcome[field] = int(item[field]['N'])
+            else:
+                outcome[field] = float(item[field]['N'])
+        return outcome
+
+    def between(self, start=None, end=None):
+        if start is None or end is None:
+            # An open-ended range could be any day, so read everything
+            items = storage.paginate(self.client.scan, TableName=self.table_name)
+        else:
+            items = (
+                item for day in range(int(start // DAY), int(math.ceil(end / DAY)))
+                for item in storage.paginate(
+                    self.client.query,
+                    TableName=self.table_name,
+                    KeyConditionExpression="#day = :day",
+                    ExpressionAttributeNames={'#day': 'day'},
+                    ExpressionAttributeValues={':day': {'N': str(day)}}
+                )
+            )
+
+        items = sorted(items, key=lambda item: float(item['recorded']['N']))
+        outcomes = [self._outcome(item) for item in items]
+        if start is None and end is None:
+            return outcomes
+
+        start = start if start is not None else float("-inf")
+        end = end if end is not None else float("inf")
+        return [o for o in outcomes if o['scheduled'] is not None and start <= o['scheduled'] < end]
+
+
+class CheckInHistory(object):
+    """
+    Records check-in outcomes in a backend, which implements append and
+    between like SQLiteHistory and DynamoDBHistory. An outcome the backend
+    fails to store is logged and lost: it's recorded after the check-in, so
+    there's nothing left to protect, and reports tolerate gaps.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def record(self, confirmation_number, outcome, scheduled=None, fired=None, lateness=None, latency=None,
+               retries=None, boarding_positions=(), execution=None):
+        """
+        Records one check-in. `outcome` is CHECKED_IN, ALREADY_CHECKED_IN or
+        the class name of the error which stopped it. `scheduled` and `fired`
+        are Unix timestamps, `lateness` is how long after `scheduled` the POST
+        was sent by Southwest's clock and `latency` how long the POST took.
+
+        The best of the `boarding_positions` received is kept, along with
+        the number of passengers.
+
+        `execution` is the state machine execution checking in. Given it and
+        `scheduled`, recording a retried check-in replaces the outcome of the
+        attempt before it rather than adding another.
+        """
+        row = {
+            'execution': execution,
+            'confirmation_number': confirmation_number,
+            'outcome': outcome,
+            'scheduled': scheduled,
+            'fired': fired,
+            'lateness': lateness,
+            'latency': latency,
+            'retries': retries,
+            'boarding_position': min(boarding_positions) if boarding_positions else None,
+            'passengers': len(boarding_positions) if boarding_positions else None
+        }
+        with storage.log_errors(log, "Error recording check-in outcome for {}".format(confirmation_number)):
+            self.backend.append([row])
+
+    def between(self, start=None, end=None):
+        """
+        Returns the outcomes of check-ins scheduled from `start` up to (but
+        not including) `end`, as Unix timestamps, in the order they were
+        recorded. Without either, every outcome is returned.
+        """
+        return self.backend.between(start, end)
+
+
+_history = None
+
+
+def get_history():
+    """
+    Returns the process-wide check-in history, backed by DynamoDB if
+    `CHECK_IN_HISTORY_TABLE` is set or by SQLite if `CHECK_IN_HISTORY_DB`
+    is. Returns None if neither is set.
+    """
+    global _history
+
+    if _history is None:
+        if CHECK_IN_HISTORY_TABLE:
+            _history = CheckInHistory(DynamoDBHistory(CHECK_IN_HISTORY_TABLE))
+        elif CHECK_IN_HISTORY_DB:
+            _history = CheckInHistory(SQLiteHistory(CHECK_IN_HISTORY_DB))
+
+    return _history
@@ -0,0 +1,170 @@
+#
+# idempotency.py
+# Remembers which reservations have been handed to the state machine
+#
+# The same reservation reaches the receive-email handler more than once: a
+# passenger forwards the confirmation email twice, or SES retries the async
+# Lambda invocation. Each arrival is claimed here by confirmation number and
+# departure set before an execution is started, so only the first arrival in
+# a window schedules check-ins.
+#
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+import aws
+import storage
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+# Seconds a claimed reservation blocks further arrivals of the same reservation
+IDEMPOTENCY_WINDOW = int(os.getenv("IDEMPOTENCY_WINDOW", 7 * 24 * 3600))
+# DynamoDB table shared between Lambda containers. If unset, each container
+# only remembers the reservations it has seen itself.
+IDEMPOTENCY_TABLE = os.getenv("IDEMPOTENCY_TABLE")
+
+
+def fingerprint(departures):
+    """
+    Returns a short, order-independent digest of a reservation's departure
+    (or check-in) times
+    """
+    digest = hashlib.sha1("|".join(sorted(departures)).encode('utf-8')).hexdigest()
+    return digest[:12]
+
+
+def reservation_key(confirmation_number, departures=None):
+    """
+    Returns the key a reservation is claimed under. Without departures, every
+    itinerary for the confirmation number shares a key.
+    """
+    key = confirmation_number.upper()
+    if departures:
+        key += ":" + fingerprint(departures)
+    return key
+
+
+class MemoryStore(object):
+    """
+    An in-process store of claims which expire after `window` seconds
+    """
+
+    def __init__(self, window, now=time.time):
+        self.window = window
+        self._now = now
+        self._claims = {}
+
+    def __len__(self):
+        return len(self._claims)
+
+    def claim(self, key, value):
+        now = self._now()
+        entry = self._claims.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        self._claims[key] = (now + self.window, value)
+        return None
+
+    def release(self, key):
+        self._claims.pop(key, None)
+
+
+class DynamoDBStore(object):
+    """
+    Claims stored in a DynamoDB table with a string hash key named `key` and
+    TTL enabled on the `expires_at` attribute. Claims are conditional puts,
+    so two containers racing on the same reservation can't both win.
+
+    Values must be JSON serializable. Pass `client` to use a stub locally.
+    """
+
+    def __init__(self, table_name, window, client=None, now=time.time):
+        self.table_name = table_name
+        self.window = window
+        self.client = client or aws.client('dynamodb')
+        self._now = now
+
+    def claim(self, key, value):
+        from botocore.exceptions import ClientError
+
+        now = self._now()
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={
+                    'key': {'S': key},
+                    'value': {'S': json.dumps(value)},
+                    'expires_at': {'N': str(int(now + self.window))}
+                },
+                # DynamoDB removes expired items lazily, so an expired claim
+                # may still be there
+                ConditionExpression="attribute_not_exists(#key) OR expires_at < :now",
+                ExpressionAttributeNames={'#key': 'key'},
+                ExpressionAttributeValues={':now': {'N': str(int(now))}}
+            )
+            return None
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+        item = self.client.get_item(
+            TableName=self.table_name,
+            Key={'key': {'S': key}},
+            ConsistentRead=True
+        ).get('Item')
+        return json.loads(item['value']['S']) if item else {}
+
+    def release(self, key):
+        self.client.delete_item(TableName=self.table_name, Key={'key': {'S': key}})
+
+
+class IdempotencyStore(object):
+    """
+    Claims reservations in a backend. A claim the backend can't answer is
+    logged and treated as new, since a duplicate execution is better than a
+    missed check-in; a failed release leaves the claim to expire.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def claim(self, key, value):
+        """
+        Claims `key`, recording `value` with it. Returns None if the claim is
+        new, or the value recorded by the earlier claim if it's a duplicate.
+        """
+        with storage.log_errors(log, "Error claiming {}".format(key)):
+            return self.backend.claim(key, value)
+        return None
+
+    def release(self, key):
+        """
+        Drops a claim, so the next arrival of the reservation is new again
+        """
+        with storage.log_errors(log, "Error releasing {}".format(key)):
+            self.backend.release(key)
+
+
+_store = None
+
+
+def get_store():
+    """
+    Returns the process-wide idempotency store, backed by DynamoDB if
+    `IDEMPOTENCY_TABLE` is set or by memory otherwise.
+    """
+    global _store
+
+    if _store is None:
+        if IDEMPOTENCY_TABLE:
+            backend = DynamoDBStore(IDEMPOTENCY_TABLE, IDEMPOTENCY_WINDOW)
+        else:
+            backend = MemoryStore(IDEMPOTENCY_WINDOW)
+        _store = IdempotencyStore(backend)
+
+    return _store
@@ -0,0 +1,192 @@
+#
+# metrics.py
+# CloudWatch metrics emitted as embedded metric format (EMF) log lines
+#
+
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+NAMESPACE = os.getenv("METRICS_NAMESPACE", "CheckinBot")
+# Most values CloudWatch accepts for one metric in one EMF line
+MAX_VALUES = 100
+
+
+def _stdout_sink(line):
+    # Lambda ships stdout to CloudWatch Logs, which extracts EMF metrics
+    sys.stdout.write(line + "\n")
+
+
+class MemorySink(object):
+    """
+    A sink which keeps the records it's given instead of printing them, for
+    tests and local runs. Use it with `metrics.sink = MemorySink()`.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, line):
+        self.records.append(json.loads(line))
+
+    def values(self, name, **dimensions):
+        """
+        Returns every value recorded for metric `name`, optionally only those
+        recorded with the given dimension values
+        """
+        values = []
+        for record in self.records:
+            if name not in record:
+                continue
+            if any(record.get(k) != str(v) for k, v in dimensions.items()):
+                continue
+            value = record[name]
+            values.extend(value if isinstance(value, list) else [value])
+        return values
+
+
+# Replaceable so tests can capture metrics instead of printing them
+sink = _stdout_sink
+
+
+def _format(metrics, dimensions):
+    # Each dimension gets its own dimension set, along with an empty one for
+    # the totals, so metrics can be sliced by any one dimension
+    names = sorted(dimensions)
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": NAMESPACE,
+                "Dimensions": [[]] + [[name] for name in names],
+                "Metrics": [{"Name": name, "Unit": unit} for name, (unit, _) in sorted(metrics.items())]
+            }]
+        }
+    }
+    for name in names:
+        record[name] = str(dimensions[name])
+    for name, (_, value) in metrics.items():
+        record[name] = value
+    return json.dumps(record)
+
+
+def put_metric(name, value, unit="None", dimensions=None):
+    """
+    Emits a single metric value in CloudWatch embedded metric format
+    """
+    sink(_format({name: (unit, value)}, dimensions or {}))
+
+
+class MetricSet(object):
+    """
+    Collects metric values and emits them together when flushed, so that
+    recording a value on the hot path is a list append rather than a log
+    write. Values recorded with the same dimensions share an EMF line.
+
+    `dimensions` are added to every value, and can be changed with
+    `set_dimension` until the set is flushed.
+    """
+
+    def __init__(self, dimensions=None):
+        self.dimensions = dict(dimensions or {})
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set_dimension(self, name, value):
+        self.dimensions[name] = value
+
+    def put(self, name, value, unit="None", dimensions=None):
+        key = tuple(sorted((dimensions or {}).items()))
+        with self._lock:
+            metrics = self._values.setdefault(key, {})
+            metrics.setdefault(name, (unit, []))[1].append(value)
+
+    def flush(self):
+        """
+        Emits the values collected so far. Errors are logged rather than
+        raised, as metrics shouldn't fail whatever they're measuring.
+        """
+        with self._lock:
+            values, self._values = self._values, {}
+
+        for key, metrics in values.items():
+            dimensions = dict(self.dimensions, **dict(key))
+            longest = max(len(v) for _, v in metrics.values())
+            for start in range(0, longest, MAX_VALUES):
+                chunk = {}
+                for name, (unit, v) in metrics.items():
+                    v = v[start:start + MAX_VALUES]
+                    if v:
+                        chunk[name] = (unit, v if len(v) > 1 else v[0])
+                try:
+                    sink(_format(chunk, dimensions))
+                except Exception as e:
+                    log.warning("Error emitting metrics {}: {}".format(sorted(chunk), e))
+
+
+# The set `record` adds to, while one is being collected. Each thread has its
+# own, so that handlers running side by side (e.g. in bucket_scheduler's
+# workers) keep their metrics apart.
+_local = threading.local()
+
+
+def _get_active():
+    return getattr(_local, 'active', None)
+
+
+@contextlib.contextmanager
+def _activate(metric_set):
+    previous, _local.active = _get_active(), metric_set
+    try:
+        yield
+    finally:
+        _local.active = previous
+
+
+@contextlib.contextmanager
+def collect(dimensions=None):
+    """
+    Collects the values passed to `record` on this thread, or in functions
+    wrapped with `bind`, into a `MetricSet`, which is flushed when the block
+    exits
+    """
+    metric_set = MetricSet(dimensions)
+    try:
+        with _activate(metric_set):
+            yield metric_set
+    finally:
+        metric_set.flush()
+
+
+def bind(fn):
+    """
+    Wraps `fn` so that the values it records go to the set being collected
+    by the caller, whichever thread it's later called on. For handing work
+    to a thread pool.
+    """
+    metric_set = _get_active()
+
+    @functools.wraps(fn)
+    def bound(*args, **kwargs):
+        with _activate(metric_set):
+            return fn(*args, **kwargs)
+
+    return bound
+
+
+def record(name, value, unit="None", dimensions=None):
+    """
+    Adds a value to the metrics being collected. Values recorded outside of
+    `collect` are dropped, so library code can record timings freely.
+    """
+    metric_set = _get_active()
+    if metric_set is not None:
+        metric_set.put(name, value, unit, dimensions)
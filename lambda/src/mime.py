@@ -0,0 +1,313 @@
+#
+# mime.py
+# Streaming extraction of the readable text of a MIME message
+#
+# Reservation emails are often forwarded with inline images and attachments,
+# and the passenger details may be in a quoted-printable or base64 encoded
+# part, or in a message forwarded as an attachment. Rather than scanning the
+# raw source, this walks the MIME structure (including forwarded messages) a
+# line at a time, skips attachments without holding them in memory, and
+# decodes only the text parts we're going to read.
+#
+
+import binascii
+import codecs
+import email.parser
+import html
+import logging
+import re
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+# Longer lines are split, so that a message without line breaks can't use
+# unbounded memory
+MAX_LINE_LENGTH = 64 * 1024
+# Header blocks are truncated beyond this size
+MAX_HEADER_SIZE = 64 * 1024
+# HTML parts are stripped of markup whole. Anything beyond this size is ignored.
+MAX_HTML_SIZE = 1024 * 1024
+# Approximate number of characters yielded at a time by iter_text
+TEXT_CHUNK_SIZE = 16 * 1024
+# Encoded lines are decoded in batches of about this many bytes
+DECODE_BATCH_SIZE = 16 * 1024
+
+# Regular expressions are crude for HTML, but an order of magnitude faster
+# than html.parser, and all we need is the text to search.
+HTML_SKIP = re.compile(r"<(head|script|style|title)\b.*?</\1\s*>", re.DOTALL | re.IGNORECASE)
+# Elements which separate blocks of text
+HTML_BLOCK_TAG = re.compile(r"</?(?:br|div|h[1-6]|li|p|table|td|th|tr)\b[^>]*>", re.IGNORECASE)
+HTML_TAG = re.compile(r"<!--.*?-->|<[^>]*>", re.DOTALL)
+
+
+class _Lines(object):
+    """
+    Iterates over the lines of a message read as byte chunks, keeping line
+    endings. One line can be pushed back to be read again.
+    """
+
+    def __init__(self, chunks):
+        self._lines = self._split(chunks)
+        self._pushed_back = None
+
+    @staticmethod
+    def _split(chunks):
+        pending = b''
+        for chunk in chunks:
+            pending += chunk
+            start = 0
+            while True:
+                end = pending.find(b'\n', start) + 1
+                if not end:
+                    break
+                yield pending[start:end]
+                start = end
+            pending = pending[start:]
+
+            while len(pending) > MAX_LINE_LENGTH:
+                yield pending[:MAX_LINE_LENGTH]
+                pending = pending[MAX_LINE_LENGTH:]
+
+        if pending:
+            yield pending
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._pushed_back is not None:
+            line, self._pushed_back = self._pushed_back, None
+            return line
+        return next(self._lines)
+
+    def push_back(self, line):
+        self._pushed_back = line
+
+
+def _match_boundary(line, boundaries):
+    """
+    Returns (boundary, closing) if `line` is a delimiter for one of
+    `boundaries`, or (None, False) otherwise
+    """
+    if not line.startswith(b'--'):
+        return None, False
+
+    delimiter = line[2:].rstrip()
+    closing = delimiter.endswith(b'--')
+    if closing:
+        delimiter = delimiter[:-2]
+
+    if delimiter in boundaries:
+        return delimiter, closing
+
+    return None, False
+
+
+def _read_headers(lines):
+    header_lines = []
+    size = 0
+    for line in lines:
+        if not line.strip():
+            break
+        size += len(line)
+        if size <= MAX_HEADER_SIZE:
+            header_lines.append(line)
+
+    return email.parser.BytesParser().parsebytes(b''.join(header_lines), headersonly=True)
+
+
+def _body_lines(lines, boundaries):
+    # Yields the lines of a part's body, stopping at (and leaving unread) the
+    # next delimiter line for any enclosing multipart
+    for line in lines:
+        if _match_boundary(line, boundaries)[0] is not None:
+            lines.push_back(line)
+            return
+        yield line
+
+
+def _walk(headers, lines, boundaries):
+    if headers.get_content_type() == 'message/rfc822':
+        # A forwarded message: walk the message itself, which ends where this
+        # part does
+        body = _body_lines(lines, boundaries)
+        for part in _walk(_read_headers(body), lines, boundaries):
+            yield part
+        for _ in _body_lines(lines, boundaries):
+            pass
+        return
+
+    if headers.get_content_maintype() != 'multipart' or not headers.get_param('boundary'):
+        body = _body_lines(lines, boundaries)
+        yield headers, body
+        # Skip whatever the caller didn't read
+        for _ in body:
+            pass
+        return
+
+    inner = boundaries + [headers.get_param('boundary').encode('utf-8', 'replace')]
+
+    # Skip the preamble
+    for _ in _body_lines(lines, inner):
+        pass
+
+    for line in lines:
+        boundary, closing = _match_boundary(line, inner)
+        if boundary != inner[-1]:
+            # An enclosing multipart ended without closing this one
+            lines.push_back(line)
+            return
+
+        if closing:
+            # Skip the epilogue
+            for _ in _body_lines(lines, boundaries):
+                pass
+            return
+
+        for part in _walk(_read_headers(lines), lines, inner):
+            yield part
+
+
+def iter_parts(chunks):
+    """
+    Yields (headers, body lines) for each leaf part of the message read from
+    the byte chunks in `chunks`, in the order they appear. The parts of
+    attached (message/rfc822) messages are yielded in place. `headers` is an
+    `email.message.Message` with no payload, and body lines are the raw,
+    still encoded lines of the part. Lines a caller doesn't read are skipped
+    without being held in memory.
+    """
+    lines = _Lines(chunks)
+    return _walk(_read_headers(lines), lines, [])
+
+
+def _batched(lines):
+    batch, size = [], 0
+    for line in lines:
+        batch.append(line)
+        size += len(line)
+        if size >= DECODE_BATCH_SIZE:
+            yield b''.join(batch)
+            batch, size = [], 0
+
+    if batch:
+        yield b''.join(batch)
+
+
+def _decoded_lines(headers, lines):
+    # Undoes the part's Content-Transfer-Encoding, a batch of whole lines at
+    # a time
+    encoding = headers.get('Content-Transfer-Encoding', '').strip().lower()
+
+    if encoding == 'quoted-printable':
+        for batch in _batched(lines):
+            yield binascii.a2b_qp(batch)
+
+    elif encoding == 'base64':
+        pending = b''
+        for batch in _batched(lines):
+            pending += b''.join(batch.split())
+            usable = len(pending) - len(pending) % 4
+            if usable:
+                try:
+                    yield binascii.a2b_base64(pending[:usable])
+                except binascii.Error as e:
+                    log.warning("Skipping malformed base64: {}".format(e))
+                pending = pending[usable:]
+
+    else:
+        for batch in _batched(lines):
+            yield batch
+
+
+def _decoded_text(headers, lines):
+    # Decodes the part's text using the charset it declares
+    charset = headers.get_content_charset() or 'utf-8'
+    try:
+        decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+    except LookupError:
+        log.warning("Unknown charset {}, decoding as UTF-8".format(charset))
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    for data in _decoded_lines(headers, lines):
+        text = decoder.decode(data)
+        if text:
+            yield text
+
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+def strip_html(markup):
+    """
+    Returns the readable text of an HTML document, dropping markup, scripts
+    and styles and separating block elements with newlines
+    """
+    markup = HTML_SKIP.sub("", markup)
+    markup = HTML_BLOCK_TAG.sub("\n", markup)
+    return html.unescape(HTML_TAG.sub("", markup))
+
+
+def _is_text(headers):
+    # Text we can read, rather than an attachment
+    if headers.get_content_disposition() == 'attachment':
+        return False
+    return headers.get_content_type() in ('text/plain', 'text/html')
+
+
+def _html_text(headers, lines):
+    # HTML is only readable once it's all there, so strip it in one go
+    html_text, size = [], 0
+    for text in _decoded_text(headers, lines):
+        size += len(text)
+        if size > MAX_HTML_SIZE:
+            log.warning("Ignoring HTML beyond {} characters".format(MAX_HTML_SIZE))
+            break
+        html_text.append(text)
+    yield strip_html("".join(html_text))
+
+
+def _chunked(pieces, size):
+    buffered, length = [], 0
+    for piece in pieces:
+        buffered.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield "".join(buffered)
+            buffered, length = [], 0
+
+    if buffered:
+        yield "".join(buffered)
+
+
+def iter_text(chunks, chunk_size=TEXT_CHUNK_SIZE):
+    """
+    Yields the decoded text of each readable part of a message in the order
+    they appear, in pieces of roughly `chunk_size` characters, with a newline
+    between parts.
+
+    text/plain parts are streamed as they're read, and text/html parts are
+    stripped of markup, so the HTML alternative is there to search if the
+    plain text doesn't have what the caller is looking for. Parts of
+    forwarded messages are included, attachments are skipped, and reading
+    stops as soon as the caller stops asking for text.
+    """
+    first = True
+
+    for headers, lines in iter_parts(chunks):
+        if not _is_text(headers):
+            continue
+
+        if not first:
+            # Keep the end of one part from running into the next
+            yield "\n"
+        first = False
+
+        if headers.get_content_subtype() == 'plain':
+            texts = _decoded_text(headers, lines)
+        else:
+            texts = _html_text(headers, lines)
+
+        for text in _chunked(texts, chunk_size):
+            yield text
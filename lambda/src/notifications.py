@@ -0,0 +1,333 @@
+#
+# notifications.py
+# Templated email notifications, sent through SES
+#
+# Templates live in the `templates` directory, one per file: the subject on
+# the first line, then a blank line, then the text body. Placeholders look
+# like `{{{name}}}`, which is also SES's (Handlebars) syntax for an unescaped
+# value, so the same files are deployed as SES templates by Terraform.
+#
+# By default templates are rendered here and sent one at a time. If
+# SES_TEMPLATE_PREFIX is set, the SES copies of the templates are used
+# instead and queued notifications for the same template are sent together
+# with SendBulkTemplatedEmail.
+#
+
+import collections
+import concurrent.futures
+import json
+import logging
+import os
+import re
+import time
+
+import aws
+import exceptions
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+# Prefix of the SES templates created by Terraform. If unset, templates are
+# rendered locally.
+SES_TEMPLATE_PREFIX = os.getenv("SES_TEMPLATE_PREFIX")
+# SES accepts at most 50 destinations per SendBulkTemplatedEmail call
+MAX_BATCH_SIZE = 50
+# Threads sending notifications in the background, see `submit`
+BACKGROUND_WORKERS = int(os.getenv("NOTIFICATION_WORKERS", 4))
+# Longest `drain` waits for background sends before giving up on them
+DRAIN_TIMEOUT = float(os.getenv("NOTIFICATION_DRAIN_TIMEOUT", 10))
+
+# Retries of a send which SES rejected because we're over our sending rate
+THROTTLE_RETRIES = int(os.getenv("SES_THROTTLE_RETRIES", 5))
+THROTTLE_RETRY_DELAY = 0.1
+THROTTLE_RETRY_MAX_DELAY = 2.0
+THROTTLING_ERROR_CODES = {"Throttling", "ThrottlingException", "TooManyRequestsException"}
+# Bulk send statuses for a destination which are worth retrying
+RETRYABLE_STATUSES = {"AccountThrottled", "TransientFailure"}
+
+PLACEHOLDER = re.compile(r"\{\{\{?\s*(\w+)\s*\}?\}\}")
+
+Notification = collections.namedtuple('Notification', ['to', 'template', 'data'])
+
+
+class Template(object):
+    """
+    An email template, compiled once into alternating literal text and
+    placeholder names. Missing values render as empty strings, as they do in
+    SES. Values aren't escaped; these are plain text emails.
+    """
+
+    def __init__(self, name, subject, text):
+        self.name = name
+        self.subject = subject
+        self.text = text
+        self._subject_parts = PLACEHOLDER.split(subject)
+        self._text_parts = PLACEHOLDER.split(text)
+
+    def __repr__(self):
+        return "<Template {}>".format(self.name)
+
+    @classmethod
+    def load(cls, name, template_dir=TEMPLATE_DIR):
+        with open(os.path.join(template_dir, name + '.txt')) as f:
+            subject, _, text = f.read().partition("\n\n")
+        return cls(name, subject.strip(), text.rstrip("\n"))
+
+    @staticmethod
+    def _render(parts, data):
+        # Even indexes are literal text, odd indexes are placeholder names
+        return "".join(
+            part if i % 2 == 0 else str(data.get(part, ""))
+            for i, part in enumerate(parts)
+        )
+
+    def render(self, data):
+        """
+        Returns the (subject, text) of an email with `data` filled in
+        """
+        return self._render(self._subject_parts, data), self._render(self._text_parts, data)
+
+
+_templates = {}
+
+
+def get_template(name):
+    """
+    Returns the compiled template `name`, loading it on first use
+    """
+    template = _templates.get(name)
+    if template is None:
+        template = _templates[name] = Template.load(name)
+    return template
+
+
+def _is_throttling(e):
+    error = getattr(e, 'response', None) or {}
+    return error.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+
+def _get_retry_delay(retries):
+    return min(THROTTLE_RETRY_DELAY * 2 ** retries, THROTTLE_RETRY_MAX_DELAY)
+
+
+class Dispatcher(object):
+    """
+    Queues notifications and sends them with as few SES calls as possible,
+    backing off when SES throttles us.
+
+    The sender defaults to the EMAIL_SOURCE, EMAIL_BCC and EMAIL_FEEDBACK
+    environment variables, and `template_prefix` to SES_TEMPLATE_PREFIX;
+    pass an empty prefix to render templates locally. Pass `client` to use a
+    stub locally.
+    """
+
+    def __init__(self, source=None, bcc=None, reply_to=None, template_prefix=None, client=None, sleep=time.sleep):
+        self.source = source or os.environ.get('EMAIL_SOURCE')
+        self.bcc = bcc or os.environ.get('EMAIL_BCC')
+        self.reply_to = reply_to or os.environ.get('EMAIL_FEEDBACK')
+        self.template_prefix = SES_TEMPLATE_PREFIX if template_prefix is None else template_prefix
+        self._client = client
+        self._sleep = sleep
+        self._queue = []
+
+    def __len__(self):
+        return len(self._queue)
+
+    @property
+    def client(self):
+        return self._client or aws.client('ses')
+
+    def _destination(self, to):
+        destination = dict(ToAddresses=[to])
+        if self.bcc:
+            destination['BccAddresses'] = [self.bcc]
+        return destination
+
+    def _sender(self):
+        sender = dict(Source=self.source)
+        if self.reply_to:
+            sender['ReplyToAddresses'] = [self.reply_to]
+        return sender
+
+    def _call(self, method, **kwargs):
+        # Calls an SES method, retrying when we're throttled
+        retries = 0
+        while True:
+            try:
+                return getattr(self.client, method)(**kwargs)
+            except Exception as e:
+                if not _is_throttling(e) or retries >= THROTTLE_RETRIES:
+                    raise
+
+                delay = _get_retry_delay(retries)
+                log.warning("SES throttled {}, retrying in {:.2f}s".format(method, delay))
+                self._sleep(delay)
+                retries += 1
+
+    def send_email(self, to, subject, text):
+        """
+        Sends a single email with the given subject and text body
+        """
+        log.info("Sending email to {}".format(to))
+        return self._call(
+            'send_email',
+            Destination=self._destination(to),
+            Message={
+                'Subject': {'Data': subject, 'Charset': 'UTF-8'},
+                'Body': {'Text': {'Data': text, 'Charset': 'UTF-8'}}
+            },
+            **self._sender()
+        )
+
+    def queue(self, to, template, data):
+        """
+        Queues a notification using the template named `template` to be sent
+        on the next `flush`. Notifications without a recipient are dropped.
+        """
+        if not to:
+            log.debug("Not sending {} notification without a recipient".format(template))
+            return
+        self._queue.append(Notification(to, get_template(template), data))
+
+    def _send_bulk(self, template, notifications):
+        # Returns a response or exception for each notification
+        results = [None] * len(notifications)
+        pending = list(range(len(notifications)))
+        retries = 0
+
+        while pending:
+            log.info("Sending {} {} emails".format(len(pending), template.name))
+            response = self._call(
+                'send_bulk_templated_email',
+                Template=self.template_prefix + template.name,
+                DefaultTemplateData="{}",
+                Destinations=[
+                    {
+                        'Destination': self._destination(notifications[i].to),
+                        'ReplacementTemplateData': json.dumps(notifications[i].data)
+                    }
+                    for i in pending
+                ],
+                **self._sender()
+            )
+
+            retry = []
+            for i, status in zip(pending, response['Status']):
+                if status['Status'] == 'Success':
+                    results[i] = status
+                elif status['Status'] in RETRYABLE_STATUSES and retries < THROTTLE_RETRIES:
+                    retry.append(i)
+                else:
+                    results[i] = exceptions.NotificationError(
+                        status.get('Error', status['Status']), status=status['Status'])
+
+            if retry:
+                self._sleep(_get_retry_delay(retries))
+                retries += 1
+            pending = retry
+
+        return results
+
+    def flush(self):
+        """
+        Sends all queued notifications and returns, in the order they were
+        queued, the SES response or the exception raised for each one. A
+        failed send doesn't stop the others.
+        """
+        notifications, self._queue = self._queue, []
+        results = [None] * len(notifications)
+
+        if not self.template_prefix:
+            for i, notification in enumerate(notifications):
+                try:
+                    results[i] = self.send_email(notification.to, *notification.template.render(notification.data))
+                except Exception as e:
+                    results[i] = e
+            return results
+
+        by_template = collections.OrderedDict()
+        for i, notification in enumerate(notifications):
+            by_template.setdefault(notification.template.name, []).append(i)
+
+        for indexes in by_template.values():
+            for start in range(0, len(indexes), MAX_BATCH_SIZE):
+                batch = indexes[start:start + MAX_BATCH_SIZE]
+                template = notifications[batch[0]].template
+                try:
+                    batch_results = self._send_bulk(template, [notifications[i] for i in batch])
+                except Exception as e:
+                    batch_results = [e] * len(batch)
+
+                for i, result in zip(batch, batch_results):
+                    results[i] = result
+
+        return results
+
+
+def send(to, template, data, dispatcher=None):
+    """
+    Sends one notification right away, raising if it fails
+    """
+    dispatcher = dispatcher or Dispatcher()
+    dispatcher.queue(to, template, data)
+    results = dispatcher.flush()
+    if not results:
+        return None
+
+    if isinstance(results[0], Exception):
+        raise results[0]
+
+    return results[0]
+
+
+_executor = None
+_pending = []
+
+
+def _get_executor():
+    global _executor
+
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS)
+
+    return _executor
+
+
+def submit(fn, *args, **kwargs):
+    """
+    Runs `fn` on a background thread so that the handler can carry on with
+    its real work, and returns a future for the result.
+
+    Lambda freezes the container as soon as a handler returns, so handlers
+    which submit work must call `drain` before returning.
+    """
+    future = _get_executor().submit(fn, *args, **kwargs)
+    _pending.append(future)
+    return future
+
+
+def warm_up():
+    """
+    Creates the SES client in the background, so that it's ready by the time
+    the handler has something to send
+    """
+    return submit(aws.client, 'ses')
+
+
+def drain(timeout=DRAIN_TIMEOUT):
+    """
+    Waits for everything passed to `submit` to finish. Errors are logged
+    rather than raised; a notification shouldn't fail the handler.
+    """
+    futures, _pending[:] = list(_pending), []
+    if not futures:
+        return
+
+    done, not_done = concurrent.futures.wait(futures, timeout=timeout)
+    for future in done:
+        if future.exception() is not None:
+            log.warning("Error in background notification task: {}".format(future.exception()))
+
+    if not_done:
+        log.warning("Gave up waiting for {} background notification tasks".format(len(not_done)))
@@ -0,0 +1,290 @@
+#
+# schedule_index.py
+# An index of pending check-ins, keyed by check-in time and confirmation number
+#
+# The state machine only knows what's scheduled through its execution
+# inputs. The handlers also record each check-in here as it's scheduled and
+# remove it once it's done, so questions like "what fires in the next hour?"
+# are answered by an indexed range query instead of a scan of executions.
+#
+# Deployed, the index is a DynamoDB table shared by every Lambda function.
+# Locally, e.g. for scripts/query-schedule.py against a simulated schedule,
+# it can be a SQLite database instead.
+#
+
+import collections
+import itertools
+import logging
+import os
+import time
+
+import aws
+import storage
+import timeutil
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+# DynamoDB table holding the index, shared between Lambda functions
+SCHEDULE_INDEX_TABLE = os.getenv("SCHEDULE_INDEX_TABLE")
+# SQLite database holding the index, used if SCHEDULE_INDEX_TABLE isn't set.
+# If neither is set, no index is kept.
+SCHEDULE_INDEX_DB = os.getenv("SCHEDULE_INDEX_DB")
+# What checks in the reservations recorded here: "executions", the state
+# machine's Map state, or "buckets", bucket_scheduler reading this index.
+# Only one of them may, or every check-in is sent twice.
+CHECK_IN_MODE = os.getenv("CHECK_IN_MODE", "executions")
+EXECUTIONS = "executions"
+BUCKETS = "buckets"
+# Seconds an entry outlives its check-in time in DynamoDB, in case the
+# check-in never finishes to remove it
+SCHEDULE_INDEX_TTL = int(os.getenv("SCHEDULE_INDEX_TTL", 86400))
+
+DAY = 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS check_ins (
+    time INTEGER NOT NULL,
+    confirmation_number TEXT NOT NULL,
+    check_in_time TEXT NOT NULL,
+    first_name TEXT,
+    last_name TEXT,
+    email TEXT,
+    PRIMARY KEY (time, confirmation_number)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS check_ins_confirmation_number ON check_ins (confirmation_number);
+"""
+
+FIELDS = ('time', 'confirmation_number', 'check_in_time', 'first_name', 'last_name', 'email')
+
+
+def _timestamp(value):
+    # Accepts RFC 3339 strings or Unix timestamps
+    if isinstance(value, str):
+        return int(timeutil.parse(value).timestamp())
+    return int(value)
+
+
+class SQLiteIndex(storage.SQLiteDatabase):
+    """
+    A schedule index stored in SQLite. Rows are clustered by (time,
+    confirmation number), so range and density queries read only the rows in
+    range, and there's a secondary index for deletes by confirmation number.
+    Times are stored as whole Unix seconds.
+    """
+
+    def __init__(self, path):
+        super().__init__(path, SCHEMA)
+
+    def add(self, entries):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO check_ins ({}) VALUES ({})".format(
+                    ", ".join(FIELDS), ", ".join("?" * len(FIELDS))),
+                [tuple(e.get(f) for f in FIELDS) for e in entries]
+            )
+
+    def remove(self, confirmation_number, times=None):
+        with self._lock, self._conn:
+            if times is None:
+                self._conn.execute("DELETE FROM check_ins WHERE confirmation_number = ?", (confirmation_number,))
+            else:
+                self._conn.executemany(
+                    "DELETE FROM check_ins WHERE time = ? AND confirmation_number = ?",
+                    [(t, confirmation_number) for t in times]
+                )
+
+    def between(self, start, end, limit=None):
+        query = "SELECT * FROM check_ins WHERE time >= ? AND time < ? ORDER BY time, confirmation_number"
+        params = [start, end]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(query, params)]
+
+    def density(self, start, end, min_count=1):
+        with self._lock:
+            return [
+                tuple(row) for row in self._conn.execute(
+                    "SELECT time, COUNT(*) FROM check_ins WHERE time >= ? AND time < ? "
+                    "GROUP BY time HAVING COUNT(*) >= ? ORDER BY time",
+                    (start, end, min_count)
+                )
+            ]
+
+
+class DynamoDBIndex(object):
+    """
+    A schedule index stored in a DynamoDB table keyed by confirmation number
+    (hash) and time (range), with a global secondary index named `by_day`
+    keyed by the check-in's day, whole Unix seconds // 86400 (hash), and
+    time (range). Range and density queries read the days in range from the
+    secondary index, and deletes go straight to the table.
+
+    TTL is enabled on the `expires_at` attribute. Pass `client` to use a
+    stub locally.
+    """
+
+    def __init__(self, table_name, client=None):
+        self.table_name = table_name
+        self.client = client or aws.client('dynamodb')
+
+    def _query(self, **kwargs):
+        return storage.paginate(self.client.query, TableName=self.table_name, **kwargs)
+
+    @staticmethod
+    def _entry(item):
+        entry = {f: item[f]['S'] if f in item else None for f in FIELDS if f != 'time'}
+        entry['time'] = int(item['time']['N'])
+        return entry
+
+    def add(self, entries):
+        for entry in entries:
+            item = {
+                'confirmation_number': {'S': entry['confirmation_number']},
+                'time': {'N': str(entry['time'])},
+                'day': {'N': str(entry['time'] // DAY)},
+                'expires_at': {'N': str(entry['time'] + SCHEDULE_INDEX_TTL)}
+            }
+            # DynamoDB has no null strings, so missing names and emails are left out
+            for field in ('check_in_time', 'first_name', 'last_name', 'email'):
+                if entry.get(field):
+                    item[field] = {'S': entry[field]}
+
+            self.client.put_item(TableName=self.table_name, Item=item)
+
+    def remove(self, confirmation_number, times=None):
+        if times is None:
+            times = [
+                int(item['time']['N']) for item in self._query(
+                    KeyConditionExpression="confirmation_number = :cn",
+                    ProjectionExpression="#time",
+                    ExpressionAttributeNames={'#time': 'time'},
+                    ExpressionAttributeValues={':cn': {'S': confirmation_number}}
+                )
+            ]
+
+        for t in times:
+            self.client.delete_item(
+                TableName=self.table_name,
+                Key={'confirmation_number': {'S': confirmation_number}, 'time': {'N': str(t)}}
+            )
+
+    def _between(self, start, end):
+        # Yields the entries in range a day at a time, so callers with a
+        # limit stop reading once they have enough
+        for day in range(start // DAY, (end - 1) // DAY + 1):
+            items = self._query(
+                IndexName='by_day',
+                KeyConditionExpression="#day = :day AND #time BETWEEN :start AND :end",
+                ExpressionAttributeNames={'#day': 'day', '#time': 'time'},
+                ExpressionAttributeValues={
+                    ':day': {'N': str(day)},
+                    ':start': {'N': str(start)},
+                    ':end': {'N': str(end - 1)}
+                }
+            )
+            yield from sorted((self._entry(i) for i in items), key=lambda e: (e['time'], e['confirmation_number']))
+
+    def between(self, start, end, limit=None):
+        return list(itertools.islice(self._between(start, end), limit))
+
+    def density(self, start, end, min_count=1):
+        counts = collections.Counter(e['time'] for e in self._between(start, end))
+        return [(t, count) for t, count in sorted(counts.items()) if count >= min_count]
+
+
+class ScheduleIndex(object):
+    """
+    Records scheduled check-ins in a backend and answers questions about
+    them. Query times may be given as RFC 3339 strings or Unix timestamps.
+
+    A backend implements add, remove, between and density over whole Unix
+    seconds, like SQLiteIndex and DynamoDBIndex. A failed add or remove is
+    logged rather than raised, so an execution can still check in without
+    the index; add says whether it worked for callers which depend on it.
+    Queries do raise, since an answer read from a broken index would be
+    wrong.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def add(self, confirmation_number, check_in_times, first_name=None, last_name=None, email=None):
+        """
+        Records a reservation's check-in times, given as RFC 3339 strings.
+        Returns whether they were recorded.
+        """
+        entries = [
+            {
+                'time': _timestamp(t),
+                'confirmation_number': confirmation_number,
+                'check_in_time': t,
+                'first_name': first_name,
+                'last_name': last_name,
+                'email': email
+            }
+            for t in check_in_times
+        ]
+        with storage.log_errors(log, "Error adding {} to schedule index".format(confirmation_number)):
+            self.backend.add(entries)
+            return True
+        return False
+
+    def remove(self, confirmation_number, check_in_times=None):
+        """
+        Removes the given check-in times for a reservation, or all of them if
+        `check_in_times` is None
+        """
+        with storage.log_errors(log, "Error removing {} from schedule index".format(confirmation_number)):
+            times = None if check_in_times is None else [_timestamp(t) for t in check_in_times]
+            self.backend.remove(confirmation_number, times)
+
+    def remove_past(self, confirmation_number, check_in_times, now=None):
+        """
+        Removes the check-in times for a reservation which are no longer in
+        the future. `check_in_times` may also be an older event's dict of
+        `next` and `remaining` times.
+        """
+        if isinstance(check_in_times, dict):
+            check_in_times = [check_in_times.get('next')] + check_in_times.get('remaining', [])
+            check_in_times = [t for t in check_in_times if t]
+
+        now = time.time() if now is None else now
+        self.remove(confirmation_number, [t for t in check_in_times if _timestamp(t) <= now])
+
+    def between(self, start, end, limit=None):
+        """
+        Returns the check-ins from `start` up to (but not including) `end`,
+        soonest first
+        """
+        return self.backend.between(_timestamp(start), _timestamp(end), limit)
+
+    def density(self, start, end, min_count=1):
+        """
+        Returns (Unix second, count) for each second from `start` up to `end`
+        with at least `min_count` check-ins
+        """
+        return self.backend.density(_timestamp(start), _timestamp(end), min_count)
+
+
+_schedule_index = None
+
+
+def get_schedule_index():
+    """
+    Returns the process-wide schedule index, backed by DynamoDB if
+    `SCHEDULE_INDEX_TABLE` is set or by SQLite if `SCHEDULE_INDEX_DB` is.
+    Returns None if neither is set.
+    """
+    global _schedule_index
+
+    if _schedule_index is None:
+        if SCHEDULE_INDEX_TABLE:
+            _schedule_index = ScheduleIndex(DynamoDBIndex(SCHEDULE_INDEX_TABLE))
+        elif SCHEDULE_INDEX_DB:
+            _schedule_index = ScheduleIndex(SQLiteIndex(SCHEDULE_INDEX_DB))
+
+    return _schedule_index
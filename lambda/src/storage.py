@@ -0,0 +1,59 @@
+#
+# storage.py
+# Plumbing shared by the modules which keep state in SQLite or DynamoDB
+#
+# The reservation cache, idempotency store, schedule index and check-in
+# history each put a wrapper in front of a pluggable backend: DynamoDB when
+# deployed, memory or SQLite locally. The wrappers decide what a failing
+# backend means for their callers; the backends share what's below.
+#
+
+import contextlib
+import threading
+
+
+@contextlib.contextmanager
+def log_errors(log, message):
+    """
+    Logs any error raised in the block as a warning, "<message>: <error>",
+    and carries on after the block
+    """
+    try:
+        yield
+    except Exception as e:
+        log.warning("{}: {}".format(message, e))
+
+
+class SQLiteDatabase(object):
+    """
+    A SQLite connection shared between threads, which must hold `_lock`
+    while using `_conn`. `schema` is run on connecting, so it should only
+    create what doesn't exist yet. Rows are returned as sqlite3.Rows.
+    """
+
+    def __init__(self, path, schema):
+        import sqlite3
+
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(schema)
+
+    def close(self):
+        self._conn.close()
+
+
+def paginate(operation, **kwargs):
+    """
+    Yields the items of every page of a DynamoDB query or scan, where
+    `operation` is the client's query or scan method
+    """
+    while True:
+        response = operation(**kwargs)
+        yield from response.get('Items', [])
+
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
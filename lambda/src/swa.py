@@ -4,21 +4,144 @@
 #
 
 import codecs
+import datetime
+import logging
+import os
+import time
 
 from urllib.parse import urlencode
 
-import pendulum
 import requests
 
+from requests.adapters import HTTPAdapter
+
+import clock
 import exceptions
+import metrics
+import timeutil
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
 
 USER_AGENT = "SouthwestAndroid/7.2.1 android/10"
 # This is not a secret, but obfuscate it to prevent detection
 API_KEY = codecs.decode("y7kk8389n5on9ro24nr68onq068oq1860osp", "rot13")
+# Overridable so that benchmarks and local test servers can stand in for Southwest
+API_URL = os.getenv("SWA_API_URL", "https://mobile.southwest.com/api")
+
+CHECK_IN_PAGE = "mobile-air-operations/v1/mobile-air-operations/page/check-in"
+# Southwest error keys which mean the check-in window hasn't opened yet
+TOO_EARLY_MESSAGE_KEYS = {"ERROR__AIR_TRAVEL__BEFORE_CHECKIN_WINDOW"}
+# Southwest error keys which mean the passengers are already checked in
+ALREADY_CHECKED_IN_MESSAGE_KEYS = {"ERROR__CHECKIN__ALREADY_CHECKED_IN", "ERROR__AIR_TRAVEL__ALREADY_CHECKED_IN"}
+# HTTP statuses worth retrying immediately
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Categories returned by `classify_error`
+TOO_EARLY = "too_early"
+TRANSIENT = "transient"
+ALREADY_CHECKED_IN = "already_checked_in"
+FATAL = "fatal"
+
+# Retry delays (seconds) for check-ins sent before the window opens. These are
+# kept short because every retry costs boarding positions.
+TOO_EARLY_RETRY_DELAY = 0.1
+TOO_EARLY_RETRY_MAX_DELAY = 0.5
+# Retry delays (seconds) for timeouts, throttling and server errors
+TRANSIENT_RETRY_DELAY = 0.5
+TRANSIENT_RETRY_MAX_DELAY = 2.0
+# Total seconds spent retrying a check-in before giving up to the state machine
+CHECK_IN_RETRY_BUDGET = float(os.getenv("CHECK_IN_RETRY_BUDGET", 10))
+# Shortest timeout worth starting a check-in attempt with
+MIN_ATTEMPT_TIMEOUT = 0.5
+# Seconds a check-in session body is reused for before it's fetched again
+SESSION_BODY_TTL = 60
+# Connect and read timeouts for the session GET made by `prepare_check_in`,
+# kept short because it runs inside the check-in Lambda's time limit
+PREPARE_CONNECT_TIMEOUT = float(os.getenv("SWA_PREPARE_CONNECT_TIMEOUT", 1))
+PREPARE_READ_TIMEOUT = float(os.getenv("SWA_PREPARE_READ_TIMEOUT", 2))
+
+# Seconds after Southwest's clock reaches the check-in time to send the check-in
+CHECK_IN_SAFETY_MARGIN = float(os.getenv("CHECK_IN_SAFETY_MARGIN", 0.5))
+# Delay used instead when no Date headers have been seen to estimate the skew
+UNCALIBRATED_DELAY = 5
+
+# Connection pool settings for the shared HTTP session
+POOL_SIZE = int(os.getenv("SWA_POOL_SIZE", 10))
+CONNECT_TIMEOUT = float(os.getenv("SWA_CONNECT_TIMEOUT", 3.05))
+READ_TIMEOUT = float(os.getenv("SWA_READ_TIMEOUT", 10))
+
+# Module-level so that it survives across warm Lambda invocations
+_session = None
+# Rolling estimate of Southwest's clock relative to ours, fed by every response
+clock_skew = clock.SkewEstimator()
+
+
+def get_session():
+    """
+    Returns the shared `requests.Session` used for all Southwest API calls.
+
+    The session keeps connections alive in a pool, so the GET and POST in a
+    check-in (and any later invocations in a warm Lambda container) reuse the
+    same TCP/TLS connection instead of paying for a new handshake each time.
+    """
+    global _session
+
+    if _session is None:
+        adapter = HTTPAdapter(
+            pool_connections=POOL_SIZE,
+            pool_maxsize=POOL_SIZE
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _session = session
+
+    return _session
+
+
+def reset_session():
+    """
+    Closes the shared session and its pooled connections. A new one will be
+    created on the next request.
+    """
+    global _session
+
+    if _session is not None:
+        _session.close()
+        _session = None
 
 
-def _make_request(method, page, data='', check_status_code=True):
-    url = f"https://mobile.southwest.com/api/{page}"
+def _sample_clock_skew(response, sent, received):
+    date = response.headers.get("Date")
+    if not date:
+        return
+
+    try:
+        clock_skew.add_sample(date, sent, received)
+    except (TypeError, ValueError):
+        log.warning("Unable to parse Date header: {}".format(date))
+
+
+def get_fire_time(check_in_time):
+    """
+    Converts a check-in time on Southwest's clock (a Unix timestamp) into the
+    local time at which to send the check-in, using the measured clock skew
+    plus `CHECK_IN_SAFETY_MARGIN`.
+    """
+    fire_time = clock_skew.local_time(check_in_time + CHECK_IN_SAFETY_MARGIN)
+    if fire_time is None:
+        log.warning("No clock skew samples, delaying check-in by {}s".format(UNCALIBRATED_DELAY))
+        return check_in_time + UNCALIBRATED_DELAY
+
+    skew = clock_skew.skew
+    log.info("Southwest clock skew is {:.3f}s (bounds {})".format(skew, clock_skew.bounds))
+    metrics.record("ClockSkew", skew, "Seconds")
+    return fire_time
+
+
+def _make_request(method, page, data='', check_status_code=True, timeout=None):
+    url = f"{API_URL}/{page}"
     headers = {
         "User-Agent": USER_AGENT,
         "X-API-Key": API_KEY,
@@ -26,26 +149,37 @@ def _make_request(method, page, data='', check_status_code=True):
         "Accept": "application/json"
     }
     method = method.lower()
+    session = get_session()
+    timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
 
+    sent = time.time()
     if method == 'get':
-        response = requests.get(url, headers=headers, params=urlencode(data))
+        response = session.get(url, headers=headers, params=urlencode(data), timeout=timeout)
     elif method == 'post':
         headers['Content-Type'] = 'application/json'
-        response = requests.post(url, headers=headers, json=data)
+        response = session.post(url, headers=headers, json=data, timeout=timeout)
     else:
         raise NotImplementedError()
 
+    _sample_clock_skew(response, sent, time.time())
+
     if check_status_code and not response.ok:
+        message_key = None
         try:
-            msg = response.json()["message"]
+            error = response.json()
+            msg = error["message"]
+            message_key = error.get("messageKey")
         except:
             msg = response.reason
 
         if response.status_code == 404:
             raise exceptions.ReservationNotFoundError()
 
-        raise exceptions.SouthwestAPIError("status_code={} msg=\"{}\"".format(
-            response.status_code, msg))
+        raise exceptions.SouthwestAPIError(
+            "status_code={} msg=\"{}\"".format(response.status_code, msg),
+            status_code=response.status_code,
+            message_key=message_key
+        )
 
     return response
 
@@ -57,23 +191,40 @@ class Reservation():
         self.confirmation_number = confirmation_number
         self.response = response
 
-        # Second of the minute to use for check in times
-        self.check_in_seconds = 5
+        # Second of the minute to use for check in times. Clock skew is
+        # handled when the check-in is fired, see `get_fire_time`.
+        self.check_in_seconds = 0
 
     def __repr__(self):
         return "<Reservation {}>".format(self.confirmation_number)
 
     @classmethod
-    def from_passenger_info(cls, first_name, last_name, confirmation_number):
+    def from_passenger_info(cls, first_name, last_name, confirmation_number, cache=None, timeout=None):
+        """
+        Looks up a reservation with the Southwest API. If a
+        `cache.ReservationCache` is provided, a cached response is used
+        when available and fresh responses are stored in it. `timeout`
+        overrides the connect and read timeouts of the request.
+        """
+        if cache is not None:
+            cached = cache.get(first_name, last_name, confirmation_number)
+            if cached is not None:
+                return cls(first_name, last_name, confirmation_number, cached)
+
         params = {'first-name': first_name, 'last-name': last_name}
 
         response = _make_request(
             "get",
             "mobile-air-booking/v1/mobile-air-booking/page/view-reservation/" + confirmation_number,
-            params
+            params,
+            timeout=timeout
         )
+        responsej = response.json()
+
+        if cache is not None:
+            cache.set(first_name, last_name, confirmation_number, responsej)
 
-        return cls(first_name, last_name, confirmation_number, response.json())
+        return cls(first_name, last_name, confirmation_number, responsej)
 
     def _get_check_in_time(self, departure_time):
         """
@@ -81,13 +232,12 @@ class Reservation():
 
             2017-02-09T07:50:00.000-06:00
 
-        And returns the check in time (24 hours prior) as a pendulum time
-        object. `self.check_in_seconds` seconds (Default 5) are added to
-        the checkin time to allow for some clock skew buffer.
+        And returns the check in time (24 hours prior) as a datetime.
+        `self.check_in_seconds` seconds (Default 0) are added to the checkin
+        time.
         """
-        return pendulum.parse(departure_time)\
-                .subtract(days=1)\
-                .add(seconds=self.check_in_seconds)
+        return timeutil.parse(departure_time) - \
+            datetime.timedelta(days=1, seconds=-self.check_in_seconds)
 
 
     def get_check_in_times(self, expired=False):
@@ -109,31 +259,71 @@ class Reservation():
 
         # Remove expired checkins from results
         if not expired:
-            times = [t for t in times if t > pendulum.now()]
+            now = timeutil.now()
+            times = [t for t in times if t > now]
 
-        return list(map(str, reversed(sorted(times))))
+        return [t.isoformat() for t in reversed(sorted(times))]
 
     @property
     def check_in_times(self):
         return self.get_check_in_times()
 
 
-def check_in(first_name, last_name, confirmation_number):
-    # first we get a session token with a GET request, then issue a POST to check in
-    page = "mobile-air-operations/v1/mobile-air-operations/page/check-in"
+class PreparedCheckIn():
+    """
+    A check-in which has been staged ahead of time by `prepare_check_in` and
+    is waiting to be sent with `fire_check_in`.
+    """
+
+    def __init__(self, first_name, last_name, confirmation_number, body=None):
+        self.first_name = first_name
+        self.last_name = last_name
+        self.confirmation_number = confirmation_number
+        # POST body (including the session token), if Southwest provided it early
+        self.body = body
+        self.body_fetched_at = time.monotonic() if body is not None else None
+        # Check-in POSTs sent so far, the local time the last was sent and
+        # how many seconds it took
+        self.attempts = 0
+        self.sent_at = None
+        self.latency = None
+
+    def __repr__(self):
+        return "<PreparedCheckIn {} ready={}>".format(self.confirmation_number, self.body is not None)
+
+    def get_body(self, timeout=None):
+        """
+        Returns the check-in POST body, fetching a new one if we don't have
+        one yet or the one we have is too old to trust.
+        """
+        if self.body is None or time.monotonic() - self.body_fetched_at > SESSION_BODY_TTL:
+            start = time.monotonic()
+            try:
+                self.body = _get_check_in_body(
+                    self.first_name, self.last_name, self.confirmation_number, timeout=timeout
+                )
+                self.body_fetched_at = time.monotonic()
+            finally:
+                metrics.record("CheckInGetTime", (time.monotonic() - start) * 1000, "Milliseconds")
+        return self.body
+
+
+def _get_check_in_body(first_name, last_name, confirmation_number, timeout=None):
     params = {'first-name': first_name, 'last-name': last_name}
 
-    session = _make_request("get", page + "/" + confirmation_number, params)
+    session = _make_request("get", CHECK_IN_PAGE + "/" + confirmation_number, params, timeout=timeout)
     sessionj = session.json()
 
     try:
         # the whole POST body (including the session token) is provided here
-        body = sessionj['checkInViewReservationPage']['_links']['checkIn']['body']
+        return sessionj['checkInViewReservationPage']['_links']['checkIn']['body']
     except KeyError:
-        print(sessionj)
+        log.debug("Unexpected check-in session response: {}".format(sessionj))
         raise exceptions.SouthwestAPIError("Error getting check-in session")
 
-    response = _make_request("post", page, body)
+
+def _post_check_in(body, timeout=None):
+    response = _make_request("post", CHECK_IN_PAGE, body, timeout=timeout)
     if not response.ok:
         raise exceptions.SouthwestAPIError("Error checking in! response={}".format(response))
 
@@ -142,3 +332,130 @@ def check_in(first_name, last_name, confirmation_number):
         raise exceptions.SouthwestAPIError("Check in failed. response={}".format(responsej))
 
     return responsej
+
+
+def _send_check_in(prepared, timeout=None):
+    # POSTs the check-in, noting when it was sent and how long it took
+    body = prepared.get_body(timeout)
+    prepared.attempts += 1
+    prepared.sent_at = time.time()
+    start = time.monotonic()
+    try:
+        return _post_check_in(body, timeout)
+    finally:
+        prepared.latency = time.monotonic() - start
+        metrics.record("CheckInPostTime", prepared.latency * 1000, "Milliseconds")
+
+
+def classify_error(e):
+    """
+    Sorts an exception raised while checking in into TOO_EARLY,
+    ALREADY_CHECKED_IN, TRANSIENT or FATAL.
+    """
+    if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+        return TRANSIENT
+
+    if not isinstance(e, exceptions.SouthwestAPIError):
+        return FATAL
+
+    if e.message_key in TOO_EARLY_MESSAGE_KEYS:
+        return TOO_EARLY
+    if e.message_key in ALREADY_CHECKED_IN_MESSAGE_KEYS:
+        return ALREADY_CHECKED_IN
+    if e.status_code in TRANSIENT_STATUS_CODES:
+        return TRANSIENT
+
+    return FATAL
+
+
+def _get_retry_delay(kind, retries):
+    if kind == TOO_EARLY:
+        return min(TOO_EARLY_RETRY_DELAY * 1.5 ** retries, TOO_EARLY_RETRY_MAX_DELAY)
+    return min(TRANSIENT_RETRY_DELAY * 2 ** retries, TRANSIENT_RETRY_MAX_DELAY)
+
+
+def _get_attempt_timeout(remaining):
+    # Connect and read timeouts for an attempt, cut short so that it can't
+    # run far past the retry budget
+    remaining = max(remaining, MIN_ATTEMPT_TIMEOUT)
+    return min(CONNECT_TIMEOUT, remaining), min(READ_TIMEOUT, remaining)
+
+
+def _check_in_with_retries(prepared, budget):
+    """
+    Sends a check-in, retrying errors which are likely to clear up within
+    `budget` seconds. Fatal errors, and the last error once the budget is
+    spent, are raised to the caller. Each attempt's timeouts are capped at
+    what's left of the budget.
+    """
+    deadline = time.monotonic() + budget
+    attempt = 0
+
+    while True:
+        attempt += 1
+        start = time.monotonic()
+
+        try:
+            response = _send_check_in(prepared, _get_attempt_timeout(deadline - start))
+            log.info("Check-in attempt {} succeeded in {:.0f}ms".format(
+                attempt, (time.monotonic() - start) * 1000))
+            return response
+        except (exceptions.SouthwestAPIError, requests.RequestException) as e:
+            kind = classify_error(e)
+            log.info("Check-in attempt {} failed in {:.0f}ms ({}): {}".format(
+                attempt, (time.monotonic() - start) * 1000, kind, e))
+
+            if kind == ALREADY_CHECKED_IN:
+                # Most likely an earlier attempt went through after we gave up on it
+                log.info("Reservation {} is already checked in".format(prepared.confirmation_number))
+                return {'alreadyCheckedIn': True}
+
+            if kind == FATAL:
+                raise
+
+            delay = _get_retry_delay(kind, attempt - 1)
+            if time.monotonic() + delay + MIN_ATTEMPT_TIMEOUT > deadline:
+                log.warning("Check-in retry budget of {}s exhausted after {} attempts".format(budget, attempt))
+                raise
+
+            time.sleep(delay)
+
+
+def prepare_check_in(first_name, last_name, confirmation_number):
+    """
+    Does as much of the check-in as possible ahead of the check-in window.
+
+    This opens a pooled connection to Southwest and requests the check-in
+    session body. If Southwest refuses because the window hasn't opened yet,
+    the body is fetched again when the check-in is fired, but the connection
+    stays warm either way. Any other error is raised immediately, including
+    a timeout after PREPARE_CONNECT_TIMEOUT + PREPARE_READ_TIMEOUT seconds.
+    """
+    prepared = PreparedCheckIn(first_name, last_name, confirmation_number)
+
+    try:
+        prepared.get_body(timeout=(PREPARE_CONNECT_TIMEOUT, PREPARE_READ_TIMEOUT))
+    except exceptions.SouthwestAPIError as e:
+        if e.message_key not in TOO_EARLY_MESSAGE_KEYS:
+            raise
+
+    return prepared
+
+
+def fire_check_in(prepared, at=None, budget=CHECK_IN_RETRY_BUDGET):
+    """
+    Completes a check-in staged by `prepare_check_in`, retrying for up to
+    `budget` seconds. If `at` (a Unix timestamp on Southwest's clock) is
+    provided, the POST is held until that instant, adjusted for the measured
+    clock skew.
+    """
+    if at is not None:
+        clock.wait_until(get_fire_time(at))
+
+    return _check_in_with_retries(prepared, budget)
+
+
+def check_in(first_name, last_name, confirmation_number, budget=CHECK_IN_RETRY_BUDGET):
+    # first we get a session token with a GET request, then issue a POST to check in
+    prepared = PreparedCheckIn(first_name, last_name, confirmation_number)
+    return _check_in_with_retries(prepared, budget)
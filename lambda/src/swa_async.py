@@ -0,0 +1,112 @@
+#
+# swa_async.py
+# Asyncio counterparts to the functions in swa.py
+#
+# The blocking calls run on a bounded thread pool over swa's shared, pooled
+# session, so concurrent check-ins reuse the same keep-alive connections.
+#
+
+import asyncio
+import concurrent.futures
+import os
+import time
+
+import clock
+import metrics
+import swa
+
+# Maximum number of Southwest requests in flight at once. Defaults to the size
+# of the connection pool so that every request gets a warm connection.
+MAX_CONCURRENCY = int(os.getenv("SWA_MAX_CONCURRENCY", swa.POOL_SIZE))
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENCY)
+
+    return _executor
+
+
+async def _run(fn, *args, **kwargs):
+    # Metrics recorded on the pool go to the caller's set
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(_get_executor(), metrics.bind(lambda: fn(*args, **kwargs)))
+
+
+class Reservation(swa.Reservation):
+    @classmethod
+    async def from_passenger_info(cls, first_name, last_name, confirmation_number, cache=None):
+        reservation = await _run(
+            swa.Reservation.from_passenger_info, first_name, last_name, confirmation_number, cache=cache
+        )
+        return cls(first_name, last_name, confirmation_number, reservation.response)
+
+
+async def prepare_check_in(first_name, last_name, confirmation_number):
+    return await _run(swa.prepare_check_in, first_name, last_name, confirmation_number)
+
+
+async def wait_until(target):
+    """
+    Waits until the local clock reaches `target`, a Unix timestamp, like
+    `clock.wait_until` but without holding a thread while it sleeps.
+    """
+    remaining = target - time.time()
+    if remaining > clock.SPIN_SECONDS:
+        await asyncio.sleep(remaining - clock.SPIN_SECONDS)
+    return clock.wait_until(target)
+
+
+async def fire_check_in(prepared, at=None, budget=swa.CHECK_IN_RETRY_BUDGET):
+    return await _run(swa.fire_check_in, prepared, at=at, budget=budget)
+
+
+async def check_in(first_name, last_name, confirmation_number, at=None, budget=swa.CHECK_IN_RETRY_BUDGET):
+    """
+    Prepares and fires a check-in. If `at` is provided the check-in is sent
+    at that time on Southwest's clock, see `swa.fire_check_in`.
+    """
+    prepared = await prepare_check_in(first_name, last_name, confirmation_number)
+    return await fire_check_in(prepared, at=at, budget=budget)
+
+
+async def check_in_all(check_ins, concurrency=MAX_CONCURRENCY):
+    """
+    Checks in a list of reservations concurrently. Each item is a dict of
+    `check_in` keyword arguments.
+
+    Every reservation is prepared straight away and waits for its check-in
+    time on the event loop, so check-ins due at the same time are all ready
+    to go together. Only the check-in requests themselves are limited to
+    `concurrency` at once.
+
+    Returns a list in the same order as `check_ins` holding either the
+    check-in response or the exception raised for that reservation.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _check_in(first_name, last_name, confirmation_number, at=None, budget=swa.CHECK_IN_RETRY_BUDGET):
+        prepared = await prepare_check_in(first_name, last_name, confirmation_number)
+        if at is not None:
+            await wait_until(swa.get_fire_time(at))
+
+        async with semaphore:
+            return await fire_check_in(prepared, budget=budget)
+
+    return await asyncio.gather(*[_check_in(**c) for c in check_ins], return_exceptions=True)
+
+
+def run(coroutine):
+    """
+    Runs a coroutine to completion on a new event loop, for use from the
+    synchronous Lambda handlers.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
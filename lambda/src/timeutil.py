@@ -0,0 +1,96 @@
+#
+# timeutil.py
+# The handful of date and time operations the project needs, built on the
+# standard library. Output matches what pendulum produced for the same inputs.
+#
+
+import datetime
+import re
+
+DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+RFC3339_PATTERN = re.compile(
+    r"^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2})(?::(\d{2})(?:[.,](\d{1,6})\d*)?)?"
+    r"(?:(Z)|([+-])(\d{2}):?(\d{2}))?$"
+)
+
+# datetime.fromisoformat (Python 3.7+) is much faster than a regex, but doesn't
+# accept everything RFC 3339 allows. It's tried first where it exists.
+_fromisoformat = getattr(datetime.datetime, "fromisoformat", None)
+
+_timezones = {}
+
+
+def _get_timezone(offset_minutes):
+    # Reuse tzinfo objects; there are only a few distinct offsets in practice
+    tz = _timezones.get(offset_minutes)
+    if tz is None:
+        if offset_minutes == 0:
+            tz = datetime.timezone.utc
+        else:
+            tz = datetime.timezone(datetime.timedelta(minutes=offset_minutes))
+        _timezones[offset_minutes] = tz
+    return tz
+
+
+def _parse_slow(value):
+    match = RFC3339_PATTERN.match(value)
+    if not match:
+        raise ValueError("Invalid RFC 3339 timestamp: {}".format(value))
+
+    year, month, day, hour, minute, second, fraction, zulu, sign, tz_hour, tz_minute = match.groups()
+
+    offset = 0
+    if sign:
+        offset = int(tz_hour) * 60 + int(tz_minute)
+        if sign == "-":
+            offset = -offset
+
+    return datetime.datetime(
+        int(year), int(month), int(day), int(hour), int(minute), int(second or 0),
+        int((fraction or "0").ljust(6, "0")),
+        tzinfo=_get_timezone(offset)
+    )
+
+
+def parse(value):
+    """
+    Parses an RFC 3339 timestamp such as `2017-02-09T07:50:00.000-06:00` into
+    a timezone-aware datetime. Like pendulum, timestamps without an offset are
+    assumed to be in UTC.
+    """
+    if _fromisoformat is not None:
+        try:
+            dt = _fromisoformat(value)
+        except ValueError:
+            pass
+        else:
+            # Swap in a shared tzinfo: comparing datetimes whose tzinfo is the
+            # same object skips the utcoffset() calls, which makes sorting
+            # many times an order of magnitude faster.
+            offset = dt.utcoffset()
+            minutes = 0 if offset is None else offset.days * 1440 + offset.seconds // 60
+            return dt.replace(tzinfo=_get_timezone(minutes))
+
+    return _parse_slow(value)
+
+
+def now():
+    """
+    The current time as a timezone-aware datetime
+    """
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def to_day_datetime_string(dt):
+    """
+    Formats a datetime like `Thu, Feb 9, 2017 7:50 AM`, the same as pendulum's
+    `to_day_datetime_string`. This avoids strftime, whose names depend on the
+    locale.
+    """
+    hour = dt.hour % 12 or 12
+    return "{}, {} {}, {} {}:{:02d} {}".format(
+        DAYS[dt.weekday()], MONTHS[dt.month - 1], dt.day, dt.year,
+        hour, dt.minute, "AM" if dt.hour < 12 else "PM"
+    )
@@ -0,0 +1,296 @@
+#
+# fake_aws.py
+# In-memory stand-ins for the boto3 clients used by the project
+#
+
+import datetime
+import json
+import re
+import time
+
+
+def _client_error(code, message, operation):
+    from botocore.exceptions import ClientError
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+def _value(attribute):
+    # The Python value of a low-level attribute such as {'N': '12'}
+    (kind, value), = attribute.items()
+    return float(value) if kind == 'N' else value
+
+
+class FakeDynamoDBClient(object):
+    """
+    Implements get_item, put_item, delete_item, query and scan, storing items
+    in the same low-level format boto3 uses. Tables are keyed by `key_name`
+    and, if given, `range_key`. `indexes` maps the name of each global
+    secondary index to its (hash, range) key names.
+
+    put_item understands condition expressions made of
+    `attribute_not_exists(name)` and `name < :value` terms joined by OR, and
+    query understands `hash = :value` optionally followed by
+    `AND range BETWEEN :low AND :high`. Query and scan results are split
+    into pages of `page_size` items.
+    """
+
+    def __init__(self, key_name='key', range_key=None, indexes=None, page_size=None):
+        self.key_name = key_name
+        self.key_names = (key_name, range_key) if range_key else (key_name,)
+        self.indexes = indexes or {}
+        self.page_size = page_size
+        self.tables = {}
+
+    def _table(self, name):
+        return self.tables.setdefault(name, {})
+
+    def _key(self, item):
+        # Items are stored by their hash key, or by (hash, range) if the table has both
+        key = tuple(_value(item[k]) for k in self.key_names)
+        return key if len(key) > 1 else key[0]
+
+    def get_item(self, TableName, Key, **kwargs):
+        item = self._table(TableName).get(self._key(Key))
+        return {'Item': dict(item)} if item is not None else {}
+
+    def _check_condition(self, item, expression, names, values):
+        for term in expression.split(" OR "):
+            term = term.strip()
+            if term.startswith("attribute_not_exists("):
+                name = names.get(term[len("attribute_not_exists("):-1].strip(), term)
+                if item is None or name not in item:
+                    return True
+            else:
+                name, op, value = term.split()
+                assert op == "<", "Unsupported condition: {}".format(term)
+                name = names.get(name, name)
+                if item is not None and name in item and float(item[name]['N']) < float(values[value]['N']):
+                    return True
+        return False
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, **kwargs):
+        table = self._table(TableName)
+        key = self._key(Item)
+        if ConditionExpression and not self._check_condition(
+                table.get(key), ConditionExpression, ExpressionAttributeNames or {}, ExpressionAttributeValues or {}):
+            raise _client_error('ConditionalCheckFailedException', 'The conditional request failed', 'PutItem')
+        table[key] = dict(Item)
+        return {}
+
+    def delete_item(self, TableName, Key, **kwargs):
+        self._table(TableName).pop(self._key(Key), None)
+        return {}
+
+    def _page(self, items, key_names, start_key):
+        # Resumes after `start_key` and stops after a page of items
+        if start_key is not None:
+            keys = [{k: item[k] for k in key_names} for item in items]
+            items = items[keys.index(start_key) + 1:]
+
+        if self.page_size is None or len(items) <= self.page_size:
+            return {'Items': [dict(item) for item in items], 'Count': len(items)}
+
+        items = items[:self.page_size]
+        return {
+            'Items': [dict(item) for item in items],
+            'Count': len(items),
+            'LastEvaluatedKey': {k: items[-1][k] for k in key_names}
+        }
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, ExpressionAttributeNames=None,
+              IndexName=None, ExclusiveStartKey=None, **kwargs):
+        match = re.match(r'^(\S+) = (\S+)(?: AND (\S+) BETWEEN (\S+) AND (\S+))?$', KeyConditionExpression)
+        assert match, "Unsupported key condition: {}".format(KeyConditionExpression)
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues
+        hash_name, value, range_name, low, high = match.groups()
+        hash_name = names.get(hash_name, hash_name)
+
+        if IndexName is None:
+            index_keys = self.key_names
+        else:
+            index_keys = self.indexes[IndexName]
+        assert hash_name == index_keys[0], "Not the hash key: {}".format(hash_name)
+
+        items = [
+            item for item in self._table(TableName).values()
+            if hash_name in item and _value(item[hash_name]) == _value(values[value])
+        ]
+        if range_name is not None:
+            range_name = names.get(range_name, range_name)
+            items = [
+                item for item in items
+                if range_name in item and _value(values[low]) <= _value(item[range_name]) <= _value(values[high])
+            ]
+
+        # Sorted by the range key, and within it by the table's key
+        if len(index_keys) > 1:
+            items.sort(key=lambda item: (_value(item[index_keys[1]]), self._key(item)))
+
+        key_names = list(dict.fromkeys(self.key_names + tuple(index_keys)))
+        return self._page(items, key_names, ExclusiveStartKey)
+
+    def scan(self, TableName, ExclusiveStartKey=None, **kwargs):
+        return self._page(list(self._table(TableName).values()), self.key_names, ExclusiveStartKey)
+
+
+class FakeStreamingBody(object):
+    """
+    Mimics botocore's StreamingBody, recording how much of the object was
+    read and whether the stream was closed. If `bandwidth` (bytes per
+    second) is set, reads take as long as they would over the network.
+    """
+
+    def __init__(self, data, bandwidth=None, sleep=time.sleep):
+        self.data = data
+        self.bandwidth = bandwidth
+        self.bytes_read = 0
+        self.closed = False
+        self._sleep = sleep
+
+    def read(self, amt=None):
+        end = len(self.data) if amt is None else self.bytes_read + amt
+        chunk = self.data[self.bytes_read:end]
+        self.bytes_read += len(chunk)
+        if self.bandwidth and chunk:
+            self._sleep(len(chunk) / float(self.bandwidth))
+        return chunk
+
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class FakeS3Client(object):
+    """
+    Implements get_object over objects stored in memory as bytes. `latency`
+    (seconds before the first byte) and `bandwidth` (bytes per second)
+    simulate the cost of fetching from S3.
+    """
+
+    def __init__(self, latency=0, bandwidth=None, sleep=time.sleep):
+        self.objects = {}
+        self.bodies = []
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._sleep = sleep
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        self.objects[(Bucket, Key)] = Body
+        return {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        if self.latency:
+            self._sleep(self.latency)
+        body = FakeStreamingBody(self.objects[(Bucket, Key)], bandwidth=self.bandwidth, sleep=self._sleep)
+        self.bodies.append(body)
+        return {'Body': body, 'ContentLength': len(body.data)}
+
+
+def _throttling_error(operation):
+    return _client_error('Throttling', 'Maximum sending rate exceeded.', operation)
+
+
+class FakeSESClient(object):
+    """
+    Implements send_email and send_bulk_templated_email, recording each
+    delivered email in `sent` as a dict of to, subject and text. Bulk sends
+    render the local copy of the template.
+
+    The first `throttle` calls fail with SES's throttling error, and each
+    call takes `latency` seconds.
+    """
+
+    def __init__(self, template_prefix="", throttle=0, latency=0, sleep=time.sleep):
+        self.template_prefix = template_prefix
+        self.sent = []
+        self.calls = []
+        self.throttle = throttle
+        self.latency = latency
+        self._sleep = sleep
+
+    def _call(self, operation):
+        self.calls.append(operation)
+        if self.latency:
+            self._sleep(self.latency)
+        if self.throttle > 0:
+            self.throttle -= 1
+            raise _throttling_error(operation)
+
+    def send_email(self, Source, Destination, Message, **kwargs):
+        self._call('SendEmail')
+        self.sent.append({
+            'to': Destination['ToAddresses'][0],
+            'subject': Message['Subject']['Data'],
+            'text': Message['Body']['Text']['Data']
+        })
+        return {'MessageId': str(len(self.sent))}
+
+    def send_bulk_templated_email(self, Source, Template, DefaultTemplateData, Destinations, **kwargs):
+        import notifications
+
+        self._call('SendBulkTemplatedEmail')
+        template = notifications.get_template(Template[len(self.template_prefix):])
+
+        statuses = []
+        for destination in Destinations:
+            data = json.loads(DefaultTemplateData)
+            data.update(json.loads(destination['ReplacementTemplateData']))
+            subject, text = template.render(data)
+            self.sent.append({'to': destination['Destination']['ToAddresses'][0], 'subject': subject, 'text': text})
+            statuses.append({'Status': 'Success', 'MessageId': str(len(self.sent))})
+
+        return {'Status': statuses}
+
+
+class FakeStepFunctionsClient(object):
+    """
+    Implements start_execution, recording each execution's input in
+    `executions` by name. As in Step Functions, starting an execution whose
+    name is taken returns the existing execution if the input matches and
+    raises ExecutionAlreadyExists otherwise.
+
+    Also implements describe_execution. Executions are RUNNING unless given
+    another status in `statuses` by name.
+    """
+
+    def __init__(self):
+        from botocore.exceptions import ClientError
+
+        self.executions = {}
+        self.statuses = {}
+        self.exceptions = type('Exceptions', (object,), {
+            'ExecutionAlreadyExists': type('ExecutionAlreadyExists', (ClientError,), {}),
+            'ExecutionDoesNotExist': type('ExecutionDoesNotExist', (ClientError,), {})
+        })
+
+    def start_execution(self, stateMachineArn, name, input='{}', **kwargs):
+        arn = "{}:{}".format(stateMachineArn.replace(':stateMachine:', ':execution:'), name)
+        if name in self.executions and self.executions[name] != input:
+            error = {'Error': {'Code': 'ExecutionAlreadyExists', 'Message': 'Execution Already Exists: ' + arn}}
+            raise self.exceptions.ExecutionAlreadyExists(error, 'StartExecution')
+
+        self.executions[name] = input
+        return {'executionArn': arn, 'startDate': datetime.datetime.now()}
+
+    def describe_execution(self, executionArn):
+        name = executionArn.rsplit(':', 1)[-1]
+        if name not in self.executions:
+            error = {'Error': {'Code': 'ExecutionDoesNotExist', 'Message': 'Execution Does Not Exist: ' + executionArn}}
+            raise self.exceptions.ExecutionDoesNotExist(error, 'DescribeExecution')
+
+        return {
+            'executionArn': executionArn,
+            'name': name,
+            'status': self.statuses.get(name, 'RUNNING'),
+            'input': self.executions[name]
+        }
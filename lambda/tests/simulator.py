@@ -0,0 +1,198 @@
+#
+# simulator.py
+# The whole check-in pipeline run locally on a virtual clock
+#
+# Emails go to the real receive-email handler, which starts executions of the
+# state machine defined in terraform/state_machine.tf, run by
+# state_machine.StateMachine with the real handlers from terraform/lambda.tf.
+# S3, SES, Step Functions and Southwest are the in-memory stand-ins, and
+# every clock the handlers read is the simulation's.
+#
+
+import contextlib
+import datetime
+import importlib
+import json
+import os
+import time
+
+import mock
+
+import aws
+import cache
+import clock
+import history
+import idempotency
+import metrics
+import schedule_index
+import state_machine
+import swa
+import timeutil
+import fake_aws
+from fake_southwest import FakeSouthwestSession
+
+TERRAFORM_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'terraform')
+STATE_MACHINE_ARN = "arn:aws:states:us-east-1:123456789012:stateMachine:check-in"
+EMAIL_BUCKET = "checkin-bot-email"
+
+
+class _VirtualTime(object):
+    # Stands in for the `time` module of the modules which read the clock
+    def __init__(self, clock):
+        self._clock = clock
+
+    def time(self):
+        return self._clock.time()
+
+    def monotonic(self):
+        return self._clock.monotonic()
+
+    def sleep(self, seconds):
+        self._clock.sleep(seconds)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class _StepFunctionsClient(fake_aws.FakeStepFunctionsClient):
+    # Starts each execution on the simulated state machine
+    def __init__(self, machine):
+        super().__init__()
+        self.machine = machine
+
+    def start_execution(self, stateMachineArn, name, input='{}', **kwargs):
+        new = name not in self.executions
+        response = super().start_execution(stateMachineArn, name, input, **kwargs)
+        if new:
+            self.machine.start_execution(json.loads(input), name)
+        return response
+
+    def describe_execution(self, executionArn):
+        response = super().describe_execution(executionArn)
+        for execution in self.machine.executions:
+            if execution.name == response['name']:
+                response['status'] = execution.status
+        return response
+
+
+class Pipeline(object):
+    """
+    Runs reservations through the check-in pipeline without deploying it.
+    Use it as a context manager, which swaps in the stand-ins and the virtual
+    clock for the duration.
+
+    The clock starts at `start` (default: now). Southwest responds after
+    `latency` seconds with its clock `clock_offset` seconds ahead. Check-in
+    outcomes are recorded in a history kept in SQLite at `history_db`
+    (default: in memory).
+    """
+
+    def __init__(self, start=None, latency=0.05, clock_offset=0, history_db=":memory:",
+                 terraform_path=TERRAFORM_PATH):
+        self.clock = clock.SimulatedClock(time.time() if start is None else start)
+        self.southwest = FakeSouthwestSession(self.clock, latency=latency, clock_offset=clock_offset)
+        self.s3 = fake_aws.FakeS3Client()
+        self.ses = fake_aws.FakeSESClient()
+        self.history = history.CheckInHistory(history.SQLiteHistory(history_db))
+
+        handlers = state_machine.load_lambda_handlers(os.path.join(terraform_path, 'lambda.tf'))
+        self.receive_email = handlers['sw_receive_email']
+        resources = {name: _invoke(handler) for name, handler in handlers.items()}
+        self.machine = state_machine.StateMachine(
+            state_machine.load_definition(os.path.join(terraform_path, 'state_machine.tf')),
+            resources, clock=self.clock
+        )
+        self.sfn = _StepFunctionsClient(self.machine)
+        self.emails = 0
+        # CPU seconds used by each receive-email invocation
+        self.receive_email_cpu_time = []
+        self._patches = None
+
+    def __enter__(self):
+        virtual_time = _VirtualTime(self.clock)
+        check_in = importlib.import_module('handlers.check_in')
+
+        self._patches = contextlib.ExitStack()
+        for patch in (
+            mock.patch.object(swa, '_session', self.southwest),
+            mock.patch.object(swa, 'clock_skew', clock.SkewEstimator()),
+            mock.patch.object(swa, 'time', virtual_time),
+            mock.patch.object(clock, 'time', virtual_time),
+            mock.patch.object(check_in, 'time', virtual_time),
+            mock.patch.object(schedule_index, 'time', virtual_time),
+            mock.patch.object(timeutil, 'now', self._now),
+            mock.patch.object(cache, 'RESERVATION_CACHE_TABLE', None),
+            mock.patch.object(cache, '_reservation_cache', None),
+            mock.patch.object(idempotency, 'IDEMPOTENCY_TABLE', None),
+            mock.patch.object(idempotency, '_store', None),
+            mock.patch.object(history, '_history', self.history),
+            mock.patch.object(metrics, 'sink', lambda line: None),
+            mock.patch.dict(os.environ, {'STATE_MACHINE_ARN': STATE_MACHINE_ARN, 'S3_BUCKET_NAME': EMAIL_BUCKET}),
+        ):
+            self._patches.enter_context(patch)
+
+        aws.set_client('s3', self.s3)
+        aws.set_client('ses', self.ses)
+        aws.set_client('stepfunctions', self.sfn)
+        self._patches.callback(aws.reset)
+        return self
+
+    def __exit__(self, *args):
+        self._patches.close()
+
+    def _now(self):
+        return datetime.datetime.fromtimestamp(self.clock.now, datetime.timezone.utc)
+
+    def add_reservation(self, confirmation_number, first_name, last_name, departures):
+        """
+        Books a reservation with Southwest, with flights leaving at
+        `departures` (RFC 3339 timestamps)
+        """
+        self.southwest.add_reservation(confirmation_number, first_name, last_name, departures)
+
+    def send_email(self, confirmation_number, first_name, last_name, sender="passenger@example.com",
+                   itinerary=False):
+        """
+        Delivers a forwarded reservation email to the receive-email handler
+        now, and returns what the handler returned. The passenger is named in
+        the subject, or with `itinerary`, only in the body saved to S3.
+        """
+        self.emails += 1
+        message_id = "simulated-{}".format(self.emails)
+
+        if itinerary:
+            subject = "Fwd: Passenger Itinerary"
+            # Passenger names are written the way Southwest's records keep
+            # them, without spaces
+            body = "AIR Confirmation: {}\n*Passenger(s)*\n{}/{}\n".format(
+                confirmation_number, last_name.upper().replace(" ", ""), first_name.upper().replace(" ", ""))
+        else:
+            subject = "FW: Flight reservation ({}) | 12JUN17 | AUS-DCA | {}/{}".format(
+                confirmation_number, last_name, first_name)
+            body = ""
+
+        self.s3.put_object(
+            Bucket=EMAIL_BUCKET, Key=message_id,
+            Body="Subject: {}\r\nContent-Type: text/plain\r\n\r\n{}".format(subject, body)
+        )
+        event = {'Records': [{'ses': {'mail': {
+            'messageId': message_id,
+            'source': sender,
+            'commonHeaders': {'subject': subject, 'from': [sender]}
+        }}}]}
+        cpu_started = time.process_time()
+        try:
+            return self.receive_email(event, None)
+        finally:
+            self.receive_email_cpu_time.append(time.process_time() - cpu_started)
+
+    def run(self, until=None):
+        """
+        Runs the state machine until every execution has finished, or the
+        virtual clock reaches `until`. Returns the executions.
+        """
+        return self.machine.run(until)
+
+
+def _invoke(handler):
+    return lambda event: handler(event, None)
@@ -0,0 +1,547 @@
+#
+# state_machine.py
+# Runs the check-in state machine locally against a virtual clock
+#
+# The check-in flow lives in the Amazon States Language definition in
+# terraform/state_machine.tf. This interprets the parts of the language that
+# definition uses (Task, Map, Wait, Pass, Succeed and Fail states, with
+# Retry, Catch and the input and output paths), dispatching Task states to
+# local functions, so the whole pipeline can be run without deploying it.
+#
+# Nothing waits in real time. Executions are run in order of a virtual clock
+# which skips ahead to whatever is due next, so days of Wait states pass in
+# moments. Each task sees the clock as it was when the task started; the
+# time the task itself spends (e.g. sleeping on the clock) delays only the
+# execution it belongs to, as it would in its own Lambda invocation.
+#
+
+import heapq
+import importlib
+import itertools
+import json
+import logging
+import re
+import time
+
+import clock
+import timeutil
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+# Retry defaults from the States Language specification
+DEFAULT_RETRY_INTERVAL = 1
+DEFAULT_RETRY_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_BACKOFF_RATE = 2.0
+
+_TERRAFORM_DEFINITION = re.compile(r"definition\s*=\s*<<-?(\w+)\n(.*?)\n\s*\1\b", re.DOTALL)
+_TERRAFORM_LAMBDA_ARN = re.compile(r"\$\{aws_lambda_function\.(\w+)\.arn\}")
+_TERRAFORM_LAMBDA_HANDLER = re.compile(
+    r'resource\s+"aws_lambda_function"\s+"(\w+)"\s*\{.*?\bhandler\s*=\s*"([\w.]+)"', re.DOTALL
+)
+_PATH_TOKEN = re.compile(r"\.([^.\[]+)|\[(\d+)\]")
+
+
+class StatesError(Exception):
+    """
+    An error raised by a state, named the way the States Language names it:
+    a task's exception class name, or one of the `States.*` errors
+    """
+
+    def __init__(self, error, cause=None):
+        super().__init__("{}: {}".format(error, cause) if cause else error)
+        self.error = error
+        self.cause = cause
+
+    def output(self):
+        return {'Error': self.error, 'Cause': self.cause}
+
+
+def load_definition(path):
+    """
+    Reads the state machine definition from a Terraform file. Lambda ARNs
+    interpolated into the definition, like
+    `${aws_lambda_function.sw_check_in.arn}`, are replaced by the Terraform
+    resource name, `sw_check_in`.
+    """
+    with open(path) as fh:
+        match = _TERRAFORM_DEFINITION.search(fh.read())
+
+    if not match:
+        raise ValueError("No state machine definition in {}".format(path))
+
+    return json.loads(_TERRAFORM_LAMBDA_ARN.sub(r"\1", match.group(2)))
+
+
+def load_lambda_handlers(path):
+    """
+    Reads the Lambda functions from a Terraform file and returns a dict of
+    Terraform resource name to handler function
+    """
+    with open(path) as fh:
+        handlers = _TERRAFORM_LAMBDA_HANDLER.findall(fh.read())
+
+    functions = {}
+    for name, handler in handlers:
+        module_name, function_name = handler.rsplit(".", 1)
+        functions[name] = getattr(importlib.import_module(module_name), function_name)
+
+    return functions
+
+
+#
+# Paths
+#
+
+def _split_path(path):
+    if path == "$" or path == "$$":
+        return []
+
+    prefix = "$$" if path.startswith("$$") else "$"
+    rest = path[len(prefix):]
+    tokens = []
+    position = 0
+    for match in _PATH_TOKEN.finditer(rest):
+        if match.start() != position:
+            break
+        tokens.append(match.group(1) if match.group(1) is not None else int(match.group(2)))
+        position = match.end()
+
+    if position != len(rest):
+        raise StatesError("States.Runtime", "Unsupported path: {}".format(path))
+
+    return tokens
+
+
+def get_path(data, path, context=None):
+    """
+    Returns the value at a reference path like `$.data.email` or `$[0]`.
+    Paths starting with `$$` read from the `context` object instead.
+    """
+    value = context if path.startswith("$$") else data
+    for token in _split_path(path):
+        try:
+            value = value[token]
+        except (KeyError, IndexError, TypeError):
+            raise StatesError("States.Runtime", "Invalid path {}: not found in input".format(path))
+    return value
+
+
+def set_path(data, path, value):
+    """
+    Returns a copy of `data` with `value` placed at the reference path
+    `path`, creating objects along the way
+    """
+    tokens = _split_path(path)
+    if not tokens:
+        return value
+
+    result = dict(data) if isinstance(data, dict) else {}
+    node = result
+    for token in tokens[:-1]:
+        child = node.get(token)
+        node[token] = dict(child) if isinstance(child, dict) else {}
+        node = node[token]
+    node[tokens[-1]] = value
+    return result
+
+
+def apply_parameters(parameters, data, context=None):
+    """
+    Builds a state's effective input from its `Parameters` template. Keys
+    ending in `.$` take their value from a path.
+    """
+    if isinstance(parameters, dict):
+        result = {}
+        for key, value in parameters.items():
+            if key.endswith(".$"):
+                result[key[:-2]] = get_path(data, value, context)
+            else:
+                result[key] = apply_parameters(value, data, context)
+        return result
+
+    if isinstance(parameters, list):
+        return [apply_parameters(v, data, context) for v in parameters]
+
+    return parameters
+
+
+def _matches(error_equals, error):
+    return error.error in error_equals or "States.ALL" in error_equals or \
+        ("States.TaskFailed" in error_equals and not error.error.startswith("States."))
+
+
+def _find_rule(rules, error):
+    # Returns the index and the first Retry or Catch rule matching `error`
+    for index, rule in enumerate(rules):
+        if _matches(rule['ErrorEquals'], error):
+            return index, rule
+    return None, None
+
+
+# Passed for `result` by states which don't produce one
+_NO_RESULT = object()
+
+
+def _simulated_clock():
+    return clock.SimulatedClock(time.time())
+
+
+#
+# Executions
+#
+
+class StateStats(object):
+    """
+    What one state did across every execution: how often it was entered,
+    retried and failed (by error name), plus a sample per task invocation of
+    the handler's CPU time and its duration on the virtual clock
+    """
+
+    def __init__(self):
+        self.entered = 0
+        self.retries = 0
+        self.errors = {}
+        self.cpu_time = []
+        self.duration = []
+
+    def __repr__(self):
+        return "<StateStats entered={} retries={} errors={}>".format(self.entered, self.retries, self.errors)
+
+
+class Execution(object):
+    """
+    One run of the state machine. `status` is RUNNING, SUCCEEDED or FAILED;
+    `start` and `stop` are virtual Unix timestamps.
+    """
+
+    def __init__(self, name, input, start):
+        self.name = name
+        self.input = input
+        self.start = start
+        self.stop = None
+        self.status = "RUNNING"
+        self.output = None
+        self.error = None
+
+    def __repr__(self):
+        return "<Execution {} {}>".format(self.name, self.status)
+
+
+class _Sleep(object):
+    # Yielded by a process to resume at a virtual time
+    def __init__(self, until):
+        self.until = until
+
+
+class _Spawn(object):
+    # Yielded by a process to run child processes and resume with their results
+    def __init__(self, children, max_concurrency=0):
+        self.children = children
+        self.max_concurrency = max_concurrency
+
+
+class _Caught(Exception):
+    # Carries an error out of a state to the catcher that handles it
+    def __init__(self, error, catcher):
+        super().__init__(str(error))
+        self.error = error
+        self.catcher = catcher
+
+
+class _Group(object):
+    # The child processes a parent is waiting on
+    def __init__(self, parent, count, max_concurrency):
+        self.parent = parent
+        self.results = [None] * count
+        self.waiting = count
+        self.running = 0
+        self.queued = []
+        self.max_concurrency = max_concurrency
+        self.cancelled = False
+
+
+class _Process(object):
+    def __init__(self, generator, execution, group=None, index=None):
+        self.generator = generator
+        self.execution = execution
+        self.group = group
+        self.index = index
+
+    @property
+    def alive(self):
+        group = self.group
+        while group is not None:
+            if group.cancelled:
+                return False
+            group = group.parent.group
+        return True
+
+
+class StateMachine(object):
+    """
+    Runs executions of a state machine `definition` (a parsed States
+    Language document). Task states call `resources[state['Resource']]`
+    with the task's input.
+
+    `clock` is a clock.SimulatedClock which starts at the current time by
+    default. Tasks which need the time should read (and sleep on) it.
+    """
+
+    def __init__(self, definition, resources, clock=None):
+        self.definition = definition
+        self.resources = resources
+        self.clock = clock or _simulated_clock()
+        self.executions = []
+        self.stats = {}
+        self._queue = []
+        self._sequence = itertools.count()
+        self._names = set()
+
+    def start_execution(self, input, name=None):
+        """
+        Starts an execution at the clock's current time. It runs when `run`
+        is called.
+        """
+        name = name or "execution-{}".format(len(self.executions) + 1)
+        if name in self._names:
+            raise StatesError("ExecutionAlreadyExists", name)
+        self._names.add(name)
+
+        execution = Execution(name, input, self.clock.now)
+        self.executions.append(execution)
+
+        context = {'Execution': {'Id': name, 'Name': name, 'Input': input, 'StartTime': execution.start}}
+        self._schedule(_Process(self._run_states(self.definition, input, context), execution), self.clock.now)
+        return execution
+
+    def run(self, until=None):
+        """
+        Runs every started execution until it finishes, or until the virtual
+        clock would pass `until`. Returns the executions.
+        """
+        while self._queue:
+            if until is not None and self._queue[0][0] > until:
+                self.clock.now = until
+                break
+
+            at, _, process, value, error = heapq.heappop(self._queue)
+            if process.alive:
+                self.clock.now = at
+                self._step(process, value, error)
+
+        return self.executions
+
+    def _schedule(self, process, at, value=None, error=None):
+        heapq.heappush(self._queue, (at, next(self._sequence), process, value, error))
+
+    def _step(self, process, value=None, error=None):
+        now = self.clock.now
+        try:
+            if error is not None:
+                command = process.generator.throw(error)
+            else:
+                command = process.generator.send(value)
+        except StopIteration as e:
+            self._finish(process, now, result=e.value)
+            return
+        except StatesError as e:
+            self._finish(process, now, error=e)
+            return
+
+        if isinstance(command, _Sleep):
+            self._schedule(process, max(now, command.until))
+        elif not command.children:
+            self._schedule(process, now, value=[])
+        else:
+            group = _Group(process, len(command.children), command.max_concurrency)
+            group.queued = [
+                _Process(child, process.execution, group, i) for i, child in enumerate(command.children)
+            ]
+            group.queued.reverse()
+            self._start_children(group, now)
+
+    def _start_children(self, group, now):
+        while group.queued and (not group.max_concurrency or group.running < group.max_concurrency):
+            group.running += 1
+            self._schedule(group.queued.pop(), now)
+
+    def _finish(self, process, now, result=None, error=None):
+        group = process.group
+        if group is None:
+            execution = process.execution
+            execution.stop = now
+            if error is None:
+                execution.status = "SUCCEEDED"
+                execution.output = result
+            else:
+                execution.status = "FAILED"
+                execution.error = error
+            return
+
+        if error is not None:
+            # One failed iteration fails the whole Map and stops the rest
+            group.cancelled = True
+            self._schedule(group.parent, now, error=error)
+            return
+
+        group.results[process.index] = result
+        group.waiting -= 1
+        group.running -= 1
+        if group.waiting == 0:
+            self._schedule(group.parent, now, value=group.results)
+        else:
+            self._start_children(group, now)
+
+    #
+    # States
+    #
+
+    def _stats(self, name):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = StateStats()
+        return stats
+
+    def _run_states(self, states, data, context):
+        name = states['StartAt']
+        while True:
+            state = states['States'][name]
+            stats = self._stats(name)
+            stats.entered += 1
+            kind = state['Type']
+            context = dict(context, State={'Name': name, 'EnteredTime': self.clock.now})
+
+            try:
+                if kind == "Task" or kind == "Map":
+                    data = yield from self._run_with_retries(name, state, data, context)
+                elif kind == "Wait":
+                    yield _Sleep(self._get_wait_until(state, data))
+                    data = self._get_output(state, data)
+                elif kind == "Pass":
+                    result = state['Result'] if 'Result' in state else self._get_input(state, data, context)
+                    data = self._get_output(state, data, result)
+                elif kind == "Succeed":
+                    return self._get_output(state, data)
+                elif kind == "Fail":
+                    raise StatesError(state.get('Error', "States.Fail"), state.get('Cause'))
+                else:
+                    raise StatesError("States.Runtime", "Unsupported state type {}".format(kind))
+            except _Caught as caught:
+                stats.errors[caught.error.error] = stats.errors.get(caught.error.error, 0) + 1
+                result_path = caught.catcher.get('ResultPath', "$")
+                if result_path is not None:
+                    data = set_path(data, result_path, caught.error.output())
+                name = caught.catcher['Next']
+                continue
+            except StatesError as e:
+                stats.errors[e.error] = stats.errors.get(e.error, 0) + 1
+                raise
+
+            if state.get('End'):
+                return data
+            name = state['Next']
+
+    def _run_with_retries(self, name, state, data, context):
+        stats = self._stats(name)
+        attempts = {}
+
+        while True:
+            try:
+                if state['Type'] == "Task":
+                    result = yield from self._run_task(name, state, data, context)
+                else:
+                    result = yield from self._run_map(state, data, context)
+                return self._get_output(state, data, result)
+            except StatesError as e:
+                # The first matching retrier decides, even once it's spent
+                index, retrier = _find_rule(state.get('Retry', []), e)
+                if retrier is not None:
+                    attempt = attempts.get(index, 0)
+                    if attempt < retrier.get('MaxAttempts', DEFAULT_RETRY_MAX_ATTEMPTS):
+                        attempts[index] = attempt + 1
+                        stats.retries += 1
+                        delay = retrier.get('IntervalSeconds', DEFAULT_RETRY_INTERVAL) * \
+                            retrier.get('BackoffRate', DEFAULT_RETRY_BACKOFF_RATE) ** attempt
+                        yield _Sleep(self.clock.now + delay)
+                        continue
+
+                _, catcher = _find_rule(state.get('Catch', []), e)
+                if catcher is not None:
+                    raise _Caught(e, catcher)
+                raise
+
+    def _run_task(self, name, state, data, context):
+        stats = self._stats(name)
+        function = self.resources[state['Resource']]
+        # Tasks get a copy of their input, as they would over the wire
+        task_input = json.loads(json.dumps(self._get_input(state, data, context)))
+
+        started = self.clock.now
+        cpu_started = time.process_time()
+        try:
+            result = function(task_input)
+            error = None
+        except Exception as e:
+            result = None
+            error = StatesError(type(e).__name__, json.dumps({'errorMessage': str(e), 'errorType': type(e).__name__}))
+        stats.cpu_time.append(time.process_time() - cpu_started)
+        finished = self.clock.now
+        stats.duration.append(finished - started)
+
+        # Only this execution is held up by the time the task took
+        self.clock.now = started
+        yield _Sleep(finished)
+
+        if error is not None:
+            raise error
+        return json.loads(json.dumps(result))
+
+    def _run_map(self, state, data, context):
+        data_in = self._get_input(state, data, context)
+        items = get_path(data_in, state.get('ItemsPath', "$"), context)
+        iterator = state.get('Iterator') or state['ItemProcessor']
+
+        children = []
+        for index, item in enumerate(items):
+            item_context = dict(context, Map={'Item': {'Index': index, 'Value': item}})
+            if 'Parameters' in state:
+                item_input = apply_parameters(state['Parameters'], data_in, item_context)
+            else:
+                item_input = item
+            children.append(self._run_states(iterator, item_input, item_context))
+
+        return (yield _Spawn(children, state.get('MaxConcurrency', 0)))
+
+    def _get_wait_until(self, state, data):
+        if 'Seconds' in state:
+            return self.clock.now + state['Seconds']
+        if 'SecondsPath' in state:
+            return self.clock.now + get_path(data, state['SecondsPath'])
+        timestamp = state['Timestamp'] if 'Timestamp' in state else get_path(data, state['TimestampPath'])
+        return timeutil.parse(timestamp).timestamp()
+
+    def _get_input(self, state, data, context):
+        if state.get('InputPath', "$") is None:
+            data = {}
+        elif 'InputPath' in state:
+            data = get_path(data, state['InputPath'])
+
+        if 'Parameters' in state and state['Type'] != "Map":
+            data = apply_parameters(state['Parameters'], data, context)
+
+        return data
+
+    def _get_output(self, state, data, result=_NO_RESULT):
+        if result is not _NO_RESULT:
+            if 'ResultSelector' in state:
+                result = apply_parameters(state['ResultSelector'], result)
+            path = state.get('ResultPath', "$")
+            if path is not None:
+                data = set_path(data, path, result)
+
+        if state.get('OutputPath', "$") is None:
+            return {}
+        if 'OutputPath' in state:
+            return get_path(data, state['OutputPath'])
+        return data
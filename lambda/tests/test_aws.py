@@ -0,0 +1,35 @@
+import unittest
+
+import mock
+
+import util
+
+import aws
+
+
+class TestClientRegistry(unittest.TestCase):
+
+    def tearDown(self):
+        aws.reset()
+
+    @mock.patch('boto3.client')
+    def test_client_is_reused(self, mock_client):
+        assert aws.client('ses') is aws.client('ses')
+        assert mock_client.call_count == 1
+
+    @mock.patch('boto3.client')
+    def test_client_config(self, mock_client):
+        aws.client('s3')
+        config = mock_client.call_args[1]['config']
+        assert config.connect_timeout == aws.CONNECT_TIMEOUT
+        assert config.read_timeout == aws.READ_TIMEOUT
+        assert config.retries == {'max_attempts': aws.MAX_ATTEMPTS}
+
+    def test_set_client(self):
+        fake = object()
+        aws.set_client('stepfunctions', fake)
+        assert aws.client('stepfunctions') is fake
+
+        aws.reset()
+        with mock.patch('boto3.client') as mock_client:
+            assert aws.client('stepfunctions') is mock_client.return_value
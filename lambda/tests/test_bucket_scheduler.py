@@ -0,0 +1,153 @@
+import threading
+import unittest
+
+import mock
+
+import util
+
+import aws
+import bucket_scheduler
+import clock
+import fake_aws
+import metrics
+
+START = 4090693700.0
+T0 = "2099-08-17T18:50:00-05:00"
+T1 = "2099-08-21T07:35:00-05:00"
+
+
+def event(confirmation_number, time, email="gwb@example.com"):
+    return {
+        'first_name': 'George',
+        'last_name': 'Bush',
+        'confirmation_number': confirmation_number,
+        'email': email,
+        'time': time
+    }
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = clock.SimulatedClock(START)
+        self.fired = []
+
+    def worker(self, bucket):
+        self.fired.append((self.clock.now, bucket.time, [r['confirmation_number'] for r in bucket.reservations]))
+        return len(bucket.reservations)
+
+    def scheduler(self):
+        return bucket_scheduler.Scheduler(
+            worker=self.worker, lead=5, now=self.clock.time, sleep=self.clock.sleep
+        )
+
+    def test_coalesces_check_ins_in_the_same_second(self):
+        scheduler = self.scheduler()
+        scheduler.add(event("DEF456", T1))
+        scheduler.add(event("ABC123", T0))
+        # The same second, written in UTC
+        scheduler.add(event("GHI789", "2099-08-17T23:50:00.250Z"))
+        assert len(scheduler) == 2
+
+        results = scheduler.run()
+
+        assert [(b.time, r) for b, r in results] == [(4090693800, 2), (4090998900, 1)]
+        assert [f[2] for f in self.fired] == [["ABC123", "GHI789"], ["DEF456"]]
+        # Each bucket fires its lead time early
+        for fired_at, second, _ in self.fired:
+            assert second - 5 <= fired_at < second - 4.9
+
+    def test_earlier_check_in_added_while_waiting(self):
+        scheduler = self.scheduler()
+        scheduler.add(event("DEF456", T1))
+
+        sleep = self.clock.sleep
+
+        def add_on_first_sleep(seconds):
+            sleep(seconds)
+            if len(scheduler) == 1:
+                scheduler.add(event("ABC123", T0))
+
+        scheduler._sleep = add_on_first_sleep
+        scheduler.run()
+
+        assert [f[2] for f in self.fired] == [["ABC123"], ["DEF456"]]
+
+    def test_add_cuts_real_wait_short(self):
+        scheduler = bucket_scheduler.Scheduler(worker=self.worker)
+        waiter = threading.Thread(target=scheduler._wait, args=(30,))
+        waiter.start()
+        scheduler.add(event("ABC123", T0))
+        waiter.join(5)
+        assert not waiter.is_alive()
+
+    def test_late_bucket_fires_immediately(self):
+        self.clock.now = START + 1000
+        scheduler = self.scheduler()
+        scheduler.add(event("ABC123", T0))
+        scheduler.run()
+
+        assert len(self.fired) == 1
+        assert self.fired[0][0] < START + 1001
+
+    def test_overlapping_buckets_keep_their_own_metrics(self):
+        sink = metrics.MemorySink()
+        # Both buckets are collecting before either records anything
+        together = threading.Barrier(2, timeout=5)
+
+        def worker(bucket):
+            with metrics.collect({'Bucket': bucket.time}):
+                together.wait()
+                for reservation in bucket.reservations:
+                    metrics.record("CheckInSuccess", reservation['confirmation_number'])
+                together.wait()
+
+        scheduler = bucket_scheduler.Scheduler(
+            worker=worker, max_workers=2, now=self.clock.time, sleep=self.clock.sleep
+        )
+        scheduler.add(event("ABC123", T0))
+        scheduler.add(event("DEF456", T0))
+        scheduler.add(event("GHI789", T1))
+        with mock.patch.object(metrics, 'sink', sink):
+            scheduler.run()
+
+        assert sorted(sink.values("CheckInSuccess", Bucket=4090693800)) == ["ABC123", "DEF456"]
+        assert sink.values("CheckInSuccess", Bucket=4090998900) == ["GHI789"]
+
+    def test_worker_errors(self):
+        scheduler = bucket_scheduler.Scheduler(
+            worker=mock.Mock(side_effect=ValueError("boom")), now=self.clock.time, sleep=self.clock.sleep
+        )
+        scheduler.add(event("ABC123", T0))
+        (bucket, result), = scheduler.run()
+        assert isinstance(result, ValueError)
+
+
+class TestCheckInBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.ses = fake_aws.FakeSESClient()
+        aws.set_client('ses', self.ses)
+
+    def tearDown(self):
+        aws.reset()
+
+    @mock.patch('handlers.check_in.main')
+    def test_failure_notifications(self, check_in_mock):
+        bucket = bucket_scheduler.Bucket(4090693800, [
+            event("ABC123", T0, "ok@example.com"),
+            event("DEF456", T0, "failed@example.com"),
+            event("GHI789", T0, "cancelled@example.com"),
+        ])
+        check_in_mock.return_value = [
+            {'confirmation_number': 'ABC123', 'checked_in': True},
+            {'confirmation_number': 'DEF456', 'error': 'SouthwestAPIError', 'message': "oops"},
+            {'confirmation_number': 'GHI789', 'error': 'ReservationNotFoundError', 'message': "gone"},
+        ]
+
+        results = bucket_scheduler.check_in_bucket(bucket)
+
+        check_in_mock.assert_called_once_with({'reservations': bucket.reservations}, None)
+        assert results == check_in_mock.return_value
+        assert [e['to'] for e in self.ses.sent] == ["failed@example.com"]
+        assert "Confirmation #DEF456" in self.ses.sent[0]['text']
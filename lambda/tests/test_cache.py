@@ -0,0 +1,107 @@
+import os
+import unittest
+
+import mock
+import vcr
+
+import util
+
+import cache, metrics, swa
+from fake_aws import FakeDynamoDBClient
+
+v = vcr.VCR(
+    cassette_library_dir=os.path.join(os.path.dirname(__file__), 'fixtures'),
+    decode_compressed_response=True
+)
+
+
+class FakeClock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class TestMemoryCache(unittest.TestCase):
+
+    def test_ttl(self):
+        clock = FakeClock()
+        c = cache.MemoryCache(ttl=10, max_size=10, now=clock.time)
+        c.set("a", 1)
+        assert c.get("a") == 1
+
+        clock.now += 10
+        assert c.get("a") is None
+        assert len(c) == 0
+
+    def test_evicts_least_recently_used(self):
+        c = cache.MemoryCache(ttl=10, max_size=2)
+        c.set("a", 1)
+        c.set("b", 2)
+        c.get("a")
+        c.set("c", 3)
+
+        assert c.get("a") == 1
+        assert c.get("b") is None
+        assert c.get("c") == 3
+
+
+class TestDynamoDBCache(unittest.TestCase):
+
+    def test_get_set(self):
+        clock = FakeClock()
+        c = cache.DynamoDBCache("cache", ttl=10, client=FakeDynamoDBClient(), now=clock.time)
+        assert c.get("a") is None
+
+        c.set("a", {"foo": "bar"})
+        assert c.get("a") == {"foo": "bar"}
+
+        # DynamoDB may not have deleted the item yet
+        clock.now += 10
+        assert c.get("a") is None
+
+
+class TestReservationCache(unittest.TestCase):
+
+    def test_key_normalization(self):
+        assert cache.ReservationCache.key("George", "Bush", "abc123") == \
+            cache.ReservationCache.key(" GEORGE ", "bush", "ABC123")
+        assert cache.ReservationCache.key("Steven", "Mc  Lovin", "ABC123") == "ABC123:steven mc lovin"
+
+    def test_counters(self):
+        sink = metrics.MemorySink()
+        c = cache.ReservationCache(cache.MemoryCache(ttl=10, max_size=10))
+        with mock.patch.object(metrics, 'sink', sink), metrics.collect():
+            assert c.get("George", "Bush", "ABC123") is None
+            c.set("George", "Bush", "ABC123", {"foo": "bar"})
+            assert c.get("george", "BUSH", "ABC123") == {"foo": "bar"}
+        assert (c.hits, c.misses) == (1, 1)
+        # Recorded with the rest of the invocation's metrics
+        assert len(sink.records) == 1
+        assert sink.values("ReservationCacheHit") == [1]
+        assert sink.values("ReservationCacheMiss") == [1]
+
+    def test_backend_errors_are_misses(self):
+        class BrokenBackend(object):
+            def get(self, key):
+                raise Exception("broken")
+
+            def set(self, key, value):
+                raise Exception("broken")
+
+        c = cache.ReservationCache(BrokenBackend())
+        c.set("George", "Bush", "ABC123", {"foo": "bar"})
+        assert c.get("George", "Bush", "ABC123") is None
+        assert c.misses == 1
+
+    @v.use_cassette('view_reservation.yml', filter_headers=['X-API-Key'])
+    def test_from_passenger_info_uses_cache(self):
+        c = cache.ReservationCache(cache.DynamoDBCache("cache", ttl=10, client=FakeDynamoDBClient()))
+        first = swa.Reservation.from_passenger_info("George", "Bush", "ABC123", cache=c)
+        # The cassette only has one response; a second request would fail
+        second = swa.Reservation.from_passenger_info("GEORGE", "BUSH", "ABC123", cache=c)
+
+        assert second.response == first.response
+        assert second.check_in_times == first.check_in_times
+        assert (c.hits, c.misses) == (1, 1)
@@ -0,0 +1,71 @@
+import unittest
+
+import util
+
+import clock
+
+
+class FakeClock(object):
+    def __init__(self, now, tick=0.001):
+        self.now = now
+        # Every reading advances the clock slightly, like a real busy-wait
+        self.tick = tick
+        self.sleeps = []
+
+    def time(self):
+        self.now += self.tick
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestWaitUntil(unittest.TestCase):
+
+    def test_wait_until(self):
+        fake = FakeClock(100.0)
+        clock.wait_until(105.0, now=fake.time, sleep=fake.sleep)
+        assert fake.now >= 105.0
+        # Sleep most of the way, then spin for the remainder
+        self.assertAlmostEqual(fake.sleeps[0], 5.0 - clock.SPIN_SECONDS, places=2)
+
+    def test_wait_until_past(self):
+        fake = FakeClock(100.0, tick=0)
+        late = clock.wait_until(99.5, now=fake.time, sleep=fake.sleep)
+        assert late == 0.5
+        assert fake.sleeps == []
+
+
+class TestSkewEstimator(unittest.TestCase):
+
+    def test_no_samples(self):
+        estimator = clock.SkewEstimator()
+        assert estimator.bounds is None
+        assert estimator.skew is None
+        assert estimator.local_time(100.0) is None
+
+    def test_samples_narrow_bounds(self):
+        estimator = clock.SkewEstimator()
+        # The server is 2.3s ahead. Its Date header reads 102 for requests
+        # made between local 99.7 and 100.7, and 103 from local 100.7.
+        estimator.add_sample("Thu, 01 Jan 1970 00:01:42 GMT", 99.9, 100.1)
+        estimator.add_sample("Thu, 01 Jan 1970 00:01:43 GMT", 100.6, 100.8)
+
+        lower, upper = estimator.bounds
+        self.assertAlmostEqual(lower, 103 - 100.8)
+        self.assertAlmostEqual(upper, 102 + 1 - 99.9)
+        assert lower <= 2.3 <= upper
+        self.assertAlmostEqual(estimator.local_time(200.0), 200.0 - lower)
+
+    def test_inconsistent_samples_use_latest(self):
+        estimator = clock.SkewEstimator()
+        estimator.add_sample("Thu, 01 Jan 1970 00:01:40 GMT", 100.0, 100.1)
+        estimator.add_sample("Thu, 01 Jan 1970 00:01:50 GMT", 100.0, 100.1)
+        self.assertAlmostEqual(estimator.bounds[0], 110 - 100.1)
+
+    def test_window(self):
+        estimator = clock.SkewEstimator(window=2)
+        for _ in range(5):
+            estimator.add_sample("Thu, 01 Jan 1970 00:01:40 GMT", 100.0, 100.1)
+        assert len(estimator.samples) == 2
@@ -0,0 +1,99 @@
+import unittest
+
+import util
+
+import email_parser
+
+
+class FakeEmail(object):
+    def __init__(self, subject, body=None):
+        self.subject = subject
+        self.message_id = 0
+        self._body = body
+        self.body_reads = 0
+
+    def body(self):
+        self.body_reads += 1
+        if self._body is None:
+            raise AssertionError("body should not have been read")
+        return self._body
+
+    def search_body(self, pattern):
+        return pattern.search(self.body())
+
+
+class TestEmailParser(unittest.TestCase):
+
+    def setUp(self):
+        email_parser.reset_stats()
+
+    def test_subject_formats_do_not_read_body(self):
+        subjects = [
+            'Fwd: Flight reservation (ABC123) | 25FEB18 | AUS-TUL | Bush/George',
+            'George Bush\'s 12/25 Detroit trip (ABC123)',
+            'ABC123 George Bush',
+        ]
+        for subject in subjects:
+            email_format, result = email_parser.parse(FakeEmail(subject))
+            assert not email_format.needs_body
+            assert result == ('George', 'Bush', 'ABC123'), subject
+
+    def test_itinerary(self):
+        msg = FakeEmail(
+            "Fwd: Here's your itinerary! (ABC123)",
+            "Blah blah PASSENGER\n  George Walker Bush\n  Check in online"
+        )
+        email_format, result = email_parser.parse(msg)
+        # The new subject format would also match, but itinerary takes precedence
+        assert email_format.name == "itinerary"
+        assert result == ('George', 'Bush', 'ABC123')
+        assert msg.body_reads == 1
+
+    def test_itinerary_from_html(self):
+        # Text stripped from the HTML part separates words with newlines and
+        # non-breaking spaces
+        msg = FakeEmail("Here's your itinerary! (ABC123)", "PASSENGER\n\nGeorge\xa0Bush\n\nCheck in")
+        email_format, result = email_parser.parse(msg)
+        assert result == ('George', 'Bush', 'ABC123')
+
+    def test_ticketless(self):
+        msg = FakeEmail(
+            "Passenger Itinerary for Bush",
+            "AIR Confirmation: ABC123\n*Passenger(s)*\nBUSH/GEORGE W\n"
+        )
+        email_format, result = email_parser.parse(msg)
+        assert email_format.name == "ticketless"
+        assert result == ('GEORGE', 'BUSH', 'ABC123')
+
+    def test_unclaimed(self):
+        email_format, result = email_parser.parse(FakeEmail("Price alert: review your monthly delivery"))
+        assert email_format is None
+        assert result == (None, None, None)
+
+    def test_find_format(self):
+        email_format, match = email_parser.find_format("Passenger Itinerary for Bush")
+        assert email_format.name == "ticketless"
+        assert email_parser.find_format("Price alert") == (None, None)
+
+    def test_stats(self):
+        email_parser.parse(FakeEmail('ABC123 George Bush'))
+        email_parser.parse(FakeEmail("Passenger Itinerary", "nothing useful"))
+
+        stats = email_parser.get_stats()
+        assert stats['manual'] == {'claimed': 1, 'matched': 1}
+        assert stats['ticketless'] == {'claimed': 1, 'matched': 0}
+        assert stats['legacy'] == {'claimed': 0, 'matched': 0}
+
+    def test_register_format(self):
+        custom = email_parser.EmailFormat(
+            "custom", 1, lambda msg, m: ("George", "Bush", m.group(1)),
+            keywords=("Boarding pass",), subject=r"\[([A-Z0-9]{6})\]"
+        )
+        email_parser.register_format(custom)
+        try:
+            email_format, result = email_parser.parse(FakeEmail("Boarding pass [ABC123]"))
+            assert email_format is custom
+            assert result == ("George", "Bush", "ABC123")
+            assert email_parser.FORMATS[0] is custom
+        finally:
+            email_parser.FORMATS.remove(custom)
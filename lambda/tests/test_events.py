@@ -0,0 +1,41 @@
+import unittest
+
+import util
+
+import events
+
+T0 = "2099-08-17T18:50:00-05:00"
+T1 = "2099-08-21T07:35:00-05:00"
+RESERVATION = {'first_name': 'George', 'last_name': 'Bush', 'confirmation_number': 'ABC123', 'email': None}
+
+
+class TestEvents(unittest.TestCase):
+
+    def test_schedule(self):
+        schedule = [{'time': T1, 'wait_until': T1}]
+        event = events.schedule(dict(RESERVATION, send_confirmation_email=False), [T1], schedule)
+        assert event == dict(
+            RESERVATION, version=events.SCHEMA_VERSION, check_in_times=[T1], check_in_schedule=schedule
+        )
+
+    def test_projected_event(self):
+        event = dict(RESERVATION, version=2, time=T0, wait_until=T0)
+        assert events.get_version(event) == 2
+        assert events.get_check_in_times(event) == [T0]
+        assert events.get_remaining(event) == []
+
+    def test_unversioned_event(self):
+        event = dict(RESERVATION, check_in_times=[T1, T0], time=T0)
+        assert events.get_version(event) == 1
+        assert events.get_check_in_times(event) == [T1, T0]
+        assert events.get_remaining(event) == []
+
+    def test_legacy_event(self):
+        event = dict(RESERVATION, check_in_times={'next': T0, 'remaining': [T1]})
+        assert events.get_version(event) == 0
+        assert events.get_check_in_times(event) == [T0, T1]
+        assert events.get_remaining(event) == [T1]
+
+        event = dict(RESERVATION, check_in_times={'remaining': []})
+        assert events.get_check_in_times(event) == []
+        assert events.get_remaining(event) == []
@@ -1,5 +1,9 @@
+import json
 import logging
 import os
+import subprocess
+import sys
+import time
 import unittest
 
 import mock
@@ -7,11 +11,17 @@ import vcr
 
 import util
 
-import exceptions
-from handlers import receive_email, schedule_check_in, check_in
+import aws, cache, exceptions, history, idempotency, metrics, schedule_index, swa, timeutil
+import fake_aws
+from fake_southwest import FakeSouthwestServer
+from handlers.receive_email import main as receive_email
+from handlers.schedule_check_in import main as schedule_check_in
+from handlers.check_in import main as check_in
+from handlers.check_in_failure import main as check_in_failure
 
 # Prevent the handler function from logging during test runs
 logging.disable(logging.CRITICAL)
+metrics.sink = lambda line: None
 
 v = vcr.VCR(
     cassette_library_dir=os.path.join(os.path.dirname(__file__), 'fixtures'),
@@ -19,9 +29,177 @@ v = vcr.VCR(
 )
 
 
+class TestLazyImports(unittest.TestCase):
+
+    def _loaded_modules(self, module):
+        src = os.path.join(os.path.dirname(__file__), '..', 'src')
+        probe = "import sys, {}; print(' '.join(sys.modules))".format(module)
+        output = subprocess.check_output([sys.executable, "-c", probe], cwd=src)
+        return output.decode('utf-8').split()
+
+    def test_package_imports_no_handlers(self):
+        loaded = self._loaded_modules('handlers')
+        assert 'handlers.check_in' not in loaded
+        assert 'boto3' not in loaded
+
+    def test_check_in_does_not_import_boto3(self):
+        loaded = self._loaded_modules('handlers.check_in')
+        assert 'boto3' not in loaded
+        assert 'mail' not in loaded
+        assert 'notifications' not in loaded
+
+
+class TestReceiveEmail(unittest.TestCase):
+
+    def setUp(self):
+        cache._reservation_cache = None
+        idempotency._store = None
+        self.sfn = fake_aws.FakeStepFunctionsClient()
+        aws.set_client('stepfunctions', self.sfn)
+        self.ses = fake_aws.FakeSESClient()
+        aws.set_client('ses', self.ses)
+        self.event = {'Records': [{'ses': util.load_fixture('ses_email_notification')}]}
+        self.state_machine = "arn:aws:states:us-east-1:123456789012:stateMachine:check-in"
+        os.environ['STATE_MACHINE_ARN'] = self.state_machine
+
+    def tearDown(self):
+        aws.reset()
+        idempotency._store = None
+        del os.environ['STATE_MACHINE_ARN']
+
+    @v.use_cassette('view_reservation.yml')
+    def test_receive_email(self):
+        result = receive_email(self.event, None)
+
+        name, = self.sfn.executions
+        assert name.startswith("bush-george-abc123-")
+        assert result['executionArn'] == \
+            "arn:aws:states:us-east-1:123456789012:execution:check-in:" + name
+        assert json.loads(self.sfn.executions[name]) == {
+            'first_name': 'George',
+            'last_name': 'Bush',
+            'confirmation_number': 'ABC123',
+            'email': 'gwb@example.com'
+        }
+
+    @v.use_cassette('view_reservation.yml')
+    def test_duplicate_email(self):
+        first = receive_email(self.event, None)
+        second = receive_email(self.event, None)
+
+        assert len(self.sfn.executions) == 1
+        assert second == {'executionArn': first['executionArn'], 'duplicate': True}
+        reply, = self.ses.sent
+        assert reply['to'] == 'gwb@example.com'
+        assert reply['subject'] == "Your checkin is already scheduled"
+        assert "ABC123" in reply['text']
+
+    @v.use_cassette('view_reservation.yml')
+    def test_failed_execution_is_replaced(self):
+        first = receive_email(self.event, None)
+        name, = self.sfn.executions
+        self.sfn.statuses[name] = 'FAILED'
+
+        second = receive_email(self.event, None)
+        assert 'duplicate' not in second
+        assert second['executionArn'] == first['executionArn'] + "-2"
+        assert sorted(self.sfn.executions) == [name, name + "-2"]
+        assert not self.ses.sent
+
+        # The replacement is running, so the next arrival is a duplicate
+        assert receive_email(self.event, None) == {'executionArn': second['executionArn'], 'duplicate': True}
+
+        self.sfn.statuses[name + "-2"] = 'TIMED_OUT'
+        assert receive_email(self.event, None)['executionArn'] == first['executionArn'] + "-3"
+
+    @v.use_cassette('view_reservation.yml')
+    def test_replacement_start_failure_is_retried(self):
+        receive_email(self.event, None)
+        name, = self.sfn.executions
+        self.sfn.statuses[name] = 'ABORTED'
+
+        with mock.patch.object(self.sfn, 'start_execution', side_effect=Exception("throttled")):
+            with self.assertRaises(Exception):
+                receive_email(self.event, None)
+
+        # SES retries the invocation, which replaces the aborted execution again
+        result = receive_email(self.event, None)
+        assert 'duplicate' not in result
+        assert sorted(self.sfn.executions) == [name, name + "-2"]
+
+    @v.use_cassette('view_reservation.yml')
+    def test_describe_failure_is_a_duplicate(self):
+        receive_email(self.event, None)
+        with mock.patch.object(self.sfn, 'describe_execution', side_effect=Exception("throttled")):
+            assert receive_email(self.event, None)['duplicate']
+        assert len(self.sfn.executions) == 1
+
+    @v.use_cassette('view_reservation.yml')
+    def test_duplicate_reaches_step_functions(self):
+        # Another container claimed the reservation with different input
+        receive_email(self.event, None)
+        idempotency._store = None
+        name, = self.sfn.executions
+        self.sfn.executions[name] = "{}"
+
+        result = receive_email(self.event, None)
+        assert result['duplicate']
+
+    @v.use_cassette('view_reservation.yml')
+    def test_start_failure_releases_claim(self):
+        with mock.patch.object(self.sfn, 'start_execution', side_effect=Exception("throttled")):
+            with self.assertRaises(Exception):
+                receive_email(self.event, None)
+
+        # SES retries the invocation
+        result = receive_email(self.event, None)
+        assert 'duplicate' not in result
+        assert len(self.sfn.executions) == 1
+
+    @v.use_cassette('view_reservation.yml')
+    def test_duplicate_uses_claimed_name(self):
+        # The earlier arrival started its execution under another name
+        idempotency.get_store().claim(
+            idempotency.reservation_key("ABC123", ["2099-08-17T18:50:00-05:00", "2099-08-21T07:35:00-05:00"]),
+            {'name': "earlier"}
+        )
+
+        result = receive_email(self.event, None)
+        assert result == {'executionArn': self.state_machine.replace(':stateMachine:', ':execution:') + ":earlier",
+                          'duplicate': True}
+        assert not self.sfn.executions
+
+    @v.use_cassette('view_reservation.yml')
+    def test_lookup_failure_is_retried(self):
+        with mock.patch('swa.Reservation.from_passenger_info', side_effect=exceptions.SouthwestAPIError("down")):
+            with self.assertRaises(exceptions.SouthwestAPIError):
+                receive_email(self.event, None)
+        assert not self.sfn.executions
+
+        # SES retries the invocation, and this time the lookup works
+        receive_email(self.event, None)
+        assert receive_email(self.event, None)['duplicate']
+        assert len(self.sfn.executions) == 1
+
+    @mock.patch('swa.Reservation.from_passenger_info')
+    def test_lookup_is_bounded(self, lookup_mock):
+        import handlers.receive_email
+        receive_email(self.event, None)
+        assert lookup_mock.call_args[1]['timeout'] == handlers.receive_email.LOOKUP_TIMEOUT
+
+    @mock.patch('swa.Reservation.from_passenger_info')
+    def test_reservation_not_found(self, lookup_mock):
+        lookup_mock.side_effect = exceptions.ReservationNotFoundError()
+        receive_email(self.event, None)
+        assert receive_email(self.event, None)['duplicate']
+        assert list(self.sfn.executions) == ["bush-george-abc123"]
+
+
 class TestScheduleCheckIn(unittest.TestCase):
 
     def setUp(self):
+        cache._reservation_cache = None
+        aws.set_client('ses', fake_aws.FakeSESClient())
         self.mock_event = {
             'first_name': 'George',
             'last_name': 'Bush',
@@ -29,16 +207,24 @@ class TestScheduleCheckIn(unittest.TestCase):
             'email': 'gwb@example.com'
         }
 
+    def tearDown(self):
+        aws.reset()
+
     @mock.patch('mail.send_confirmation')
     @v.use_cassette('view_reservation.yml')
     def test_schedule_check_in(self, email_mock):
         expected = {
+            'version': 2,
             'first_name': 'George',
             'last_name': 'Bush',
             'confirmation_number': 'ABC123',
             'check_in_times': [
-                '2099-08-21T07:35:05-05:00',
-                '2099-08-17T18:50:05-05:00',
+                '2099-08-21T07:35:00-05:00',
+                '2099-08-17T18:50:00-05:00',
+            ],
+            'check_in_schedule': [
+                {'time': '2099-08-21T07:35:00-05:00', 'wait_until': '2099-08-21T07:34:55-05:00'},
+                {'time': '2099-08-17T18:50:00-05:00', 'wait_until': '2099-08-17T18:49:55-05:00'},
             ],
             'email': 'gwb@example.com'
         }
@@ -46,6 +232,57 @@ class TestScheduleCheckIn(unittest.TestCase):
         result = schedule_check_in(self.mock_event, None)
         assert result == expected
 
+    @mock.patch('schedule_index._schedule_index')
+    @mock.patch('mail.send_confirmation')
+    @v.use_cassette('view_reservation.yml')
+    def test_schedule_check_in_updates_index(self, email_mock, index_mock):
+        schedule_check_in(self.mock_event, None)
+        index_mock.add.assert_called_once_with(
+            'ABC123', ['2099-08-21T07:35:00-05:00', '2099-08-17T18:50:00-05:00'],
+            'George', 'Bush', 'gwb@example.com'
+        )
+
+    @mock.patch('schedule_index.CHECK_IN_MODE', schedule_index.BUCKETS)
+    @mock.patch('schedule_index._schedule_index')
+    @mock.patch('mail.send_confirmation')
+    @v.use_cassette('view_reservation.yml')
+    def test_schedule_check_in_bucket_mode(self, email_mock, index_mock):
+        # The bucket scheduler checks in from the index, so the execution doesn't
+        result = schedule_check_in(self.mock_event, None)
+        assert result['check_in_schedule'] == []
+        assert len(result['check_in_times']) == 2
+        index_mock.add.assert_called_once()
+
+    @mock.patch('schedule_index.CHECK_IN_MODE', schedule_index.BUCKETS)
+    @mock.patch('schedule_index._schedule_index', None)
+    @mock.patch('schedule_index.SCHEDULE_INDEX_TABLE', None)
+    @mock.patch('schedule_index.SCHEDULE_INDEX_DB', None)
+    @mock.patch('mail.send_confirmation')
+    @v.use_cassette('view_reservation.yml')
+    def test_schedule_check_in_bucket_mode_without_index(self, email_mock):
+        result = schedule_check_in(self.mock_event, None)
+        assert len(result['check_in_schedule']) == 2
+
+    @mock.patch('schedule_index.CHECK_IN_MODE', schedule_index.BUCKETS)
+    @mock.patch('schedule_index._schedule_index')
+    @mock.patch('mail.send_confirmation')
+    @v.use_cassette('view_reservation.yml')
+    def test_schedule_check_in_bucket_mode_index_failure(self, email_mock, index_mock):
+        # Nothing would check in a reservation missing from the index
+        index_mock.add.return_value = False
+        result = schedule_check_in(self.mock_event, None)
+        assert len(result['check_in_schedule']) == 2
+
+    @mock.patch('handlers.schedule_check_in.log')
+    @mock.patch('mail.send_confirmation')
+    @v.use_cassette('view_reservation.yml')
+    def test_schedule_check_in_email_failure(self, email_mock, log_mock):
+        email_mock.side_effect = Exception("SES is down")
+        result = schedule_check_in(self.mock_event, None)
+
+        assert result['confirmation_number'] == 'ABC123'
+        log_mock.warning.assert_called_once_with("Unable to send confirmation email: SES is down")
+
     @mock.patch('mail.send_confirmation')
     @v.use_cassette('view_reservation.yml')
     def test_schedule_check_in_without_confirmation_email(self, email_mock):
@@ -53,6 +290,24 @@ class TestScheduleCheckIn(unittest.TestCase):
         schedule_check_in(self.mock_event, None)
         email_mock.assert_not_called()
 
+    def test_schedule_legacy_check_in(self):
+        self.mock_event['check_in_times'] = {
+            'next': '2099-08-17T18:50:00-05:00',
+            'remaining': ['2099-08-24T07:35:00-05:00', '2099-08-21T07:35:00-05:00']
+        }
+
+        result = schedule_check_in(self.mock_event, None)
+        assert result == {
+            'first_name': 'George',
+            'last_name': 'Bush',
+            'confirmation_number': 'ABC123',
+            'email': 'gwb@example.com',
+            'check_in_times': {
+                'next': '2099-08-21T07:35:00-05:00',
+                'remaining': ['2099-08-24T07:35:00-05:00']
+            }
+        }
+
 
 class TestCheckIn(unittest.TestCase):
 
@@ -68,18 +323,209 @@ class TestCheckIn(unittest.TestCase):
             'email': 'gwb@example.com',
             'time': '2099-08-21T07:35:05-05:00'
         }
+        self.ses = fake_aws.FakeSESClient(template_prefix="checkin-bot-")
+        aws.set_client('ses', self.ses)
+        self.sink, metrics.sink = metrics.sink, lambda line: None
+
+    def tearDown(self):
+        aws.reset()
+        metrics.sink = self.sink
 
     @v.use_cassette('check_in_success.yml')
     def test_check_in(self):
         assert(check_in(self.fake_event, None))
 
+    @mock.patch('swa.fire_check_in')
+    @mock.patch('swa.prepare_check_in')
+    def test_already_checked_in(self, prepare_mock, fire_mock):
+        fire_mock.return_value = {'alreadyCheckedIn': True}
+        check_in(self.fake_event, None)
+
+        sent, = self.ses.sent
+        assert sent['subject'] == "You're already checked in!"
+
+    def test_wait_fits_in_lambda_timeout(self):
+        import handlers.check_in
+        worst_case = (
+            handlers.check_in.MAX_WAIT_SECONDS + swa.PREPARE_CONNECT_TIMEOUT + swa.PREPARE_READ_TIMEOUT +
+            swa.CHECK_IN_RETRY_BUDGET + handlers.check_in.DRAIN_TIMEOUT
+        )
+        assert worst_case < handlers.check_in.LAMBDA_TIMEOUT
+
+    @mock.patch('schedule_index._schedule_index')
+    @v.use_cassette('check_in_success.yml')
+    def test_check_in_legacy_event(self, index_mock):
+        del self.fake_event['time']
+        self.fake_event['check_in_times'] = {
+            'next': '1999-08-17T18:50:05-05:00',
+            'remaining': ['2099-08-21T07:35:05-05:00']
+        }
+        # There are check-ins remaining
+        assert check_in(self.fake_event, None) is False
+        index_mock.remove_past.assert_called_once_with(
+            'ABC123', ['1999-08-17T18:50:05-05:00', '2099-08-21T07:35:05-05:00']
+        )
+
     @v.use_cassette('check_in_not_found.yml')
     def test_cancelled_check_in(self):
         with self.assertRaises(exceptions.ReservationNotFoundError):
             check_in(self.fake_event, None)
 
+    @mock.patch('schedule_index._schedule_index')
+    @v.use_cassette('check_in_success.yml')
+    def test_check_in_updates_index(self, index_mock):
+        check_in(self.fake_event, None)
+        index_mock.remove.assert_called_once_with('ABC123', ['2099-08-21T07:35:05-05:00'])
+
+    @mock.patch('schedule_index._schedule_index')
+    @v.use_cassette('check_in_not_found.yml')
+    def test_cancelled_check_in_updates_index(self, index_mock):
+        with self.assertRaises(exceptions.ReservationNotFoundError):
+            check_in(self.fake_event, None)
+        index_mock.remove.assert_called_once_with('ABC123')
+
     @v.use_cassette('check_in_failure.yml')
     def test_failed_check_in(self):
         with self.assertRaises(exceptions.SouthwestAPIError):
             check_in(self.fake_event, None)
 
+    @mock.patch('swa.fire_check_in')
+    @mock.patch('swa.prepare_check_in')
+    @mock.patch('time.time')
+    def test_check_in_waits_for_scheduled_time(self, time_mock, prepare_mock, fire_mock):
+        # Three seconds before the check-in time
+        time_mock.return_value = 4090998902.0
+        check_in(self.fake_event, None)
+        fire_mock.assert_called_with(prepare_mock.return_value, at=4090998905.0)
+
+    @mock.patch('swa.fire_check_in')
+    @mock.patch('swa.prepare_check_in')
+    def test_check_in_does_not_wait_for_distant_time(self, prepare_mock, fire_mock):
+        check_in(self.fake_event, None)
+        fire_mock.assert_called_with(prepare_mock.return_value, at=None)
+
+    def test_check_in_metrics(self):
+        sink = metrics.MemorySink()
+        # Scheduled for the next second, so the check-in waits for it
+        scheduled = int(time.time()) + 1
+        event = dict(self.fake_event, time=time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(scheduled)))
+
+        # The fake server's Date headers only have whole seconds, so the skew
+        # estimated from them can move by up to a second as samples arrive.
+        # It's really zero.
+        skew = mock.Mock(skew=0.0, bounds=(0.0, 0.0), local_time=lambda server_time: server_time)
+
+        with FakeSouthwestServer() as server, mock.patch('swa.API_URL', server.url), \
+                mock.patch.object(metrics, 'sink', sink), \
+                mock.patch('swa.clock_skew', skew), \
+                mock.patch('handlers.check_in._cold_start', True):
+            check_in(event, None)
+
+        assert sink.values("CheckInSuccess", Retries=0, Start="cold", Hour=time.gmtime(scheduled).tm_hour) == [1]
+        assert sink.values("BoardingPosition") == [33]
+        assert len(sink.values("InitDuration")) == 1
+        assert len(sink.values("CheckInGetTime")) == 1
+        assert len(sink.values("CheckInPostTime")) == 1
+        lateness, = sink.values("CheckInLateness", Retries=0)
+        assert 0 <= lateness - swa.CHECK_IN_SAFETY_MARGIN * 1000 < 500
+
+    @v.use_cassette('check_in_failure.yml')
+    def test_failed_check_in_metrics(self):
+        sink = metrics.MemorySink()
+        with mock.patch.object(metrics, 'sink', sink), \
+                mock.patch('handlers.check_in._cold_start', False), \
+                self.assertRaises(exceptions.SouthwestAPIError):
+            check_in(self.fake_event, None)
+
+        assert sink.values("CheckInFailure", Start="warm") == [1]
+        assert sink.values("CheckInSuccess") == []
+        assert len(sink.values("HandlerDuration")) == 1
+
+    def test_check_in_records_history(self):
+        check_in_history = history.CheckInHistory(history.SQLiteHistory(":memory:"))
+        event = dict(self.fake_event, time=time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(time.time() + 1)),
+                     execution="arn:aws:states:us-east-1:123456789012:execution:sw-check-in:ABC123")
+        missing = dict(event, confirmation_number='XYZ789')
+
+        with FakeSouthwestServer() as server, mock.patch('swa.API_URL', server.url), \
+                mock.patch('history._history', check_in_history):
+            check_in(event, None)
+            with self.assertRaises(exceptions.ReservationNotFoundError):
+                check_in(missing, None)
+
+        checked_in, not_found = check_in_history.between()
+        assert checked_in['confirmation_number'] == 'ABC123'
+        assert checked_in['execution'] == event['execution']
+        assert checked_in['outcome'] == history.CHECKED_IN
+        assert checked_in['scheduled'] == timeutil.parse(event['time']).timestamp()
+        assert checked_in['fired'] > checked_in['scheduled']
+        assert checked_in['lateness'] >= swa.CHECK_IN_SAFETY_MARGIN
+        assert checked_in['latency'] > 0
+        assert checked_in['retries'] == 0
+        assert (checked_in['boarding_position'], checked_in['passengers']) == (33, 1)
+        assert not_found['confirmation_number'] == 'XYZ789'
+        assert not_found['outcome'] == 'ReservationNotFoundError'
+
+    def test_batch_check_in(self):
+        missing = dict(self.fake_event, confirmation_number='XYZ789')
+        event = {'reservations': [self.fake_event, missing, self.fake_event]}
+
+        with FakeSouthwestServer() as server, mock.patch('swa.API_URL', server.url):
+            results = check_in(event, None)
+
+        assert results[0] == {'confirmation_number': 'ABC123', 'checked_in': True}
+        assert results[1]['confirmation_number'] == 'XYZ789'
+        assert results[1]['error'] == 'ReservationNotFoundError'
+        assert results[2] == {'confirmation_number': 'ABC123', 'checked_in': True}
+        assert len(self.ses.sent) == 2
+        assert self.ses.calls == ['SendEmail', 'SendEmail']
+
+    def test_batch_check_in_sends_bulk_email(self):
+        event = {'reservations': [self.fake_event, self.fake_event, self.fake_event]}
+
+        with FakeSouthwestServer() as server, mock.patch('swa.API_URL', server.url), \
+                mock.patch('notifications.SES_TEMPLATE_PREFIX', 'checkin-bot-'):
+            check_in(event, None)
+
+        assert self.ses.calls == ['SendBulkTemplatedEmail']
+        assert len(self.ses.sent) == 3
+        assert self.ses.sent[0]['subject'] == "You're checked in!"
+        assert "Please login to Southwest" in self.ses.sent[0]['text']
+
+
+class TestCheckInFailure(unittest.TestCase):
+
+    def setUp(self):
+        self.ses = fake_aws.FakeSESClient()
+        aws.set_client('ses', self.ses)
+
+    def tearDown(self):
+        aws.reset()
+
+    def test_check_in_failure(self):
+        event = {
+            'first_name': 'George',
+            'last_name': 'Bush',
+            'confirmation_number': 'ABC123',
+            'email': 'gwb@example.com',
+            'check_in_times': {'remaining': []}
+        }
+        assert check_in_failure(event, None)
+        assert self.ses.sent[0]['to'] == 'gwb@example.com'
+        assert self.ses.sent[0]['subject'] == "Error checking in to your flight"
+        assert "Confirmation #ABC123" in self.ses.sent[0]['text']
+
+    @mock.patch('schedule_index._schedule_index')
+    def test_check_in_failure_projected_event(self, index_mock):
+        event = {
+            'version': 2,
+            'first_name': 'George',
+            'last_name': 'Bush',
+            'confirmation_number': 'ABC123',
+            'email': 'gwb@example.com',
+            'time': '1999-08-17T18:50:05-05:00',
+            'wait_until': '1999-08-17T18:50:00-05:00',
+            'error': {'Error': 'SouthwestAPIError', 'Cause': '...'}
+        }
+        assert check_in_failure(event, None)
+        index_mock.remove_past.assert_called_once_with('ABC123', ['1999-08-17T18:50:05-05:00'])
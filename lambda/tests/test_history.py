@@ -0,0 +1,151 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import mock
+
+import util
+
+import clock
+import history
+from fake_aws import FakeDynamoDBClient
+
+T0 = 4090693800.0
+
+
+class TestCheckInHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.history = history.CheckInHistory(history.SQLiteHistory(":memory:"))
+
+    def test_record(self):
+        self.history.record(
+            "ABC123", history.CHECKED_IN, scheduled=T0, fired=T0 + 0.5, lateness=0.52, latency=0.08, retries=1,
+            boarding_positions=[14, 12, 13]
+        )
+        self.history.record("DEF456", "ReservationNotFoundError", scheduled=T0)
+
+        checked_in, not_found = self.history.between()
+        assert checked_in == {
+            'execution': None,
+            'confirmation_number': "ABC123",
+            'outcome': history.CHECKED_IN,
+            'scheduled': T0,
+            'fired': T0 + 0.5,
+            'lateness': 0.52,
+            'latency': 0.08,
+            'retries': 1,
+            'boarding_position': 12,
+            'passengers': 3
+        }
+        assert not_found['outcome'] == "ReservationNotFoundError"
+        assert not_found['boarding_position'] is None
+
+    def test_between(self):
+        self.history.record("ABC123", history.CHECKED_IN, scheduled=T0 + 60)
+        self.history.record("DEF456", history.CHECKED_IN, scheduled=T0)
+        self.history.record("GHI789", history.CHECKED_IN)
+
+        # In the order they were recorded
+        assert [o['confirmation_number'] for o in self.history.between()] == ["ABC123", "DEF456", "GHI789"]
+        assert [o['confirmation_number'] for o in self.history.between(T0, T0 + 60)] == ["DEF456"]
+        assert [o['confirmation_number'] for o in self.history.between(start=T0 + 1)] == ["ABC123"]
+        assert [o['confirmation_number'] for o in self.history.between(end=T0 + 60)] == ["DEF456"]
+
+    def test_retries_replace_their_outcome(self):
+        self.history.record("ABC123", "SouthwestAPIError", scheduled=T0, retries=1, execution="exec-1")
+        self.history.record("DEF456", history.CHECKED_IN, scheduled=T0, execution="exec-2")
+        self.history.record("ABC123", history.CHECKED_IN, scheduled=T0, retries=2, execution="exec-1")
+        # Another flight of the same execution, and a check-in without one
+        self.history.record("ABC123", history.CHECKED_IN, scheduled=T0 + 86400, execution="exec-1")
+        self.history.record("ABC123", history.CHECKED_IN, scheduled=T0)
+        self.history.record("ABC123", history.CHECKED_IN, scheduled=T0)
+
+        outcomes = self.history.between()
+        assert [(o['confirmation_number'], o['execution'], o['outcome']) for o in outcomes] == [
+            ("DEF456", "exec-2", history.CHECKED_IN),
+            ("ABC123", "exec-1", history.CHECKED_IN),
+            ("ABC123", "exec-1", history.CHECKED_IN),
+            ("ABC123", None, history.CHECKED_IN),
+            ("ABC123", None, history.CHECKED_IN)
+        ]
+        assert outcomes[1]['retries'] == 2
+
+    @mock.patch('history.log')
+    def test_backend_errors_are_logged(self, log_mock):
+        class Broken(object):
+            def append(self, outcomes):
+                raise IOError("disk full")
+
+        history.CheckInHistory(Broken()).record("ABC123", history.CHECKED_IN)
+        log_mock.warning.assert_called_once_with("Error recording check-in outcome for ABC123: disk full")
+
+
+class TestSQLiteHistory(unittest.TestCase):
+
+    def test_adds_execution_to_older_databases(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "history.db")
+            conn = sqlite3.connect(path)
+            with conn:
+                conn.execute("CREATE TABLE outcomes (confirmation_number TEXT NOT NULL, outcome TEXT NOT NULL, "
+                             "scheduled REAL, fired REAL, lateness REAL, latency REAL, retries INTEGER, "
+                             "boarding_position INTEGER, passengers INTEGER)")
+                conn.execute("INSERT INTO outcomes (confirmation_number, outcome) VALUES ('ABC123', 'checked_in')")
+            conn.close()
+
+            backend = history.SQLiteHistory(path)
+            backend.append([{'execution': "exec-1", 'confirmation_number': "DEF456", 'outcome': history.CHECKED_IN}])
+            outcomes = backend.between()
+            backend.close()
+
+        assert [(o['confirmation_number'], o['execution']) for o in outcomes] == [
+            ("ABC123", None), ("DEF456", "exec-1")
+        ]
+
+
+class TestDynamoDBHistory(TestCheckInHistory):
+
+    def setUp(self):
+        # Outcomes are recorded a second apart, in small pages
+        c = clock.SimulatedClock(T0 + 3600, tick=1)
+        self.client = FakeDynamoDBClient('day', 'id', page_size=1)
+        self.history = history.CheckInHistory(history.DynamoDBHistory("history", client=self.client, now=c.time))
+
+    def test_items(self):
+        self.history.record("ABC123", history.CHECKED_IN, scheduled=T0, retries=0, boarding_positions=[12])
+        self.history.record("DEF456", "ReservationNotFoundError")
+
+        checked_in, not_found = sorted(self.client.tables["history"].values(), key=lambda item: item['id']['S'])
+        assert checked_in == {
+            'day': {'N': str(int(T0 // 86400))},
+            'id': {'S': "{:017.6f}#ABC123".format(T0 + 3601)},
+            'recorded': {'N': repr(T0 + 3601)},
+            'confirmation_number': {'S': "ABC123"},
+            'outcome': {'S': history.CHECKED_IN},
+            'scheduled': {'N': str(T0)},
+            'retries': {'N': "0"},
+            'boarding_position': {'N': "12"},
+            'passengers': {'N': "1"}
+        }
+        # Without a scheduled time, filed under the day it was recorded
+        assert not_found['day'] == {'N': str(int((T0 + 3602) // 86400))}
+
+    def test_retry_overwrites_its_item(self):
+        self.history.record("ABC123", "SouthwestAPIError", scheduled=T0, execution="arn:exec-1")
+        self.history.record("ABC123", history.CHECKED_IN, scheduled=T0, execution="arn:exec-1")
+
+        item, = self.client.tables["history"].values()
+        assert item['id'] == {'S': "arn:exec-1#ABC123#{!r}".format(T0)}
+        assert item['outcome'] == {'S': history.CHECKED_IN}
+        assert item['recorded'] == {'N': repr(T0 + 3602)}
+
+    def test_between_reads_only_the_days_needed(self):
+        self.history.record("ABC123", history.CHECKED_IN, scheduled=T0)
+
+        with mock.patch.object(self.client, 'query', wraps=self.client.query) as query_mock, \
+                mock.patch.object(self.client, 'scan') as scan_mock:
+            assert len(self.history.between(T0, T0 + 60)) == 1
+        assert query_mock.call_count == 1
+        scan_mock.assert_not_called()
@@ -0,0 +1,87 @@
+import unittest
+
+import mock
+
+import util
+
+import clock
+import idempotency
+from fake_aws import FakeDynamoDBClient
+
+DEPARTURES = ['2099-08-21T07:35:00-05:00', '2099-08-17T18:50:00-05:00']
+
+
+class TestKeys(unittest.TestCase):
+
+    def test_fingerprint_ignores_order(self):
+        assert idempotency.fingerprint(DEPARTURES) == idempotency.fingerprint(list(reversed(DEPARTURES)))
+        assert idempotency.fingerprint(DEPARTURES) != idempotency.fingerprint(DEPARTURES[:1])
+
+    def test_reservation_key(self):
+        assert idempotency.reservation_key("abc123") == "ABC123"
+        assert idempotency.reservation_key("ABC123", DEPARTURES) == \
+            "ABC123:" + idempotency.fingerprint(DEPARTURES)
+
+
+class TestMemoryStore(unittest.TestCase):
+
+    def test_claim(self):
+        store = idempotency.MemoryStore(window=60)
+        assert store.claim("ABC123", {'name': 'first'}) is None
+        assert store.claim("ABC123", {'name': 'second'}) == {'name': 'first'}
+        assert store.claim("DEF456", {'name': 'other'}) is None
+
+    def test_window(self):
+        c = clock.SimulatedClock(1000.0)
+        store = idempotency.MemoryStore(window=60, now=c.time)
+        store.claim("ABC123", {'name': 'first'})
+
+        c.now += 60
+        assert store.claim("ABC123", {'name': 'second'}) is None
+        assert store.claim("ABC123", {'name': 'third'}) == {'name': 'second'}
+
+    def test_release(self):
+        store = idempotency.MemoryStore(window=60)
+        store.claim("ABC123", {'name': 'first'})
+        store.release("ABC123")
+        store.release("ABC123")
+        assert store.claim("ABC123", {'name': 'second'}) is None
+
+
+class TestDynamoDBStore(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeDynamoDBClient()
+        self.clock = clock.SimulatedClock(1000.0)
+        self.store = idempotency.DynamoDBStore("claims", window=60, client=self.client, now=self.clock.time)
+
+    def test_claim(self):
+        assert self.store.claim("ABC123", {'name': 'first'}) is None
+        assert self.store.claim("ABC123", {'name': 'second'}) == {'name': 'first'}
+
+        item = self.client.tables["claims"]["ABC123"]
+        assert item['expires_at'] == {'N': '1060'}
+
+    def test_expired_claim_not_yet_removed(self):
+        self.store.claim("ABC123", {'name': 'first'})
+        self.clock.now += 61
+        assert self.store.claim("ABC123", {'name': 'second'}) is None
+
+    def test_release(self):
+        self.store.claim("ABC123", {'name': 'first'})
+        self.store.release("ABC123")
+        assert "ABC123" not in self.client.tables["claims"]
+
+
+class TestIdempotencyStore(unittest.TestCase):
+
+    @mock.patch('idempotency.log')
+    def test_broken_backend_allows_claim(self, log_mock):
+        backend = mock.Mock()
+        backend.claim.side_effect = Exception("table missing")
+        backend.release.side_effect = Exception("table missing")
+        store = idempotency.IdempotencyStore(backend)
+
+        assert store.claim("ABC123", {}) is None
+        store.release("ABC123")
+        assert log_mock.warning.call_count == 2
@@ -1,3 +1,4 @@
+import re
 import unittest
 
 import mock
@@ -6,7 +7,9 @@ from collections import namedtuple
 
 import util
 
-import mail, exceptions
+import aws, mail, exceptions
+import email_parser
+import fake_aws
 
 class FakeEmail(object):
     def __init__(self, subject, message_id, body=""):
@@ -35,25 +38,96 @@ class TestSesMailNotification(unittest.TestCase):
         assert msg.source == "prvs=31198f0cd=gwb@example.com"
 
 
+class TestSearchBody(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = fake_aws.FakeS3Client()
+        aws.set_client('s3', self.s3)
+        self.data = util.load_fixture('ses_email_notification')['mail']
+        self.msg = mail.SesMailNotification(self.data, s3_bucket="bucket")
+
+    def tearDown(self):
+        aws.reset()
+
+    def put_body(self, body):
+        message = "Subject: Passenger Itinerary\r\nContent-Type: text/plain\r\n\r\n" + body
+        self.s3.put_object(Bucket="bucket", Key=self.data['messageId'], Body=message)
+
+    def test_stops_download_after_match(self):
+        marker = "AIR Confirmation: ABC123\n*Passenger(s)*\nBUSH/GEORGE W\n"
+        self.put_body(marker + ("x" * 70 + "\n") * 5000)
+
+        match = self.msg.search_body(email_parser.TICKETLESS_PASSENGER)
+        assert match.groups() == ("ABC123", "BUSH/GEORGE")
+        body = self.s3.bodies[0]
+        assert body.bytes_read < len(body.data) / 10
+        assert body.closed
+
+    def test_no_match_reads_whole_body(self):
+        self.put_body("nothing to see here\n" * 5000)
+
+        assert self.msg.search_body(email_parser.ITINERARY_PASSENGER) is None
+        body = self.s3.bodies[0]
+        assert body.bytes_read == len(body.data)
+        assert body.closed
+
+    def test_uses_downloaded_body(self):
+        self.put_body("PASSENGER George Bush Check in")
+        self.msg.body()
+
+        assert self.msg.search_body(email_parser.ITINERARY_PASSENGER)
+        assert len(self.s3.bodies) == 1
+
+    def test_searches_decoded_html(self):
+        self.s3.put_object(
+            Bucket="bucket", Key=self.data['messageId'], Body=util.load_fixture('new_reservation_email')
+        )
+        match = self.msg.search_body(re.compile(r"Confirmation #\s+([A-Z0-9]{6})"))
+        assert match.group(1) == "ABC123"
+
+
+class TestSearchStream(unittest.TestCase):
+
+    def test_match_across_chunks(self):
+        chunks = ["x" * 100 + " PASSENGER\n  George Wal", "ker Bush\n  Check in online", "y" * 100]
+        match = mail.search_stream(chunks, email_parser.ITINERARY_PASSENGER)
+        assert match.group(1).split() == ["George", "Walker", "Bush"]
+
+    def test_match_at_chunk_end_is_not_truncated(self):
+        # The first chunk ends in the middle of the passenger's name
+        chunks = ["AIR Confirmation: ABC123 *Passenger(s)* BUSH/GE", "ORGE W\n"]
+        match = mail.search_stream(chunks, email_parser.TICKETLESS_PASSENGER)
+        assert match.group(2) == "BUSH/GEORGE"
+
+    def test_stops_after_match(self):
+        def chunks():
+            yield "PASSENGER George Bush Check in"
+            yield "more text"
+            raise AssertionError("read past the match")
+
+        assert mail.search_stream(chunks(), email_parser.ITINERARY_PASSENGER)
+
+
 class TestSendEmail(unittest.TestCase):
 
     def setUp(self):
         self.reservation = FakeReservation()
 
+    def tearDown(self):
+        aws.reset()
+
     # TODO(dw): This should probably be a send email test as well
-    @mock.patch('boto3.client')
-    def test_send_confirmation_destination(self, mock_client):
+    def test_send_confirmation_destination(self):
         ses_mock = mock.Mock()
-        mock_client.return_value = ses_mock
+        aws.set_client('ses', ses_mock)
         expected_destination = {'ToAddresses': ['gwb@example.com']}
 
         mail.send_confirmation("gwb@example.com", self.reservation)
         assert ses_mock.send_email.call_args[1]['Destination'] == expected_destination
 
-    @mock.patch('boto3.client')
-    def test_send_ses_email(self, mock_client):
+    def test_send_ses_email(self):
         ses_mock = mock.Mock()
-        mock_client.return_value = ses_mock
+        aws.set_client('ses', ses_mock)
 
         expected_msg = {
             'Subject': {
@@ -75,10 +149,9 @@ class TestSendEmail(unittest.TestCase):
         assert ses_mock.send_email.call_args[1]['Destination'] == expected_destination
         assert ses_mock.send_email.call_args[1]['Message'] == expected_msg
 
-    @mock.patch('boto3.client')
-    def test_send_ses_email_bcc_destination(self, mock_client):
+    def test_send_ses_email_bcc_destination(self):
         ses_mock = mock.Mock()
-        mock_client.return_value = ses_mock
+        aws.set_client('ses', ses_mock)
         expected_destination = {'ToAddresses': ['gwb@example.com'], 'BccAddresses': ['bcc@example.com']}
 
         mail.send_ses_email("gwb@example.com", "fake subject", "fake body", bcc="bcc@example.com")
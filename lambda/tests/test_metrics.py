@@ -0,0 +1,109 @@
+import json
+import threading
+import unittest
+
+import util
+
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.previous_sink = metrics.sink
+        self.sink = metrics.sink = metrics.MemorySink()
+
+    def tearDown(self):
+        metrics.sink = self.previous_sink
+
+    def test_put_metric(self):
+        metrics.put_metric("ClockSkew", 1.5, "Seconds", dimensions={'Hour': 14})
+
+        record, = self.sink.records
+        assert record['ClockSkew'] == 1.5
+        assert record['Hour'] == "14"
+        directive, = record['_aws']['CloudWatchMetrics']
+        assert directive['Dimensions'] == [[], ['Hour']]
+        assert directive['Metrics'] == [{'Name': "ClockSkew", 'Unit': "Seconds"}]
+
+    def test_collect(self):
+        with metrics.collect({'Start': "cold"}) as metric_set:
+            metrics.record("CheckInPostTime", 50, "Milliseconds")
+            metrics.record("CheckInPostTime", 60, "Milliseconds")
+            metrics.record("CheckInSuccess", 1, "Count", {'Retries': 1})
+            metric_set.set_dimension('Hour', 7)
+            # Nothing is emitted until the block exits
+            assert self.sink.records == []
+
+        assert len(self.sink.records) == 2
+        assert self.sink.values("CheckInPostTime") == [50, 60]
+        assert self.sink.values("CheckInSuccess", Retries=1, Start="cold", Hour=7) == [1]
+        assert self.sink.values("CheckInSuccess", Retries=0) == []
+
+    def test_record_outside_collect(self):
+        metrics.record("CheckInPostTime", 50, "Milliseconds")
+        assert self.sink.records == []
+
+    def test_record_from_threads(self):
+        with metrics.collect():
+            record = metrics.bind(metrics.record)
+            threads = [threading.Thread(target=record, args=("CheckInGetTime", i)) for i in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert sorted(self.sink.values("CheckInGetTime")) == list(range(10))
+
+    def test_record_on_another_thread_is_dropped(self):
+        with metrics.collect():
+            thread = threading.Thread(target=metrics.record, args=("CheckInGetTime", 1))
+            thread.start()
+            thread.join()
+
+        assert self.sink.records == []
+
+    def test_overlapping_collects(self):
+        # Two handlers on worker threads, the first finishing while the
+        # second is still collecting
+        first_started, second_started, first_done = threading.Event(), threading.Event(), threading.Event()
+
+        def first():
+            with metrics.collect({'Bucket': 1}):
+                metrics.record("CheckInSuccess", 1)
+                first_started.set()
+                second_started.wait(5)
+            first_done.set()
+
+        def second():
+            first_started.wait(5)
+            with metrics.collect({'Bucket': 2}):
+                second_started.set()
+                first_done.wait(5)
+                metrics.record("CheckInSuccess", 2)
+
+        threads = [threading.Thread(target=first), threading.Thread(target=second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert self.sink.values("CheckInSuccess", Bucket=1) == [1]
+        assert self.sink.values("CheckInSuccess", Bucket=2) == [2]
+
+    def test_values_split_across_lines(self):
+        with metrics.collect():
+            for i in range(metrics.MAX_VALUES + 1):
+                metrics.record("BoardingPosition", i)
+
+        assert [len(json.dumps(r['BoardingPosition']).split(",")) for r in self.sink.records] == \
+            [metrics.MAX_VALUES, 1]
+        assert self.sink.values("BoardingPosition") == list(range(metrics.MAX_VALUES + 1))
+
+    def test_sink_errors_are_logged(self):
+        def broken(line):
+            raise IOError("broken")
+
+        metrics.sink = broken
+        with metrics.collect():
+            metrics.record("CheckInSuccess", 1, "Count")
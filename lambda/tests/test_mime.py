@@ -0,0 +1,206 @@
+import base64
+import unittest
+
+import util
+
+import email_parser
+import mail
+import mime
+
+
+def chunked(message, size=64):
+    data = message.encode('utf-8')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+MULTIPART = """\
+From: gwb@example.com
+Subject: Fwd: Here's your itinerary! (ABC123)
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="outer"
+
+This is a multi-part message in MIME format.
+
+--outer
+Content-Type: multipart/alternative; boundary="inner"
+
+--inner
+Content-Type: text/plain; charset="utf-8"
+Content-Transfer-Encoding: quoted-printable
+
+PASSENGER Geo=
+rge Bush Check in caf=C3=A9
+--inner
+Content-Type: text/html; charset="utf-8"
+
+<p>PASSENGER <b>Laura Bush</b> Check in</p>
+--inner--
+
+--outer
+Content-Type: application/pdf
+Content-Disposition: attachment; filename="boarding-pass.pdf"
+Content-Transfer-Encoding: base64
+
+{attachment}
+--outer--
+"""
+
+
+def multipart(attachment_lines=10):
+    return MULTIPART.format(attachment="\n".join(["QUJDREVGR0g="] * attachment_lines))
+
+
+# An itinerary forwarded as an attachment, followed by another attachment
+FORWARDED = """\
+From: gwb@example.com
+Subject: Fwd: Here's your itinerary! (ABC123)
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="outer"
+
+--outer
+Content-Type: text/plain; charset="utf-8"
+
+See attached.
+
+--outer
+Content-Type: message/rfc822
+Content-Disposition: attachment; filename="itinerary.eml"
+
+From: Southwest Airlines <southwestairlines@ifly.southwest.com>
+Subject: Here's your itinerary! (ABC123)
+MIME-Version: 1.0
+Content-Type: multipart/alternative; boundary="forwarded"
+
+--forwarded
+Content-Type: text/plain; charset="utf-8"
+Content-Transfer-Encoding: quoted-printable
+
+PASSENGER Geo=
+rge Bush Check in
+--forwarded
+Content-Type: text/html; charset="utf-8"
+
+<p>PASSENGER <b>George Bush</b> Check in</p>
+--forwarded--
+
+--outer
+Content-Type: application/pdf
+Content-Disposition: attachment; filename="boarding-pass.pdf"
+Content-Transfer-Encoding: base64
+
+QUJDREVGR0g=
+--outer--
+"""
+
+
+class TestIterParts(unittest.TestCase):
+
+    def test_leaf_parts(self):
+        parts = [
+            (headers.get_content_type(), b"".join(lines))
+            for headers, lines in mime.iter_parts(chunked(multipart(2)))
+        ]
+
+        assert [t for t, _ in parts] == ["text/plain", "text/html", "application/pdf"]
+        assert parts[1][1].strip() == b"<p>PASSENGER <b>Laura Bush</b> Check in</p>"
+        assert parts[2][1].split() == [b"QUJDREVGR0g="] * 2
+
+    def test_single_part(self):
+        message = "Subject: ABC123 George Bush\n\nHello\nworld\n"
+        parts = [(headers['Subject'], b"".join(lines)) for headers, lines in mime.iter_parts(chunked(message, 5))]
+        assert parts == [("ABC123 George Bush", b"Hello\nworld\n")]
+
+    def test_forwarded_message(self):
+        parts = [headers.get_content_type() for headers, lines in mime.iter_parts(chunked(FORWARDED))]
+        assert parts == ["text/plain", "text/plain", "text/html", "application/pdf"]
+
+    def test_long_lines_are_split(self):
+        message = "Subject: test\n\n" + "x" * (mime.MAX_LINE_LENGTH * 3)
+        for headers, lines in mime.iter_parts(chunked(message, 4096)):
+            assert max(len(line) for line in lines) == mime.MAX_LINE_LENGTH
+
+
+class TestIterText(unittest.TestCase):
+
+    def test_plain_text_first(self):
+        text = "".join(mime.iter_text(chunked(multipart())))
+        # The soft line break no longer splits the passenger's name
+        assert text.startswith("PASSENGER George Bush Check in café\n")
+        # The HTML alternative follows, stripped of markup
+        assert text.rstrip().endswith("PASSENGER Laura Bush Check in")
+
+    def test_html_after_plain_text(self):
+        # The passenger is only in the HTML alternative
+        message = multipart().replace("PASSENGER Geo=\nrge Bush Check in caf=C3=A9", "Your trip is booked")
+        match = mail.search_stream(mime.iter_text(chunked(message)), email_parser.ITINERARY_PASSENGER)
+        assert match.group(1).split() == ["Laura", "Bush"]
+
+    def test_forwarded_message(self):
+        text = "".join(mime.iter_text(chunked(FORWARDED)))
+        assert text.startswith("See attached.")
+        assert "PASSENGER George Bush Check in" in text
+        assert "QUJD" not in text
+
+        match = mail.search_stream(mime.iter_text(chunked(FORWARDED)), email_parser.ITINERARY_PASSENGER)
+        assert match.group(1).split() == ["George", "Bush"]
+
+    def test_stops_before_attachments(self):
+        chunks = chunked(multipart(attachment_lines=10000))
+        consumed = []
+
+        def reader():
+            for chunk in chunks:
+                consumed.append(chunk)
+                yield chunk
+
+        for text in mime.iter_text(reader()):
+            break
+
+        assert len(consumed) < len(chunks) / 100
+
+    def test_html_fallback(self):
+        message = (
+            'Content-Type: multipart/mixed; boundary="b"\n\n'
+            '--b\n'
+            'Content-Type: text/html; charset="windows-1252"\n'
+            'Content-Transfer-Encoding: quoted-printable\n\n'
+            '<html><head><style>p {{ color: red; }}</style></head>\n'
+            '<body><p>Hi George,</p><td>Confirmation # <strong>AB=\nC123</strong></td>'
+            '<td>Geo=\nrge&nbsp;Bush</td></body></html>\n'
+            '--b\n'
+            'Content-Type: image/png\n'
+            'Content-Transfer-Encoding: base64\n\n'
+            '{}\n'
+            '--b--\n'
+        ).format(base64.b64encode(b"\x89PNG" * 100).decode('ascii'))
+
+        text = "".join(mime.iter_text(chunked(message)))
+        assert "color" not in text
+        assert "Confirmation # ABC123" in text
+        assert "George\xa0Bush" in text
+
+    def test_base64_text(self):
+        encoded = base64.encodebytes("PASSENGER José Bush Check in".encode('utf-8')).decode('ascii')
+        message = "Content-Type: text/plain; charset=utf-8\nContent-Transfer-Encoding: base64\n\n" + encoded
+        assert "".join(mime.iter_text(chunked(message, 3))) == "PASSENGER José Bush Check in"
+
+    def test_multibyte_character_split_across_chunks(self):
+        message = "Content-Type: text/plain; charset=utf-8\n\nPASSENGER José Bush Check in"
+        # Every other chunk ends between the two bytes of "é"
+        assert "".join(mime.iter_text(chunked(message, 1))) == "PASSENGER José Bush Check in"
+
+        # And a line too long to keep whole is split between them
+        text = "x" * (mime.MAX_LINE_LENGTH - 1) + "é"
+        message = "Content-Type: text/plain; charset=utf-8\n\n" + text
+        assert "".join(mime.iter_text(chunked(message, 4096))) == text
+
+    def test_unknown_charset(self):
+        message = "Content-Type: text/plain; charset=x-unknown\n\nPASSENGER George Bush Check in"
+        assert "".join(mime.iter_text(chunked(message))) == "PASSENGER George Bush Check in"
+
+    def test_new_reservation_email(self):
+        data = util.load_fixture('new_reservation_email')
+        text = "".join(mime.iter_text(chunked(data, 16 * 1024)))
+
+        assert "Confirmation # ABC123" in " ".join(text.split())
+        assert "<table" not in text
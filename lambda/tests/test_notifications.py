@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+import unittest
+
+import mock
+
+import util
+
+import aws
+import exceptions
+import fake_aws
+import notifications
+
+
+class TestTemplate(unittest.TestCase):
+
+    def test_render(self):
+        template = notifications.Template("test", "Hi {{{name}}}", "Flight {{ number }} to {{{city}}}.")
+        assert template.render({'name': 'George', 'number': 1234}) == ("Hi George", "Flight 1234 to .")
+
+    def test_templates_load(self):
+        for filename in os.listdir(notifications.TEMPLATE_DIR):
+            template = notifications.get_template(os.path.splitext(filename)[0])
+            assert template.subject
+            assert "\n" not in template.subject
+            assert not template.text.endswith("\n")
+
+    def test_checked_in(self):
+        subject, text = notifications.get_template('checked_in').render({'flights': "\nAUS => DAL (#1234)\n"})
+        assert subject == "You're checked in!"
+        assert text == (
+            "I just checked in to your flight! Please login to Southwest to view your boarding passes.\n"
+            "\nAUS => DAL (#1234)\n"
+        )
+
+
+class TestDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.sleeps = []
+        self.ses = fake_aws.FakeSESClient(template_prefix="checkin-bot-", sleep=self.sleeps.append)
+
+    def dispatcher(self, **kwargs):
+        kwargs.setdefault('template_prefix', '')
+        return notifications.Dispatcher(
+            source="bot@example.com", client=self.ses, sleep=self.sleeps.append, **kwargs
+        )
+
+    def test_local_templates(self):
+        dispatcher = self.dispatcher()
+        dispatcher.queue("gwb@example.com", 'checked_in', {'flights': ''})
+        dispatcher.queue("lwb@example.com", 'checked_in', {'flights': ''})
+        results = dispatcher.flush()
+
+        assert len(results) == 2
+        assert self.ses.calls == ['SendEmail', 'SendEmail']
+        assert [e['to'] for e in self.ses.sent] == ["gwb@example.com", "lwb@example.com"]
+        assert len(dispatcher) == 0
+
+    def test_bulk_templates(self):
+        dispatcher = self.dispatcher(template_prefix="checkin-bot-")
+        for i in range(notifications.MAX_BATCH_SIZE + 1):
+            dispatcher.queue("{}@example.com".format(i), 'checked_in', {'flights': ''})
+        dispatcher.queue("gwb@example.com", 'check_in_failed', {'confirmation_number': 'ABC123'})
+        results = dispatcher.flush()
+
+        assert len(results) == notifications.MAX_BATCH_SIZE + 2
+        assert self.ses.calls == ['SendBulkTemplatedEmail'] * 3
+        assert "Confirmation #ABC123" in self.ses.sent[-1]['text']
+
+    def test_throttling_backoff(self):
+        self.ses.throttle = 2
+        dispatcher = self.dispatcher()
+        dispatcher.send_email("gwb@example.com", "subject", "text")
+
+        assert len(self.ses.calls) == 3
+        assert self.sleeps == [notifications._get_retry_delay(0), notifications._get_retry_delay(1)]
+        assert len(self.ses.sent) == 1
+
+    def test_throttling_gives_up(self):
+        self.ses.throttle = notifications.THROTTLE_RETRIES + 1
+        dispatcher = self.dispatcher()
+        dispatcher.queue("gwb@example.com", 'checked_in', {})
+        dispatcher.queue("lwb@example.com", 'checked_in', {})
+        results = dispatcher.flush()
+
+        # The first send used up the retries, the second goes through
+        assert results[0].response['Error']['Code'] == 'Throttling'
+        assert [e['to'] for e in self.ses.sent] == ["lwb@example.com"]
+
+    def test_bulk_retries_throttled_destinations(self):
+        responses = [
+            {'Status': [{'Status': 'Success'}, {'Status': 'AccountThrottled'}, {'Status': 'MessageRejected'}]},
+            {'Status': [{'Status': 'Success'}]},
+        ]
+        calls = []
+
+        class Client(object):
+            def send_bulk_templated_email(self, **kwargs):
+                calls.append([d['Destination']['ToAddresses'][0] for d in kwargs['Destinations']])
+                return responses.pop(0)
+
+        dispatcher = notifications.Dispatcher(
+            source="bot@example.com", template_prefix="checkin-bot-", client=Client(), sleep=self.sleeps.append
+        )
+        for to in ("a@example.com", "b@example.com", "c@example.com"):
+            dispatcher.queue(to, 'checked_in', {})
+        results = dispatcher.flush()
+
+        assert calls == [["a@example.com", "b@example.com", "c@example.com"], ["b@example.com"]]
+        assert results[1] == {'Status': 'Success'}
+        assert isinstance(results[2], exceptions.NotificationError)
+        assert results[2].status == 'MessageRejected'
+
+    def test_send_raises(self):
+        self.ses.throttle = notifications.THROTTLE_RETRIES + 1
+        with self.assertRaises(Exception):
+            notifications.send("gwb@example.com", 'checked_in', {}, dispatcher=self.dispatcher())
+
+    def test_no_recipient(self):
+        assert notifications.send(None, 'checked_in', {}, dispatcher=self.dispatcher()) is None
+        assert self.ses.calls == []
+
+
+class TestBackground(unittest.TestCase):
+
+    def tearDown(self):
+        notifications.drain()
+
+    def test_drain_waits(self):
+        finished = []
+        started = threading.Event()
+
+        def slow():
+            started.set()
+            time.sleep(0.05)
+            finished.append(True)
+
+        notifications.submit(slow)
+        started.wait()
+        assert not finished
+        notifications.drain()
+        assert finished == [True]
+
+    @mock.patch('notifications.log')
+    def test_drain_logs_errors(self, log_mock):
+        def broken():
+            raise ValueError("no SES for you")
+
+        notifications.submit(broken)
+        notifications.drain()
+        log_mock.warning.assert_called_once_with("Error in background notification task: no SES for you")
+
+    @mock.patch('notifications.log')
+    def test_drain_timeout(self, log_mock):
+        release = threading.Event()
+        notifications.submit(release.wait)
+        try:
+            notifications.drain(timeout=0.01)
+        finally:
+            release.set()
+        log_mock.warning.assert_called_once_with("Gave up waiting for 1 background notification tasks")
+
+    def test_warm_up(self):
+        ses = fake_aws.FakeSESClient()
+        aws.set_client('ses', ses)
+        try:
+            assert notifications.warm_up().result() is ses
+        finally:
+            aws.reset()
@@ -0,0 +1,127 @@
+import unittest
+
+import mock
+
+import util
+
+import schedule_index
+from fake_aws import FakeDynamoDBClient
+
+T0 = "2099-08-17T18:50:00-05:00"
+T1 = "2099-08-21T07:35:00-05:00"
+T0_TS = 4090693800
+WEEK_LATER = T0_TS + 86400 * 7
+
+
+class TestScheduleIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = schedule_index.ScheduleIndex(schedule_index.SQLiteIndex(":memory:"))
+
+    def test_between(self):
+        self.index.add("ABC123", [T1, T0], "George", "Bush", "gwb@example.com")
+        self.index.add("DEF456", [T0], "Laura", "Bush")
+
+        entries = self.index.between(T0, T1)
+        assert [(e['time'], e['confirmation_number']) for e in entries] == [(T0_TS, "ABC123"), (T0_TS, "DEF456")]
+        assert entries[0]['check_in_time'] == T0
+        assert entries[0]['email'] == "gwb@example.com"
+
+        assert len(self.index.between(T0_TS, T0_TS + 1, limit=1)) == 1
+        assert len(self.index.between(T0, "2099-08-21T12:35:01Z")) == 3
+
+    def test_density(self):
+        self.index.add("ABC123", [T0, T1])
+        self.index.add("DEF456", [T0])
+        self.index.add("GHI789", ["2099-08-17T23:50:00Z"])
+
+        assert self.index.density(T0, T1) == [(T0_TS, 3)]
+        assert self.index.density(T0, WEEK_LATER, min_count=1) == [(T0_TS, 3), (T0_TS + 305100, 1)]
+
+    def test_add_is_idempotent(self):
+        self.index.add("ABC123", [T0])
+        self.index.add("ABC123", [T0], "George", "Bush")
+
+        entries = self.index.between(T0, T1)
+        assert len(entries) == 1
+        assert entries[0]['first_name'] == "George"
+
+    def test_remove(self):
+        self.index.add("ABC123", [T0, T1])
+        self.index.add("DEF456", [T0])
+
+        self.index.remove("ABC123", [T0])
+        assert [e['confirmation_number'] for e in self.index.between(T0, T0_TS + 1)] == ["DEF456"]
+
+        self.index.remove("ABC123")
+        assert [e['confirmation_number'] for e in self.index.between(T0, WEEK_LATER)] == ["DEF456"]
+
+    def test_remove_past(self):
+        self.index.add("ABC123", [T0, T1])
+        self.index.remove_past("ABC123", {'next': T0, 'remaining': [T1]}, now=T0_TS)
+
+        assert [e['check_in_time'] for e in self.index.between(T0, WEEK_LATER)] == [T1]
+
+    @mock.patch('schedule_index.log')
+    def test_backend_errors_are_logged(self, log_mock):
+        class Broken(object):
+            def add(self, entries):
+                raise IOError("disk full")
+
+        assert schedule_index.ScheduleIndex(Broken()).add("ABC123", [T0]) is False
+        log_mock.warning.assert_called_once_with("Error adding ABC123 to schedule index: disk full")
+
+
+class TestDynamoDBIndex(TestScheduleIndex):
+
+    def setUp(self):
+        # Small pages, so that queries have to follow LastEvaluatedKey
+        self.client = FakeDynamoDBClient(
+            'confirmation_number', 'time', indexes={'by_day': ('day', 'time')}, page_size=1
+        )
+        self.index = schedule_index.ScheduleIndex(schedule_index.DynamoDBIndex("index", client=self.client))
+
+    def test_items(self):
+        self.index.add("ABC123", [T0], "George", "Bush")
+
+        item, = self.client.tables["index"].values()
+        assert item == {
+            'confirmation_number': {'S': "ABC123"},
+            'time': {'N': str(T0_TS)},
+            'day': {'N': str(T0_TS // 86400)},
+            'expires_at': {'N': str(T0_TS + schedule_index.SCHEDULE_INDEX_TTL)},
+            'check_in_time': {'S': T0},
+            'first_name': {'S': "George"},
+            'last_name': {'S': "Bush"}
+        }
+        assert self.index.between(T0, T1)[0]['email'] is None
+
+    def test_between_reads_only_the_days_needed(self):
+        self.index.add("ABC123", [T0, T1])
+
+        with mock.patch.object(self.client, 'query', wraps=self.client.query) as query_mock:
+            assert len(self.index.between(T0, WEEK_LATER, limit=1)) == 1
+        assert {c[1]['ExpressionAttributeValues'][':day']['N'] for c in query_mock.call_args_list} == \
+            {str(T0_TS // 86400)}
+
+
+class TestGetScheduleIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.patcher = mock.patch('schedule_index._schedule_index', None)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    @mock.patch('schedule_index.SCHEDULE_INDEX_DB', None)
+    @mock.patch('schedule_index.SCHEDULE_INDEX_TABLE', None)
+    def test_none(self):
+        assert schedule_index.get_schedule_index() is None
+
+    @mock.patch('schedule_index.SCHEDULE_INDEX_DB', ":memory:")
+    @mock.patch('schedule_index.SCHEDULE_INDEX_TABLE', "index")
+    @mock.patch('aws.client')
+    def test_table_first(self, client_mock):
+        assert isinstance(schedule_index.get_schedule_index().backend, schedule_index.DynamoDBIndex)
+        client_mock.assert_called_once_with('dynamodb')
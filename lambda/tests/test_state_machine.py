@@ -0,0 +1,231 @@
+import os
+import unittest
+
+import util
+
+import clock
+import events
+import state_machine
+from simulator import Pipeline, TERRAFORM_PATH
+
+START = 4090000000.0
+DEPARTURES = ["2099-08-18T18:50:00.000-05:00", "2099-08-22T07:35:00.000-05:00"]
+
+
+class TestPaths(unittest.TestCase):
+
+    def test_get_path(self):
+        data = {'data': {'email': 'gwb@example.com', 'times': ['a', 'b']}}
+        assert state_machine.get_path(data, "$") == data
+        assert state_machine.get_path(data, "$.data.email") == 'gwb@example.com'
+        assert state_machine.get_path(data, "$.data.times[1]") == 'b'
+        assert state_machine.get_path(None, "$$.Map.Item.Value", {'Map': {'Item': {'Value': 1}}}) == 1
+
+        with self.assertRaises(state_machine.StatesError) as e:
+            state_machine.get_path(data, "$.data.missing")
+        assert e.exception.error == "States.Runtime"
+
+    def test_set_path(self):
+        data = {'data': {'email': 'gwb@example.com'}}
+        assert state_machine.set_path(data, "$", 1) == 1
+        assert state_machine.set_path(data, "$.error", 1) == {'data': {'email': 'gwb@example.com'}, 'error': 1}
+        assert state_machine.set_path(data, "$.data.email", None) == {'data': {'email': None}}
+        # The input isn't modified
+        assert data == {'data': {'email': 'gwb@example.com'}}
+
+    def test_apply_parameters(self):
+        parameters = {'name.$': "$.first_name", 'fixed': {'index.$': "$$.Map.Item.Index"}}
+        result = state_machine.apply_parameters(parameters, {'first_name': 'George'}, {'Map': {'Item': {'Index': 2}}})
+        assert result == {'name': 'George', 'fixed': {'index': 2}}
+
+
+class TestStateMachine(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = clock.SimulatedClock(START, tick=0)
+        self.calls = []
+
+    def machine(self, states, resources, start="Start"):
+        return state_machine.StateMachine({'StartAt': start, 'States': states}, resources, clock=self.clock)
+
+    def record(self, name, result=None):
+        def task(event):
+            self.calls.append((name, self.clock.now, event))
+            return result
+        return task
+
+    def test_waits_in_virtual_time(self):
+        machine = self.machine({
+            'Start': {'Type': "Wait", 'SecondsPath': "$.wait", 'Next': "Task"},
+            'Task': {'Type': "Task", 'Resource': "task", 'ResultPath': "$.result", 'End': True}
+        }, {'task': self.record("task", result="done")})
+
+        machine.start_execution({'wait': 86400}, name="day")
+        machine.start_execution({'wait': 60}, name="minute")
+        day, minute = machine.run()
+
+        assert [(c[0], c[1]) for c in self.calls] == [("task", START + 60), ("task", START + 86400)]
+        assert day.status == "SUCCEEDED"
+        assert day.output == {'wait': 86400, 'result': "done"}
+        assert day.stop == START + 86400
+
+    def test_task_time_holds_up_only_its_execution(self):
+        def slow(event):
+            self.clock.sleep(10)
+
+        machine = self.machine({
+            'Start': {'Type': "Task", 'Resource': "slow", 'Next': "Task"},
+            'Task': {'Type': "Task", 'Resource': "task", 'End': True}
+        }, {'slow': slow, 'task': self.record("task")})
+
+        machine.start_execution({})
+        machine.start_execution({})
+        machine.run()
+
+        assert [c[1] for c in self.calls] == [START + 10, START + 10]
+        assert machine.stats['Start'].duration == [10, 10]
+
+    def test_retry_and_catch(self):
+        attempts = []
+
+        def flaky(event):
+            attempts.append(self.clock.now)
+            raise ValueError("boom")
+
+        machine = self.machine({
+            'Start': {
+                'Type': "Task", 'Resource': "flaky",
+                'Retry': [{'ErrorEquals': ["ValueError"], 'IntervalSeconds': 3, 'MaxAttempts': 2}],
+                'Catch': [{'ErrorEquals': ["States.ALL"], 'ResultPath': "$.error", 'Next': "Failed"}],
+                'End': True
+            },
+            'Failed': {'Type': "Pass", 'End': True}
+        }, {'flaky': flaky})
+
+        execution = machine.start_execution({'name': 'George'})
+        machine.run()
+
+        assert attempts == [START, START + 3, START + 9]
+        assert execution.status == "SUCCEEDED"
+        assert execution.output['name'] == 'George'
+        assert execution.output['error']['Error'] == "ValueError"
+        assert machine.stats['Start'].retries == 2
+        assert machine.stats['Start'].errors == {'ValueError': 1}
+
+    def test_map_failure_stops_other_iterations(self):
+        def check(event):
+            if event['value'] == 'bad':
+                raise KeyError("bad")
+
+        machine = self.machine({
+            'Start': {
+                'Type': "Map",
+                'ItemsPath': "$.items",
+                'Parameters': {'value.$': "$$.Map.Item.Value.value", 'wait.$': "$$.Map.Item.Value.wait"},
+                'Iterator': {
+                    'StartAt': "Wait",
+                    'States': {
+                        'Wait': {'Type': "Wait", 'SecondsPath': "$.wait", 'Next': "Check"},
+                        'Check': {'Type': "Task", 'Resource': "check", 'Next': "Done"},
+                        'Done': {'Type': "Task", 'Resource': "done", 'End': True}
+                    }
+                },
+                'End': True
+            }
+        }, {'check': check, 'done': self.record("done")})
+
+        ok = machine.start_execution({'items': [{'value': 'good', 'wait': 10}, {'value': 'good', 'wait': 20}]})
+        failed = machine.start_execution({'items': [{'value': 'bad', 'wait': 10}, {'value': 'good', 'wait': 20}]})
+        machine.run()
+
+        assert ok.status == "SUCCEEDED"
+        assert ok.output == [None, None]
+        assert failed.status == "FAILED"
+        assert failed.error.error == "KeyError"
+        assert len(self.calls) == 2
+
+    def test_run_until(self):
+        machine = self.machine({'Start': {'Type': "Wait", 'Seconds': 100, 'End': True}}, {})
+        execution = machine.start_execution({})
+
+        machine.run(until=START + 50)
+        assert execution.status == "RUNNING"
+        assert self.clock.now == START + 50
+
+        machine.run()
+        assert execution.status == "SUCCEEDED"
+
+    def test_duplicate_name(self):
+        machine = self.machine({'Start': {'Type': "Succeed"}}, {})
+        machine.start_execution({}, name="check-in")
+        with self.assertRaises(state_machine.StatesError):
+            machine.start_execution({}, name="check-in")
+
+
+class TestTerraformDefinition(unittest.TestCase):
+
+    def test_load_definition(self):
+        definition = state_machine.load_definition(os.path.join(TERRAFORM_PATH, 'state_machine.tf'))
+        assert definition['StartAt'] == "ScheduleCheckIns"
+        assert definition['States']['ScheduleCheckIns']['Resource'] == "sw_schedule_check_in"
+
+    def test_check_ins_get_only_their_own_fields(self):
+        definition = state_machine.load_definition(os.path.join(TERRAFORM_PATH, 'state_machine.tf'))
+        reservation = {'first_name': 'George', 'last_name': 'Bush', 'confirmation_number': 'ABC123', 'email': None}
+        times = ["2099-08-21T07:35:00-05:00", "2099-08-17T18:50:00-05:00"]
+        schedule = [{'time': t, 'wait_until': t} for t in times]
+        check_ins = []
+
+        machine = state_machine.StateMachine(definition, {
+            'sw_schedule_check_in': lambda event: events.schedule(event, times, schedule),
+            'sw_check_in': check_ins.append
+        }, clock=clock.SimulatedClock(START, tick=0))
+        machine.start_execution(reservation)
+        execution, = machine.run()
+
+        assert execution.status == "SUCCEEDED"
+        assert sorted(check_ins, key=lambda e: e['time']) == [
+            dict(reservation, version=events.SCHEMA_VERSION, time=t, wait_until=t, execution=execution.name)
+            for t in sorted(times)
+        ]
+
+    def test_load_lambda_handlers(self):
+        handlers = state_machine.load_lambda_handlers(os.path.join(TERRAFORM_PATH, 'lambda.tf'))
+        assert sorted(handlers) == ['sw_check_in', 'sw_check_in_failure', 'sw_receive_email', 'sw_schedule_check_in']
+        assert handlers['sw_check_in'].__module__ == 'handlers.check_in'
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_check_in(self):
+        with Pipeline(start=START, latency=0.05) as pipeline:
+            pipeline.add_reservation("ABC123", "George", "Bush", DEPARTURES)
+            pipeline.send_email("ABC123", "George", "Bush")
+            execution, = pipeline.run()
+
+            assert execution.status == "SUCCEEDED"
+            check_ins = pipeline.southwest.check_ins
+            assert len(check_ins) == 2
+            for check_in in check_ins:
+                # After the safety margin, but well inside the first second
+                assert 0.5 < check_in['late'] < 1
+            subjects = [e['subject'] for e in pipeline.ses.sent]
+            assert subjects == ["Your checkin has been scheduled!", "You're checked in!", "You're checked in!"]
+
+    def test_itinerary_email_and_duplicates(self):
+        with Pipeline(start=START) as pipeline:
+            pipeline.add_reservation("ABC123", "George", "Bush", DEPARTURES)
+            pipeline.send_email("ABC123", "George", "Bush", itinerary=True)
+            assert pipeline.send_email("ABC123", "George", "Bush")['duplicate']
+            assert len(pipeline.run()) == 1
+
+    def test_cancelled_reservation(self):
+        with Pipeline(start=START) as pipeline:
+            pipeline.add_reservation("ABC123", "George", "Bush", DEPARTURES)
+            pipeline.send_email("ABC123", "George", "Bush")
+            pipeline.southwest.cancel("ABC123")
+            execution, = pipeline.run()
+
+            assert execution.status == "FAILED"
+            assert pipeline.machine.stats['CheckIn'].errors == {'ReservationNotFoundError': 1}
+            assert pipeline.southwest.check_ins == []
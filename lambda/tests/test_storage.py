@@ -0,0 +1,36 @@
+import unittest
+
+import mock
+
+import util
+
+import storage
+from fake_aws import FakeDynamoDBClient
+
+
+class TestLogErrors(unittest.TestCase):
+
+    def test_logs_and_carries_on(self):
+        log = mock.Mock()
+        with storage.log_errors(log, "Error writing ABC123"):
+            raise IOError("disk full")
+
+        log.warning.assert_called_once_with("Error writing ABC123: disk full")
+
+    def test_quiet_without_errors(self):
+        log = mock.Mock()
+        with storage.log_errors(log, "Error writing ABC123"):
+            pass
+
+        log.warning.assert_not_called()
+
+
+class TestPaginate(unittest.TestCase):
+
+    def test_follows_every_page(self):
+        client = FakeDynamoDBClient('key', page_size=1)
+        for key in ("a", "b", "c"):
+            client.put_item(TableName="table", Item={'key': {'S': key}})
+
+        items = storage.paginate(client.scan, TableName="table")
+        assert sorted(item['key']['S'] for item in items) == ["a", "b", "c"]
@@ -1,21 +1,25 @@
+import json
 import os
+import time
 import unittest
 
 import mock
+import requests
 import vcr
 
 import util
 
-import swa, exceptions
+import swa, exceptions, clock, metrics
+from fake_southwest import CHECK_IN_PATH, VIEW_RESERVATION_PATH, ErrorInjector, FakeSouthwestServer, parse_latency
 
 v = vcr.VCR(
     cassette_library_dir=os.path.join(os.path.dirname(__file__), 'fixtures'),
     decode_compressed_response=True
 )
 
-@mock.patch('swa.requests')
+@mock.patch('swa.get_session')
 class TestRequest(unittest.TestCase):
-    def test_make_request_get(self, mock_requests):
+    def test_make_request_get(self, mock_get_session):
         expected_headers = {
             "User-Agent": "SouthwestAndroid/7.2.1 android/10",
             "Accept": "application/json",
@@ -31,9 +35,12 @@ class TestRequest(unittest.TestCase):
             fake_data
         )
 
-        mock_requests.get.assert_called_with(expected_url, params=fake_data, headers=expected_headers)
+        mock_get_session.return_value.get.assert_called_with(
+            expected_url, params=fake_data, headers=expected_headers,
+            timeout=(swa.CONNECT_TIMEOUT, swa.READ_TIMEOUT)
+        )
 
-    def test_make_request_post(self, mock_requests):
+    def test_make_request_post(self, mock_get_session):
         expected_headers = {
             "User-Agent": "SouthwestAndroid/7.2.1 android/10",
             "Content-Type": "application/json",
@@ -50,13 +57,41 @@ class TestRequest(unittest.TestCase):
             fake_data
         )
 
-        mock_requests.post.assert_called_with(expected_url, json=fake_data, headers=expected_headers)
+        mock_get_session.return_value.post.assert_called_with(
+            expected_url, json=fake_data, headers=expected_headers,
+            timeout=(swa.CONNECT_TIMEOUT, swa.READ_TIMEOUT)
+        )
 
-    def test_make_request_invalid_method(self, mock_requests):
+    def test_make_request_invalid_method(self, mock_get_session):
         with self.assertRaises(NotImplementedError):
             swa._make_request("foo", "/foo/123456/bar", {}, "application/json")
 
 
+class TestSession(unittest.TestCase):
+    def tearDown(self):
+        swa.reset_session()
+
+    def test_session_is_reused(self):
+        assert swa.get_session() is swa.get_session()
+
+    def test_reset_session(self):
+        session = swa.get_session()
+        swa.reset_session()
+        assert swa.get_session() is not session
+
+    def test_session_pool_size(self):
+        adapter = swa.get_session().get_adapter("https://mobile.southwest.com/api")
+        assert adapter._pool_maxsize == swa.POOL_SIZE
+
+    def test_check_in_reuses_connection(self):
+        with FakeSouthwestServer() as server, mock.patch('swa.API_URL', server.url):
+            swa.check_in("George", "Bush", "ABC123")
+            swa.check_in("George", "Bush", "ABC123")
+
+        assert server.requests == 4
+        assert server.connections == 1
+
+
 class TestCheckIn(unittest.TestCase):
 
     @v.use_cassette('check_in_success.yml', filter_headers=['X-API-Key'])
@@ -72,6 +107,174 @@ class TestCheckIn(unittest.TestCase):
             result = swa.check_in("George", "Bush", "ABC123")
 
 
+class TestPreparedCheckIn(unittest.TestCase):
+
+    @v.use_cassette('check_in_success.yml', filter_headers=['X-API-Key'])
+    def test_prepare_and_fire(self):
+        prepared = swa.prepare_check_in("George", "Bush", "ABC123")
+        assert prepared.body['recordLocator'] == "ABC123"
+
+        result = swa.fire_check_in(prepared)
+        assert result['checkInConfirmationPage']['title']['key'] == "CHECKIN__YOURE_CHECKEDIN"
+
+    @mock.patch('swa._get_check_in_body')
+    def test_prepare_too_early(self, body_mock):
+        body_mock.side_effect = exceptions.SouthwestAPIError(
+            "too early", status_code=400, message_key="ERROR__AIR_TRAVEL__BEFORE_CHECKIN_WINDOW"
+        )
+        prepared = swa.prepare_check_in("George", "Bush", "ABC123")
+        assert prepared.body is None
+
+    @mock.patch('swa._get_check_in_body')
+    def test_prepare_timeout(self, body_mock):
+        swa.prepare_check_in("George", "Bush", "ABC123")
+        body_mock.assert_called_once_with(
+            "George", "Bush", "ABC123", timeout=(swa.PREPARE_CONNECT_TIMEOUT, swa.PREPARE_READ_TIMEOUT)
+        )
+
+    @mock.patch('swa._get_check_in_body')
+    def test_prepare_error(self, body_mock):
+        body_mock.side_effect = exceptions.SouthwestAPIError("forbidden", status_code=403)
+        with self.assertRaises(exceptions.SouthwestAPIError):
+            swa.prepare_check_in("George", "Bush", "ABC123")
+
+    @mock.patch('swa._post_check_in')
+    @mock.patch('swa._get_check_in_body')
+    @mock.patch('swa.get_fire_time')
+    @mock.patch('clock.wait_until')
+    def test_fire_waits_and_fetches_deferred_body(self, wait_mock, fire_time_mock, body_mock, post_mock):
+        prepared = swa.PreparedCheckIn("George", "Bush", "ABC123")
+        swa.fire_check_in(prepared, at=1234567890.5)
+
+        fire_time_mock.assert_called_with(1234567890.5)
+        wait_mock.assert_called_with(fire_time_mock.return_value)
+        body_mock.assert_called_with("George", "Bush", "ABC123", timeout=mock.ANY)
+        post_mock.assert_called_with(body_mock.return_value, mock.ANY)
+
+
+TOO_EARLY = exceptions.SouthwestAPIError(
+    "too early", status_code=400, message_key="ERROR__AIR_TRAVEL__BEFORE_CHECKIN_WINDOW"
+)
+SUCCESS = {'checkInConfirmationPage': {'title': {'key': 'CHECKIN__YOURE_CHECKEDIN'}}}
+
+
+class TestCheckInRetries(unittest.TestCase):
+
+    def test_classify_error(self):
+        already = exceptions.SouthwestAPIError(message_key="ERROR__CHECKIN__ALREADY_CHECKED_IN")
+        assert swa.classify_error(TOO_EARLY) == swa.TOO_EARLY
+        assert swa.classify_error(already) == swa.ALREADY_CHECKED_IN
+        assert swa.classify_error(exceptions.SouthwestAPIError(status_code=503)) == swa.TRANSIENT
+        assert swa.classify_error(requests.Timeout()) == swa.TRANSIENT
+        assert swa.classify_error(exceptions.SouthwestAPIError(status_code=403)) == swa.FATAL
+        assert swa.classify_error(exceptions.ReservationNotFoundError()) == swa.FATAL
+
+    @mock.patch('time.sleep')
+    @mock.patch('swa._post_check_in')
+    @mock.patch('swa._get_check_in_body')
+    def test_retry_too_early_reuses_body(self, body_mock, post_mock, sleep_mock):
+        post_mock.side_effect = [TOO_EARLY, TOO_EARLY, SUCCESS]
+        assert swa.check_in("George", "Bush", "ABC123") == SUCCESS
+        assert post_mock.call_count == 3
+        assert body_mock.call_count == 1
+        # Retries are quick and bounded
+        assert all(c[0][0] <= swa.TOO_EARLY_RETRY_MAX_DELAY for c in sleep_mock.call_args_list)
+
+    @mock.patch('time.sleep')
+    @mock.patch('swa._post_check_in')
+    @mock.patch('swa._get_check_in_body')
+    def test_retry_already_checked_in(self, body_mock, post_mock, sleep_mock):
+        post_mock.side_effect = [
+            requests.Timeout(),
+            exceptions.SouthwestAPIError(message_key="ERROR__CHECKIN__ALREADY_CHECKED_IN")
+        ]
+        assert swa.check_in("George", "Bush", "ABC123") == {'alreadyCheckedIn': True}
+
+    @mock.patch('swa._post_check_in')
+    @mock.patch('swa._get_check_in_body')
+    def test_fatal_error_not_retried(self, body_mock, post_mock):
+        post_mock.side_effect = exceptions.SouthwestAPIError(status_code=403)
+        with self.assertRaises(exceptions.SouthwestAPIError):
+            swa.check_in("George", "Bush", "ABC123")
+        assert post_mock.call_count == 1
+
+    @mock.patch('swa._post_check_in')
+    @mock.patch('swa._get_check_in_body')
+    def test_retry_budget(self, body_mock, post_mock):
+        post_mock.side_effect = TOO_EARLY
+        with self.assertRaises(exceptions.SouthwestAPIError):
+            swa.check_in("George", "Bush", "ABC123", budget=1)
+        assert 1 < post_mock.call_count < 10
+
+    @mock.patch('swa._post_check_in')
+    @mock.patch('swa._get_check_in_body')
+    def test_retry_timeouts_fit_the_budget(self, body_mock, post_mock):
+        post_mock.side_effect = requests.Timeout()
+        start = time.monotonic()
+        with self.assertRaises(requests.Timeout):
+            swa.check_in("George", "Bush", "ABC123", budget=2)
+
+        # However slow Southwest is, no attempt can run past the budget
+        assert post_mock.call_count > 1
+        for (body, timeout), _ in post_mock.call_args_list:
+            assert max(timeout) <= 2
+        connect, read = post_mock.call_args_list[-1][0][1]
+        assert time.monotonic() - start + read <= 2 + swa.MIN_ATTEMPT_TIMEOUT
+
+    def test_retry_until_window_opens(self):
+        opens_at = time.time() + 0.3
+        with FakeSouthwestServer(check_in_opens_at=opens_at) as server, mock.patch('swa.API_URL', server.url):
+            result = swa.check_in("George", "Bush", "ABC123")
+
+        assert result['checkInConfirmationPage']['title']['key'] == "CHECKIN__YOURE_CHECKEDIN"
+        assert time.time() >= opens_at
+        assert server.requests > 2
+
+    def test_retry_through_injected_errors(self):
+        errors = ErrorInjector()
+        errors.fail_next(2, status=503)
+        with FakeSouthwestServer(errors=errors) as server, mock.patch('swa.API_URL', server.url):
+            result = swa.check_in("George", "Bush", "ABC123")
+
+        assert result['checkInConfirmationPage']['title']['key'] == "CHECKIN__YOURE_CHECKEDIN"
+        assert errors.injected == {503: 2}
+
+
+class TestClockSkew(unittest.TestCase):
+
+    def setUp(self):
+        swa.clock_skew = clock.SkewEstimator()
+        self.metrics = []
+        self.sink, metrics.sink = metrics.sink, self.metrics.append
+
+    def tearDown(self):
+        swa.clock_skew = clock.SkewEstimator()
+        metrics.sink = self.sink
+
+    def test_skew_measured_from_date_header(self):
+        with FakeSouthwestServer(clock_offset=42.5) as server, mock.patch('swa.API_URL', server.url):
+            for _ in range(3):
+                swa.check_in("George", "Bush", "ABC123")
+
+        lower, upper = swa.clock_skew.bounds
+        assert lower <= 42.5 <= upper
+        assert upper - lower <= 1.0
+
+    def test_fire_time_uses_skew_and_margin(self):
+        swa.clock_skew.samples.append((2.0, 2.5))
+        with metrics.collect():
+            fire_time = swa.get_fire_time(1000.0)
+            # Recorded with the rest of the invocation's metrics, not written straight away
+            assert self.metrics == []
+
+        # Fire once Southwest's clock is certain to read check-in time + margin
+        assert fire_time == 1000.0 + swa.CHECK_IN_SAFETY_MARGIN - 2.0
+        assert json.loads(self.metrics[0])['ClockSkew'] == 2.25
+
+    def test_fire_time_uncalibrated(self):
+        assert swa.get_fire_time(1000.0) == 1000.0 + swa.UNCALIBRATED_DELAY
+
+
 class TestReservation(unittest.TestCase):
 
     @v.use_cassette('view_reservation.yml', filter_headers=['X-API-Key'])
@@ -82,19 +285,28 @@ class TestReservation(unittest.TestCase):
     @v.use_cassette('view_reservation.yml', filter_headers=['X-API-Key'])
     def test_check_in_times(self):
         r = swa.Reservation.from_passenger_info("George", "Bush", "ABC123")
-        assert r.check_in_times == ['2099-08-21T07:35:05-05:00', '2099-08-17T18:50:05-05:00']
+        assert r.check_in_times == ['2099-08-21T07:35:00-05:00', '2099-08-17T18:50:00-05:00']
+
+    def test_from_passenger_info_rate_limited(self):
+        errors = ErrorInjector(rate=1, statuses=[429])
+        with FakeSouthwestServer(errors=errors) as server, mock.patch('swa.API_URL', server.url):
+            with self.assertRaises(exceptions.SouthwestAPIError) as e:
+                swa.Reservation.from_passenger_info("George", "Bush", "ABC123")
+
+        assert e.exception.status_code == 429
+        assert swa.classify_error(e.exception) == swa.TRANSIENT
 
     @v.use_cassette('view_reservation_active.yml', filter_headers=['X-API-Key'])
     def test_check_in_times_no_expired(self):
         # this fixture contains one flight which has already occurred
         r = swa.Reservation.from_passenger_info("George", "Bush", "ABC123")
-        assert r.check_in_times == ['2099-08-21T07:35:05-05:00']
+        assert r.check_in_times == ['2099-08-21T07:35:00-05:00']
 
     @v.use_cassette('view_reservation_active.yml', filter_headers=['X-API-Key'])
     def test_get_check_in_times_with_expired(self):
         # this fixture contains one flight which has already occurred
         r = swa.Reservation.from_passenger_info("George", "Bush", "ABC123")
-        assert r.get_check_in_times(expired=True) == ['2099-08-21T07:35:05-05:00', '1999-08-17T18:50:05-05:00']
+        assert r.get_check_in_times(expired=True) == ['2099-08-21T07:35:00-05:00', '1999-08-17T18:50:00-05:00']
 
     @v.use_cassette('view_reservation.yml', filter_headers=['X-API-Key'])
     def test_check_in_times_alternate_second(self):
@@ -106,3 +318,20 @@ class TestReservation(unittest.TestCase):
     def test_confirmation_number(self):
         r = swa.Reservation.from_passenger_info("George", "Bush", "ABC123")
         assert r.confirmation_number == "ABC123"
+
+
+class TestFakeSouthwest(unittest.TestCase):
+
+    def test_parse_latency(self):
+        assert parse_latency("50")() == 0.05
+        assert 0.01 <= parse_latency("uniform:10:20")() <= 0.02
+        assert parse_latency("lognormal:50:0")() == 0.05
+        for spec in ("fast", "uniform:10", "gaussian:1:2"):
+            with self.assertRaises(ValueError):
+                parse_latency(spec)
+
+    def test_error_bursts(self):
+        errors = ErrorInjector(rate=1, statuses=[502], burst=3, paths=[CHECK_IN_PATH])
+        assert errors(VIEW_RESERVATION_PATH) is None
+        assert [errors(CHECK_IN_PATH) for _ in range(3)] == [502, 502, 502]
+        assert errors.injected == {502: 3}
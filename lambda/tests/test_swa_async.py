@@ -0,0 +1,65 @@
+import time
+import unittest
+
+import mock
+
+import util
+
+import exceptions, swa, swa_async
+from fake_southwest import FakeSouthwestServer
+
+
+class TestAsyncClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeSouthwestServer().start()
+        self.patcher = mock.patch('swa.API_URL', self.server.url)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.server.stop()
+
+    def test_from_passenger_info(self):
+        r = swa_async.run(swa_async.Reservation.from_passenger_info("George", "Bush", "ABC123"))
+        assert isinstance(r, swa.Reservation)
+        assert r.confirmation_number == "ABC123"
+        assert len(r.get_check_in_times(expired=True)) == 2
+
+    def test_check_in(self):
+        result = swa_async.run(swa_async.check_in("George", "Bush", "ABC123"))
+        assert result['checkInConfirmationPage']['title']['key'] == "CHECKIN__YOURE_CHECKEDIN"
+
+    def test_check_in_all(self):
+        check_ins = [
+            dict(first_name="George", last_name="Bush", confirmation_number="ABC123"),
+            dict(first_name="George", last_name="Bush", confirmation_number="XYZ789"),
+            dict(first_name="George", last_name="Bush", confirmation_number="ABC123"),
+        ]
+        results = swa_async.run(swa_async.check_in_all(check_ins, concurrency=2))
+
+        assert results[0]['checkInConfirmationPage']['title']['key'] == "CHECKIN__YOURE_CHECKEDIN"
+        assert isinstance(results[1], exceptions.ReservationNotFoundError)
+        assert results[2]['checkInConfirmationPage']['title']['key'] == "CHECKIN__YOURE_CHECKEDIN"
+
+    def test_check_in_all_fires_together(self):
+        # More check-ins than may be sent at once, all due at the same time
+        self.server.httpd.latency = 0.2
+        at = time.time() + 0.5
+        sent = []
+        check_ins = [
+            dict(first_name="George", last_name="Bush", confirmation_number="ABC123", at=at) for _ in range(6)
+        ]
+        post = swa._post_check_in
+        with mock.patch('swa.get_fire_time', lambda at: at), \
+                mock.patch('swa._post_check_in', side_effect=lambda *a: sent.append(time.time()) or post(*a)):
+            results = swa_async.run(swa_async.check_in_all(check_ins, concurrency=2))
+
+        assert all(r['checkInConfirmationPage']['title']['key'] == "CHECKIN__YOURE_CHECKEDIN" for r in results)
+        sent.sort()
+        assert len(sent) == 6
+        assert sent[0] >= at
+        # The first two go at once, and the rest follow as each one returns
+        # rather than each waiting out its own preparation first
+        assert sent[1] - at < 0.1
+        assert sent[-1] - at < 0.6
@@ -0,0 +1,52 @@
+import datetime
+import unittest
+
+import pendulum
+
+import util
+
+import timeutil
+
+TIMESTAMPS = [
+    "2017-02-09T07:50:00.000-06:00",
+    "2099-08-21T07:35:05-05:00",
+    "2099-08-21T12:05:00+05:30",
+    "2099-08-21T00:00:00-05:00",
+    "2017-05-25T15:26:36.313Z",
+    "2017-05-25T15:26:36.313456+00:00",
+    "2017-09-21T07:25:00",
+]
+
+
+class TestTimeutil(unittest.TestCase):
+
+    def test_parse_matches_pendulum(self):
+        for t in TIMESTAMPS:
+            expected = pendulum.parse(t)
+            result = timeutil.parse(t)
+            assert result == expected, t
+            assert result.utcoffset() == expected.utcoffset(), t
+            assert result.isoformat() == str(expected), t
+
+    def test_parse_slow_matches_pendulum(self):
+        # The fallback used where datetime.fromisoformat is unavailable
+        for t in TIMESTAMPS:
+            assert timeutil._parse_slow(t).isoformat() == str(pendulum.parse(t)), t
+
+    def test_arithmetic_matches_pendulum(self):
+        for t in TIMESTAMPS:
+            expected = pendulum.parse(t).subtract(days=1).add(seconds=5)
+            result = timeutil.parse(t) - datetime.timedelta(days=1, seconds=-5)
+            assert result.isoformat() == str(expected), t
+
+    def test_to_day_datetime_string_matches_pendulum(self):
+        for t in TIMESTAMPS:
+            expected = pendulum.parse(t).to_day_datetime_string()
+            assert timeutil.to_day_datetime_string(timeutil.parse(t)) == expected, t
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            timeutil.parse("25DEC17")
+
+    def test_now_is_aware(self):
+        assert timeutil.now().tzinfo is not None
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+# This script summarizes a check-in history (see lambda/src/history.py): how
+# late check-ins reached Southwest, the boarding positions that got them, and
+# how many check-ins were scheduled for the same second
+#
+#   check-in-report.py --table sw-check-in-history
+#   # last week's check-ins, as JSON
+#   check-in-report.py --db history.db --start 2099-08-10T00:00:00Z --hours 168 --json
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+# Use the project's check-in history from the Lambda source
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda', 'src'))
+import history  # NOQA
+import timeutil  # NOQA
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, p):
+    # Nearest-rank percentile of a sorted list
+    return values[max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)]
+
+
+def count(values):
+    counts = {}
+    for value in values:
+        counts[value] = counts.get(value, 0) + 1
+    return counts
+
+
+def summarize_lateness(outcomes):
+    late = sorted(o['lateness'] * 1000 for o in outcomes if o['lateness'] is not None)
+    if not late:
+        return {'count': 0}
+
+    summary = {'count': len(late)}
+    for p in PERCENTILES:
+        summary['p{}'.format(p)] = round(percentile(late, p), 1)
+    summary['max'] = round(late[-1], 1)
+    return summary
+
+
+def position_by_lateness(outcomes, buckets):
+    # Boarding positions for check-ins grouped by how late they were, in
+    # milliseconds, into [0, buckets[0]), [buckets[0], buckets[1]) and so on
+    edges = [0] + buckets + [float("inf")]
+    groups = [[] for _ in buckets + [None]]
+    for o in outcomes:
+        if o['lateness'] is None or o['boarding_position'] is None:
+            continue
+        late = max(o['lateness'] * 1000, 0)
+        for i in range(len(groups)):
+            if edges[i] <= late < edges[i + 1]:
+                groups[i].append(o['boarding_position'])
+                break
+
+    report = []
+    for i, positions in enumerate(groups):
+        upper = edges[i + 1] if i < len(buckets) else ""
+        row = {'lateness_ms': "{}-{}".format(edges[i], upper), 'count': len(positions)}
+        if positions:
+            positions.sort()
+            row.update(best=positions[0], median=percentile(positions, 50), worst=positions[-1])
+        report.append(row)
+    return report
+
+
+def density(outcomes, top):
+    # How many check-ins were scheduled for each second, and the busiest
+    # seconds with how late they ran
+    seconds = {}
+    for o in outcomes:
+        if o['scheduled'] is not None:
+            seconds.setdefault(int(o['scheduled']), []).append(o)
+
+    busiest = sorted(seconds.items(), key=lambda s: (-len(s[1]), s[0]))[:top]
+    return {
+        'check_ins_per_second': sorted(count(len(v) for v in seconds.values()).items()),
+        'busiest': [
+            {'time': second, 'count': len(group), 'lateness': summarize_lateness(group)}
+            for second, group in busiest
+        ]
+    }
+
+
+def main(args):
+    table, db = args.table, args.db
+    if not (table or db):
+        table, db = history.CHECK_IN_HISTORY_TABLE, history.CHECK_IN_HISTORY_DB
+
+    if table:
+        check_in_history = history.CheckInHistory(history.DynamoDBHistory(table))
+    else:
+        check_in_history = history.CheckInHistory(history.SQLiteHistory(db))
+    start = args.start.timestamp() if args.start else None
+    end = start + args.hours * 3600 if start is not None and args.hours else None
+    outcomes = check_in_history.between(start, end)
+
+    report = {
+        'check_ins': len(outcomes),
+        'outcomes': count(o['outcome'] for o in outcomes),
+        'retries': sorted(count(o['retries'] for o in outcomes if o['retries'] is not None).items()),
+        'lateness_ms': summarize_lateness(outcomes),
+        'position_by_lateness': position_by_lateness(outcomes, args.buckets),
+        'density': density(outcomes, args.top)
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print("check-ins: {}".format(report['check_ins']))
+    print("outcomes: {}".format(" ".join("{}={}".format(k, v) for k, v in sorted(report['outcomes'].items()))))
+    print("retries: {}".format(" ".join("{}={}".format(k, v) for k, v in report['retries'])))
+    print("lateness (ms): {}".format(" ".join("{}={}".format(k, v) for k, v in report['lateness_ms'].items())))
+    print()
+    print("{:<16} {:>8} {:>6} {:>8} {:>6}".format("lateness (ms)", "count", "best", "median", "worst"))
+    for row in report['position_by_lateness']:
+        print("{:<16} {:>8} {:>6} {:>8} {:>6}".format(
+            row['lateness_ms'], row['count'], row.get('best', ""), row.get('median', ""), row.get('worst', "")))
+    print()
+    print("check-ins per second: {}".format(
+        " ".join("{}:{}".format(k, v) for k, v in report['density']['check_ins_per_second'])))
+    for second in report['density']['busiest']:
+        print("  {} count={} lateness p99={}ms".format(
+            time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(second['time'])), second['count'],
+            second['lateness'].get('p99')))
+
+
+def _buckets(value):
+    return [int(v) for v in value.split(",")]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    backend = parser.add_mutually_exclusive_group(
+        required=not (history.CHECK_IN_HISTORY_TABLE or history.CHECK_IN_HISTORY_DB))
+    backend.add_argument('--table', help="DynamoDB check-in history (default: $CHECK_IN_HISTORY_TABLE)")
+    backend.add_argument('--db', help="SQLite check-in history (default: $CHECK_IN_HISTORY_DB)")
+    parser.add_argument('--start', type=timeutil.parse,
+                        help="RFC 3339 timestamp to start from (default: the whole history)")
+    parser.add_argument('--hours', type=float, help="How far past the start to look (default: everything after it)")
+    parser.add_argument('--buckets', type=_buckets, default=[250, 500, 750, 1000, 2000],
+                        help="Comma separated lateness buckets in milliseconds")
+    parser.add_argument('--top', type=int, default=5, help="How many of the busiest seconds to show")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args()
+    main(args)
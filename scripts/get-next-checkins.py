@@ -1,55 +1,166 @@
 #!/usr/bin/env python
 
 # This script outputs a list of the next scheduled checkins
-
-import asyncio
+#
+# An execution's check-in times are fixed once ScheduleCheckIns has run, so
+# they're read from the first few events of its history and then cached on
+# disk by execution ARN. Later runs only fetch history for executions which
+# have started since, and drop the ones which have finished.
+
+import argparse
+import bisect
+import concurrent.futures
+import heapq
 import json
+import os
+import sys
+import time
 
 import boto3
-import pendulum
-
-SFN = boto3.client('stepfunctions')
-
-
-def get_execution_history(execution_arn):
-    e = SFN.get_execution_history(executionArn=execution_arn)
-    return json.loads(e['events'][-1]['stateEnteredEventDetails']['input'])
-
-
-async def get_executions(args):
-    # TODO(dw): pagination for > 100 executions
-    executions = SFN.list_executions(
-        stateMachineArn=args.state_machine_arn,
-        statusFilter='RUNNING'
-    )
-
-    loop = asyncio.get_event_loop()
-    futures = [
-        loop.run_in_executor(None, get_execution_history, e['executionArn'])
-        for e in executions['executions']
+from botocore.config import Config
+
+# Use the project's time helpers from the Lambda source
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda', 'src'))
+import timeutil  # NOQA
+
+# Adaptive retries rate limit the client when Step Functions throttles it
+SFN = boto3.client('stepfunctions', config=Config(retries={'max_attempts': 10, 'mode': 'adaptive'}))
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'checkin-bot')
+CACHE_VERSION = 1
+# ScheduleCheckIns finishes within the first few events of an execution
+HISTORY_EVENTS = 10
+SCHEDULE_STATE = 'ScheduleCheckIns'
+RESERVATION_FIELDS = ('first_name', 'last_name', 'confirmation_number', 'email')
+
+
+def _find_schedule(events):
+    for e in events:
+        details = e.get('stateExitedEventDetails')
+        if details and details['name'] == SCHEDULE_STATE:
+            return json.loads(details['output'])
+        if e['type'] == 'MapStateEntered':
+            return json.loads(e['stateEnteredEventDetails']['input'])
+    return None
+
+
+def get_execution_schedule(execution_arn):
+    """
+    Returns the reservation and check-in times of an execution, or None if it
+    hasn't been scheduled yet
+    """
+    history = SFN.get_execution_history(executionArn=execution_arn, maxResults=HISTORY_EVENTS)
+    data = _find_schedule(history['events'])
+
+    if data is None:
+        # Executions from before the Map state keep their remaining check-in
+        # times in the input of the state they're in
+        history = SFN.get_execution_history(
+            executionArn=execution_arn, maxResults=HISTORY_EVENTS, reverseOrder=True
+        )
+        for e in history['events']:
+            if 'stateEnteredEventDetails' in e:
+                data = json.loads(e['stateEnteredEventDetails']['input'])
+                break
+
+    if not data or 'check_in_times' not in data:
+        return None
+
+    check_in_times = data['check_in_times']
+    if isinstance(check_in_times, dict):
+        check_in_times = [check_in_times['next']] + check_in_times.get('remaining', [])
+
+    times = sorted((timeutil.parse(t).timestamp(), t) for t in check_in_times)
+    record = {k: data.get(k) for k in RESERVATION_FIELDS}
+    record['check_in_times'] = [t for _, t in times]
+    record['timestamps'] = [ts for ts, _ in times]
+    return record
+
+
+def list_running_executions(state_machine_arn):
+    paginator = SFN.get_paginator('list_executions')
+    for page in paginator.paginate(stateMachineArn=state_machine_arn, statusFilter='RUNNING'):
+        for e in page['executions']:
+            yield e['executionArn']
+
+
+def load_cache(path, state_machine_arn):
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+    if cache.get('version') != CACHE_VERSION or cache.get('state_machine_arn') != state_machine_arn:
+        return {}
+    return cache['executions']
+
+
+def save_cache(path, state_machine_arn, executions):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'state_machine_arn': state_machine_arn, 'executions': executions}, f)
+    os.replace(tmp, path)
+
+
+def refresh(executions, state_machine_arn, workers):
+    """
+    Brings `executions` up to date with the running executions, fetching
+    schedules only for ones we haven't seen. Returns the updated dict.
+    """
+    running = set(list_running_executions(state_machine_arn))
+    current = {arn: executions[arn] for arn in running if arn in executions}
+    new = [arn for arn in running if arn not in executions]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for arn, record in zip(new, executor.map(get_execution_schedule, new)):
+            # Executions which haven't been scheduled yet are tried again next time
+            if record is not None:
+                current[arn] = record
+
+    print("{} running executions, {} fetched".format(len(running), len(new)), file=sys.stderr)
+    return current
+
+
+def next_check_ins(executions, count, reverse=False, now=None):
+    """
+    Returns the `count` executions with the soonest upcoming check-in (or
+    latest, if `reverse`)
+    """
+    now = time.time() if now is None else now
+
+    def upcoming():
+        for arn, record in executions.items():
+            i = bisect.bisect_right(record['timestamps'], now)
+            if i < len(record['timestamps']):
+                yield record['timestamps'][i], arn, record, record['check_in_times'][i]
+
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    return [
+        dict({k: v for k, v in record.items() if k != 'timestamps'}, executionArn=arn, next=next_time)
+        for _, arn, record, next_time in select(count, upcoming(), key=lambda item: item[0])
     ]
 
-    done, _ = await asyncio.wait(futures)
-    results = [r.result() for r in done]
-    sorted_results = sorted(results, key=lambda x: pendulum.parse(x['check_in_times']['next']))
-
-    if args.reverse:
-        sorted_results = list(reversed(sorted_results))
 
-    print(json.dumps(sorted_results[:args.count]))
+def main(args):
+    cache_path = args.cache or os.path.join(CACHE_DIR, args.state_machine_arn.split(':')[-1] + '.json')
 
+    executions = {} if args.no_cache else load_cache(cache_path, args.state_machine_arn)
+    executions = refresh(executions, args.state_machine_arn, args.workers)
+    if not args.no_cache:
+        save_cache(cache_path, args.state_machine_arn, executions)
 
-def main(args):
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(get_executions(args))
-    loop.close()
+    print(json.dumps(next_check_ins(executions, args.count, args.reverse)))
 
 
 if __name__ == '__main__':
-    import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('--state-machine-arn', required=True)
     parser.add_argument('--count', type=int, required=False, default=5)
     parser.add_argument('--reverse', action='store_true')
+    parser.add_argument('--workers', type=int, default=16, help="Most get_execution_history calls at once")
+    parser.add_argument('--cache', help="Where to cache execution schedules (default: {})".format(CACHE_DIR))
+    parser.add_argument('--no-cache', action='store_true', help="Fetch every execution's schedule")
     args = parser.parse_args()
     main(args)
@@ -1,15 +1,99 @@
 #!/usr/bin/env python
 
 # This script retrieves a detailed list of the currently running checkins
+#
+# Executions are printed as newline-delimited JSON as their details arrive,
+# so memory use stays flat however many there are. Details are fetched by a
+# bounded pool of workers which backs off when Step Functions throttles us.
 
 import argparse
 import concurrent.futures
 import datetime
 import json
+import os
+import sys
+import threading
+import time
 
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
-SFN = boto3.client('stepfunctions')
+# Use the project's time helpers from the Lambda source
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda', 'src'))
+import timeutil  # NOQA
+
+# Throttling is handled below rather than by botocore's retries, so that it
+# can slow down the whole pool instead of each request on its own.
+SFN = boto3.client('stepfunctions', config=Config(retries={'max_attempts': 1}))
+
+THROTTLING_ERROR_CODES = {"ThrottlingException", "Throttling", "TooManyRequestsException"}
+MAX_RETRIES = 8
+RETRY_DELAY = 0.2
+RETRY_MAX_DELAY = 5.0
+
+
+class AdaptiveLimit(object):
+    """
+    Bounds the number of requests in flight. The limit is halved whenever a
+    request is throttled, and grows by one after `limit` requests in a row
+    succeed, up to `maximum`.
+    """
+
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = maximum
+        self._in_flight = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+        return self
+
+    def __exit__(self, *args):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    def throttled(self):
+        with self._condition:
+            self.limit = max(1, self.limit // 2)
+            self._successes = 0
+
+    def succeeded(self):
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify()
+
+
+def is_throttling(e):
+    return isinstance(e, ClientError) and e.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+
+def call(limit, method, **kwargs):
+    # Calls an SFN method within the concurrency limit, backing off when throttled
+    retries = 0
+    while True:
+        with limit:
+            try:
+                result = getattr(SFN, method)(**kwargs)
+            except ClientError as e:
+                if not is_throttling(e) or retries >= MAX_RETRIES:
+                    raise
+                limit.throttled()
+            else:
+                limit.succeeded()
+                return result
+
+        time.sleep(min(RETRY_DELAY * 2 ** retries, RETRY_MAX_DELAY))
+        retries += 1
 
 
 def format_date_fields(obj):
@@ -19,36 +103,62 @@ def format_date_fields(obj):
     return obj
 
 
-def get_execution_details(execution_arn):
-    e = SFN.describe_execution(executionArn=execution_arn)
+def get_execution_details(limit, execution_arn):
+    e = call(limit, 'describe_execution', executionArn=execution_arn)
     e = format_date_fields(e)
     del e['ResponseMetadata']
     return e
 
 
+def list_executions(limit, args):
+    """
+    Yields every execution matching the filters in `args`, one page at a time
+    """
+    kwargs = dict(stateMachineArn=args.state_machine_arn, statusFilter=args.status)
+    while True:
+        page = call(limit, 'list_executions', **kwargs)
+        for e in page['executions']:
+            # Executions are listed newest first
+            if args.since and e['startDate'] < args.since:
+                return
+            if args.until and e['startDate'] >= args.until:
+                continue
+            yield e
+
+        if 'nextToken' not in page:
+            return
+        kwargs['nextToken'] = page['nextToken']
+
+
 def main(args):
-    results = []
-    state_machine_arn = args.state_machine_arn
+    limit = AdaptiveLimit(args.workers)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+        pending = set()
 
-    # TODO(dw): pagination for > 100 executions
-    executions = SFN.list_executions(
-        stateMachineArn=state_machine_arn,
-        statusFilter='RUNNING'
-    )
+        def write(done):
+            for future in done:
+                print(json.dumps(future.result()), flush=True)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-        futures = []
-        for e in executions['executions']:
-            future = executor.submit(get_execution_details, e['executionArn'])
-            futures.append(future)
-        for future in concurrent.futures.as_completed(futures):
-            results.append(future.result())
+        for e in list_executions(limit, args):
+            # Don't queue up more than a few pages of work
+            if len(pending) >= args.workers * 4:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                write(done)
+            pending.add(executor.submit(get_execution_details, limit, e['executionArn']))
 
-    print(json.dumps(results))
+        write(concurrent.futures.as_completed(pending))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--state-machine-arn', required=True)
+    parser.add_argument('--status', default='RUNNING',
+                        choices=['RUNNING', 'SUCCEEDED', 'FAILED', 'TIMED_OUT', 'ABORTED'])
+    parser.add_argument('--since', type=timeutil.parse,
+                        help="Only executions started at or after this RFC 3339 timestamp")
+    parser.add_argument('--until', type=timeutil.parse,
+                        help="Only executions started before this RFC 3339 timestamp")
+    parser.add_argument('--workers', type=int, default=8, help="Most describe_execution calls at once")
     args = parser.parse_args()
     main(args)
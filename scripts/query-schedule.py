@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+# This script answers questions about pending checkins from a schedule index
+# (see lambda/src/schedule_index.py) without looking at any executions
+#
+#   # what fires in the next hour?
+#   query-schedule.py --table sw-schedule-index --hours 1 upcoming
+#   # which seconds have more than one check-in this week?
+#   query-schedule.py --db schedule.db --hours 168 density --min-count 2
+
+import argparse
+import json
+import os
+import sys
+import time
+
+# Use the project's schedule index from the Lambda source
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda', 'src'))
+import schedule_index  # NOQA
+import timeutil  # NOQA
+
+
+def main(args):
+    table, db = args.table, args.db
+    if not (table or db):
+        table, db = schedule_index.SCHEDULE_INDEX_TABLE, schedule_index.SCHEDULE_INDEX_DB
+
+    if table:
+        index = schedule_index.ScheduleIndex(schedule_index.DynamoDBIndex(table))
+    else:
+        index = schedule_index.ScheduleIndex(schedule_index.SQLiteIndex(db))
+    start = args.start.timestamp() if args.start else time.time()
+    end = start + args.hours * 3600
+
+    if args.command == 'upcoming':
+        for entry in index.between(start, end, limit=args.limit):
+            print(json.dumps(entry))
+    else:
+        for second, count in index.density(start, end, min_count=args.min_count):
+            print(json.dumps({'time': second, 'count': count}))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    backend = parser.add_mutually_exclusive_group(
+        required=not (schedule_index.SCHEDULE_INDEX_TABLE or schedule_index.SCHEDULE_INDEX_DB))
+    backend.add_argument('--table', help="DynamoDB schedule index (default: $SCHEDULE_INDEX_TABLE)")
+    backend.add_argument('--db', help="SQLite schedule index (default: $SCHEDULE_INDEX_DB)")
+    parser.add_argument('--start', type=timeutil.parse, help="RFC 3339 timestamp to start from (default: now)")
+    parser.add_argument('--hours', type=float, default=1, help="How far past the start to look")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    upcoming = subparsers.add_parser('upcoming', help="List check-ins, soonest first")
+    upcoming.add_argument('--limit', type=int)
+
+    density = subparsers.add_parser('density', help="Count check-ins landing in the same second")
+    density.add_argument('--min-count', type=int, default=2)
+
+    args = parser.parse_args()
+    main(args)
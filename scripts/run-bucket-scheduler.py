@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+# This script checks in the pending checkins recorded in a schedule index
+# (see lambda/src/schedule_index.py), firing one batch check-in for every
+# second with check-ins due rather than one per reservation. It runs until
+# every check-in in the window has fired, then prints each bucket's results.
+#
+# The state machine's executions check in the same reservations unless
+# they're scheduled in bucket mode (`check_in_mode = "buckets"` in
+# terraform), so this refuses to run unless CHECK_IN_MODE=buckets is set here
+# too. Against a local index, e.g. one filled by the simulator:
+#
+#   CHECK_IN_MODE=buckets SCHEDULE_INDEX_DB=schedule.db run-bucket-scheduler.py --hours 24
+
+import argparse
+import json
+import os
+import sys
+import time
+
+# Use the project's scheduler from the Lambda source
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda', 'src'))
+import bucket_scheduler  # NOQA
+import schedule_index  # NOQA
+
+
+def main(args):
+    index = schedule_index.get_schedule_index()
+    scheduler = bucket_scheduler.Scheduler(max_workers=args.workers)
+
+    now = time.time()
+    for entry in index.between(now, now + args.hours * 3600):
+        scheduler.add({
+            'first_name': entry['first_name'],
+            'last_name': entry['last_name'],
+            'confirmation_number': entry['confirmation_number'],
+            'email': entry['email'],
+            'time': entry['check_in_time']
+        })
+
+    print("Scheduled {} buckets".format(len(scheduler)), file=sys.stderr)
+    for bucket, results in scheduler.run():
+        print(json.dumps({'time': bucket.time, 'results': results}, default=str), flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hours', type=float, default=24, help="Check in everything due in this many hours")
+    parser.add_argument('--workers', type=int, default=bucket_scheduler.MAX_BUCKET_WORKERS,
+                        help="Most buckets being checked in at once")
+    args = parser.parse_args()
+    if not (schedule_index.SCHEDULE_INDEX_TABLE or schedule_index.SCHEDULE_INDEX_DB):
+        parser.error("SCHEDULE_INDEX_TABLE or SCHEDULE_INDEX_DB must be set")
+    if schedule_index.CHECK_IN_MODE != schedule_index.BUCKETS:
+        parser.error("CHECK_IN_MODE must be {}, or the state machine checks in the same reservations".format(
+            schedule_index.BUCKETS))
+    main(args)
@@ -0,0 +1,82 @@
+resource "aws_dynamodb_table" "reservation_cache" {
+  name         = "sw-reservation-cache"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "key"
+
+  attribute {
+    name = "key"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
+resource "aws_dynamodb_table" "idempotency" {
+  name         = "sw-idempotency"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "key"
+
+  attribute {
+    name = "key"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
+resource "aws_dynamodb_table" "schedule_index" {
+  name         = "sw-schedule-index"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "confirmation_number"
+  range_key    = "time"
+
+  attribute {
+    name = "confirmation_number"
+    type = "S"
+  }
+
+  attribute {
+    name = "time"
+    type = "N"
+  }
+
+  attribute {
+    name = "day"
+    type = "N"
+  }
+
+  global_secondary_index {
+    name            = "by_day"
+    hash_key        = "day"
+    range_key       = "time"
+    projection_type = "ALL"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
+resource "aws_dynamodb_table" "check_in_history" {
+  name         = "sw-check-in-history"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "day"
+  range_key    = "id"
+
+  attribute {
+    name = "day"
+    type = "N"
+  }
+
+  attribute {
+    name = "id"
+    type = "S"
+  }
+}
@@ -58,13 +58,58 @@ resource "aws_iam_role_policy" "lambda" {
       ],
       "Resource": "${aws_sfn_state_machine.check_in.id}"
     },
+    {
+      "Effect": "Allow",
+      "Action": [
+        "states:DescribeExecution"
+      ],
+      "Resource": "${replace(aws_sfn_state_machine.check_in.id, ":stateMachine:", ":execution:")}:*"
+    },
     {
       "Effect": "Allow",
       "Action": [
         "ses:SendEmail",
-        "ses:SendRawEmail"
+        "ses:SendRawEmail",
+        "ses:SendTemplatedEmail",
+        "ses:SendBulkTemplatedEmail"
       ],
       "Resource": "*"
+    },
+    {
+      "Effect": "Allow",
+      "Action": [
+        "dynamodb:GetItem",
+        "dynamodb:PutItem"
+      ],
+      "Resource": "${aws_dynamodb_table.reservation_cache.arn}"
+    },
+    {
+      "Effect": "Allow",
+      "Action": [
+        "dynamodb:GetItem",
+        "dynamodb:PutItem",
+        "dynamodb:DeleteItem"
+      ],
+      "Resource": "${aws_dynamodb_table.idempotency.arn}"
+    },
+    {
+      "Effect": "Allow",
+      "Action": [
+        "dynamodb:PutItem",
+        "dynamodb:DeleteItem",
+        "dynamodb:Query"
+      ],
+      "Resource": [
+        "${aws_dynamodb_table.schedule_index.arn}",
+        "${aws_dynamodb_table.schedule_index.arn}/index/*"
+      ]
+    },
+    {
+      "Effect": "Allow",
+      "Action": [
+        "dynamodb:PutItem"
+      ],
+      "Resource": "${aws_dynamodb_table.check_in_history.arn}"
     }
   ]
 }
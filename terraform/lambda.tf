@@ -10,6 +10,12 @@ data "archive_file" "src" {
   output_path = "${path.module}/build/src.zip"
 }
 
+locals {
+  # Seconds the check-in function may run, which includes waiting for the
+  # exact check-in time after the state machine's Wait ends
+  check_in_timeout = 30
+}
+
 resource "aws_lambda_layer_version" "deps" {
   description         = "Bundled dependencies for Checkin Bot"
   filename            = data.archive_file.vendor.output_path
@@ -21,19 +27,21 @@ resource "aws_lambda_function" "sw_receive_email" {
   filename         = data.archive_file.src.output_path
   function_name    = "sw-receive-email"
   role             = aws_iam_role.lambda.arn
-  handler          = "handlers.receive_email"
+  handler          = "handlers.receive_email.main"
   runtime          = "python3.6"
-  timeout          = 10
+  timeout          = 30
   source_code_hash = data.archive_file.src.output_base64sha256
   layers           = [aws_lambda_layer_version.deps.arn]
 
   environment {
     variables = {
-      S3_BUCKET_NAME    = aws_s3_bucket.email.id
-      STATE_MACHINE_ARN = aws_sfn_state_machine.check_in.id
-      EMAIL_SOURCE      = "\"Checkin Bot\" <no-reply@${var.domains[0]}>"
-      EMAIL_BCC         = var.admin_email
-      EMAIL_FEEDBACK    = var.feedback_email
+      S3_BUCKET_NAME          = aws_s3_bucket.email.id
+      STATE_MACHINE_ARN       = aws_sfn_state_machine.check_in.id
+      EMAIL_SOURCE            = "\"Checkin Bot\" <no-reply@${var.domains[0]}>"
+      EMAIL_BCC               = var.admin_email
+      EMAIL_FEEDBACK          = var.feedback_email
+      IDEMPOTENCY_TABLE       = aws_dynamodb_table.idempotency.name
+      RESERVATION_CACHE_TABLE = aws_dynamodb_table.reservation_cache.name
     }
   }
 }
@@ -42,7 +50,7 @@ resource "aws_lambda_function" "sw_schedule_check_in" {
   filename         = data.archive_file.src.output_path
   function_name    = "sw-schedule-check-in"
   role             = aws_iam_role.lambda.arn
-  handler          = "handlers.schedule_check_in"
+  handler          = "handlers.schedule_check_in.main"
   runtime          = "python3.6"
   timeout          = 10
   source_code_hash = data.archive_file.src.output_base64sha256
@@ -50,9 +58,12 @@ resource "aws_lambda_function" "sw_schedule_check_in" {
 
   environment {
     variables = {
-      EMAIL_SOURCE   = "\"Checkin Bot\" <no-reply@${var.domains[0]}>"
-      EMAIL_BCC      = var.admin_email
-      EMAIL_FEEDBACK = var.feedback_email
+      EMAIL_SOURCE            = "\"Checkin Bot\" <no-reply@${var.domains[0]}>"
+      EMAIL_BCC               = var.admin_email
+      EMAIL_FEEDBACK          = var.feedback_email
+      RESERVATION_CACHE_TABLE = aws_dynamodb_table.reservation_cache.name
+      SCHEDULE_INDEX_TABLE    = aws_dynamodb_table.schedule_index.name
+      CHECK_IN_MODE           = var.check_in_mode
     }
   }
 }
@@ -61,9 +72,9 @@ resource "aws_lambda_function" "sw_check_in" {
   filename         = data.archive_file.src.output_path
   function_name    = "sw-check-in"
   role             = aws_iam_role.lambda.arn
-  handler          = "handlers.check_in"
+  handler          = "handlers.check_in.main"
   runtime          = "python3.6"
-  timeout          = 30
+  timeout          = local.check_in_timeout
   source_code_hash = data.archive_file.src.output_base64sha256
   layers           = [aws_lambda_layer_version.deps.arn]
 
@@ -72,15 +83,23 @@ resource "aws_lambda_function" "sw_check_in" {
       EMAIL_SOURCE   = "\"Checkin Bot\" <no-reply@${var.domains[0]}>"
       EMAIL_BCC      = var.admin_email
       EMAIL_FEEDBACK = var.feedback_email
+      # Send batches of success emails with the SES copies of the templates
+      SES_TEMPLATE_PREFIX    = local.email_template_prefix
+      SCHEDULE_INDEX_TABLE   = aws_dynamodb_table.schedule_index.name
+      CHECK_IN_HISTORY_TABLE = aws_dynamodb_table.check_in_history.name
+      # The handler fits its wait for the check-in time into what's left of this
+      LAMBDA_TIMEOUT = local.check_in_timeout
     }
   }
+
+  depends_on = [aws_ses_template.notifications]
 }
 
 resource "aws_lambda_function" "sw_check_in_failure" {
   filename         = data.archive_file.src.output_path
   function_name    = "sw-check-in-failure"
   role             = aws_iam_role.lambda.arn
-  handler          = "handlers.check_in_failure"
+  handler          = "handlers.check_in_failure.main"
   runtime          = "python3.6"
   timeout          = 10
   source_code_hash = data.archive_file.src.output_base64sha256
@@ -88,9 +107,10 @@ resource "aws_lambda_function" "sw_check_in_failure" {
 
   environment {
     variables = {
-      EMAIL_SOURCE   = "\"Checkin Bot\" <no-reply@${var.domains[0]}>"
-      EMAIL_BCC      = var.admin_email
-      EMAIL_FEEDBACK = var.feedback_email
+      EMAIL_SOURCE         = "\"Checkin Bot\" <no-reply@${var.domains[0]}>"
+      EMAIL_BCC            = var.admin_email
+      EMAIL_FEEDBACK       = var.feedback_email
+      SCHEDULE_INDEX_TABLE = aws_dynamodb_table.schedule_index.name
     }
   }
 }
@@ -54,3 +54,23 @@ resource "aws_ses_receipt_rule" "store" {
   }
 }
 
+
+# Notification templates, shared with the Lambda functions which render them
+# locally (see lambda/src/notifications.py). Each file holds the subject, a
+# blank line, then the text body.
+locals {
+  email_template_prefix = "checkin-bot-"
+  email_template_dir    = "${path.module}/../lambda/src/templates"
+  email_templates = {
+    for f in fileset(local.email_template_dir, "*.txt") :
+    trimsuffix(f, ".txt") => split("\n\n", file("${local.email_template_dir}/${f}"))
+  }
+}
+
+resource "aws_ses_template" "notifications" {
+  for_each = local.email_templates
+
+  name    = "${local.email_template_prefix}${each.key}"
+  subject = each.value[0]
+  text    = chomp(join("\n\n", slice(each.value, 1, length(each.value))))
+}
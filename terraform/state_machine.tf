@@ -14,24 +14,31 @@ resource "aws_sfn_state_machine" "check_in" {
     },
     "MapCheckIns": {
       "Type": "Map",
-      "ItemsPath": "$.check_in_times",
+      "ItemsPath": "$.check_in_schedule",
       "MaxConcurrency": 0,
+      "Comment": "Each check-in gets the reservation fields it needs and its own times, see lambda/src/events.py",
       "Parameters": {
-        "time.$": "$$.Map.Item.Value",
-        "data.$": "$"
+        "version.$": "$.version",
+        "first_name.$": "$.first_name",
+        "last_name.$": "$.last_name",
+        "confirmation_number.$": "$.confirmation_number",
+        "email.$": "$.email",
+        "time.$": "$$.Map.Item.Value.time",
+        "wait_until.$": "$$.Map.Item.Value.wait_until",
+        "execution.$": "$$.Execution.Id"
       },
       "Iterator": {
         "StartAt": "WaitUntilCheckIn",
         "States": {
           "WaitUntilCheckIn": {
+            "Comment": "Ends a few seconds early; the check-in Lambda waits out the rest",
             "Type": "Wait",
-            "TimestampPath": "$.time",
+            "TimestampPath": "$.wait_until",
             "Next": "CheckIn"
           },
           "CheckIn": {
             "Type": "Task",
             "Resource": "${aws_lambda_function.sw_check_in.arn}",
-            "InputPath": "$.data",
             "Retry": [
               {
                 "ErrorEquals": ["SouthwestAPIError"],
@@ -52,7 +59,6 @@ resource "aws_sfn_state_machine" "check_in" {
           "SendFailureNotification": {
             "Type": "Task",
             "Resource": "${aws_lambda_function.sw_check_in_failure.arn}",
-            "InputPath": "$.data",
             "End": true
           },
           "Fail": {
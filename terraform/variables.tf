@@ -17,3 +17,7 @@ variable "feedback_email" {
   default     = ""
 }
 
+variable "check_in_mode" {
+  description = "What checks in scheduled reservations: `executions` (the state machine) or `buckets` (scripts/run-bucket-scheduler.py, reading the schedule index). Switch once running executions have finished."
+  default     = "executions"
+}